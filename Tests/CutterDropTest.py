@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+sys.path.insert(0,'.')
+
+import math
+import random
+
+from pycam.Geometry.Point import Point
+from pycam.Geometry.Triangle import Triangle
+from pycam.Geometry.utils import INFINITE
+from pycam.Cutters.CylindricalCutter import CylindricalCutter
+from pycam.Cutters.SphericalCutter import SphericalCutter
+from pycam.Cutters.ToroidalCutter import ToroidalCutter
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+
+# the sampled surface is slightly lower than the exact drop height
+SAMPLING_TOLERANCE = 0.01
+BATCH_TOLERANCE = 1e-9
+
+def get_profile_height(cutter, distance_sq):
+    """ the height of the lower surface of the expanded cutter """
+    allowance = cutter.required_distance
+    if isinstance(cutter, ToroidalCutter):
+        outside = max(0, math.sqrt(distance_sq) - cutter.majorradius)
+        return cutter.minorradius - math.sqrt(max(0,
+                (cutter.minorradius + allowance) ** 2 - outside ** 2))
+    elif isinstance(cutter, SphericalCutter):
+        return cutter.radius - math.sqrt(max(0,
+                (cutter.radius + allowance) ** 2 - distance_sq))
+    else:
+        return -allowance
+
+def get_sampled_drop(cutter, x, y, triangle, count=60):
+    """ return the highest cutter location touching samples of the triangle """
+    p1, p2, p3 = triangle.p1, triangle.p2, triangle.p3
+    samples = []
+    for i in range(count + 1):
+        for j in range(count + 1 - i):
+            u, v = float(i) / count, float(j) / count
+            samples.append(p1.add(p2.sub(p1).mul(u)).add(p3.sub(p1).mul(v)))
+    for q1, q2 in ((p1, p2), (p2, p3), (p3, p1)):
+        for i in range(20 * count + 1):
+            samples.append(q1.add(q2.sub(q1).mul(float(i) / (20 * count))))
+    height = -INFINITE
+    for point in samples:
+        distance_sq = (point.x - x) ** 2 + (point.y - y) ** 2
+        if distance_sq <= cutter.distance_radiussq:
+            height = max(height,
+                    point.z - get_profile_height(cutter, distance_sq))
+    return height
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    failed = False
+    for cutter in (CylindricalCutter(1.0), SphericalCutter(1.0),
+            ToroidalCutter(1.0, 0.25)):
+        for allowance in (0, 0.3):
+            cutter.set_required_distance(allowance)
+            worst_sampled = 0
+            worst_batch = 0
+            for index in range(40):
+                triangle = Triangle(*[Point(random.uniform(-2, 2),
+                        random.uniform(-2, 2), random.uniform(-1, 1))
+                        for corner in range(3)])
+                x, y = random.uniform(-1.5, 1.5), random.uniform(-1.5, 1.5)
+                cut = cutter.drop(triangle, start=Point(x, y, 10))
+                if cut is None:
+                    height = -INFINITE
+                else:
+                    height = cut.z
+                sampled = get_sampled_drop(cutter, x, y, triangle)
+                if (height <= -INFINITE) or (sampled <= -INFINITE):
+                    if height != sampled:
+                        worst_sampled = INFINITE
+                # the exact drop can't be lower than the sampled one
+                elif (sampled - height > BATCH_TOLERANCE) \
+                        or (height - sampled > SAMPLING_TOLERANCE):
+                    worst_sampled = max(worst_sampled, abs(height - sampled))
+                if numpy_enabled:
+                    corners = [[(p.x, p.y, p.z) for p in (triangle.p1,
+                            triangle.p2, triangle.p3)]]
+                    batch = cutter.drop_many(numpy.array([x]),
+                            numpy.array([y]), numpy.array(corners))[0]
+                    worst_batch = max(worst_batch, abs(batch - height))
+            if (worst_sampled > 0) or (worst_batch > BATCH_TOLERANCE):
+                result = "FAILED"
+                failed = True
+            else:
+                result = "OK"
+            print "%s (allowance %g): sampled %g, batch %g - %s" % (cutter,
+                    allowance, worst_sampled, worst_batch, result)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import time
+import random
+sys.path.insert(0,'.')
+
+from pycam.Geometry.TriangleKdtree import TriangleKdtree, FlatTriangleKdtree
+from pycam.Importers import STLImporter
+
+
+if len(sys.argv) > 1:
+    filenames = sys.argv[1:]
+else:
+    filenames = ["samples/SampleScene.stl", "samples/SampleScene2.stl",
+            "samples/pycam-textbox.stl"]
+
+QUERIES = 2000
+
+for filename in filenames:
+    model = STLImporter.ImportModel(filename, use_kdtree=False)
+    # subdivide small models to get a reasonable number of triangles
+    while len(model) < 20000:
+        model = model.subdivide(1)
+    triangles = model.triangles()
+    print "# %s: %d triangles" % (filename, len(triangles))
+
+    start = time.time()
+    tree = TriangleKdtree(triangles)
+    print "# build TriangleKdtree:     %.3fs" % (time.time() - start)
+    start = time.time()
+    flat_tree = FlatTriangleKdtree([(t.minx, t.maxx, t.miny, t.maxy)
+            for t in triangles], triangles)
+    print "# build FlatTriangleKdtree: %.3fs" % (time.time() - start)
+
+    size = max(model.maxx - model.minx, model.maxy - model.miny)
+    for width in (0.002 * size, 0.05 * size):
+        print "# queries with a width of %g" % width
+        boxes = []
+        for index in range(QUERIES):
+            x = random.uniform(model.minx, model.maxx)
+            y = random.uniform(model.miny, model.maxy)
+            boxes.append((x - width, x + width, y - width, y + width))
+
+        start = time.time()
+        expected = [tree.Search(*box) for box in boxes]
+        print "# query TriangleKdtree:     %.3fs" % (time.time() - start)
+        start = time.time()
+        results = [flat_tree.Search(*box) for box in boxes]
+        print "# query FlatTriangleKdtree: %.3fs" % (time.time() - start)
+        start = time.time()
+        batch_results = flat_tree.search_many(boxes)
+        print "# batch FlatTriangleKdtree: %.3fs" % (time.time() - start)
+
+        for one_expected, one_result, one_batch in zip(expected, results,
+                batch_results):
+            one_expected = set([id(t) for t in one_expected])
+            if (one_expected != set([id(t) for t in one_result])) \
+                    or (one_expected != set([id(t) for t in one_batch])):
+                print "# ERROR: the results of the trees differ"
+                sys.exit(1)
+        print "# hits=%d / queries=%d" % (sum([len(r) for r in results]),
+                QUERIES)
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+sys.path.insert(0,'.')
+
+import math
+
+import numpy
+
+from pycam.Simulation.HeightField import HeightFieldSimulation
+from pycam.Geometry.Point import Point
+from pycam.Cutters.CylindricalCutter import CylindricalCutter
+from pycam.Cutters.SphericalCutter import SphericalCutter
+from pycam.Cutters.ToroidalCutter import ToroidalCutter
+
+from TestUtils import check, exit_on_failures
+
+
+BOUNDS = (-3, 3, -3, 3, 0, 5)
+STEPS = 60
+# a straight move is exact for every cell - except for rounding errors
+TOLERANCE = 1e-9
+
+def get_profile_heights(cutter, distances):
+    """ the analytic height of the cutter's surface above its tip
+
+    Positions outside of the cutter are marked by infinity.
+    """
+    radius = cutter.radius
+    if isinstance(cutter, ToroidalCutter):
+        minor = cutter.minorradius
+        rest = numpy.maximum(0, distances - (radius - minor))
+        heights = minor - numpy.sqrt(numpy.maximum(0, minor ** 2 - rest ** 2))
+    elif isinstance(cutter, SphericalCutter):
+        heights = radius - numpy.sqrt(numpy.maximum(0,
+                radius ** 2 - distances ** 2))
+    else:
+        heights = numpy.zeros(distances.shape)
+    heights[distances > radius] = numpy.inf
+    return heights
+
+def get_expected_heights(simulation, cutter, get_locations):
+    """ calculate the lowest cut of the tool for every cell
+
+    @value get_locations: returns the relevant locations of the tool (an
+        array of shape (N, 3)) for the center of a cell
+    """
+    minx, maxx, miny, maxy, minz, maxz = BOUNDS
+    heights = numpy.empty((simulation.x_steps, simulation.y_steps))
+    for x_index, x in enumerate(simulation.x_values):
+        for y_index, y in enumerate(simulation.y_values):
+            locations = get_locations(x, y)
+            distances = numpy.sqrt((locations[:, 0] - x) ** 2 \
+                    + (locations[:, 1] - y) ** 2)
+            cut = (locations[:, 2] + get_profile_heights(cutter,
+                    distances)).min()
+            heights[x_index, y_index] = min(maxz, max(minz, cut))
+    return heights
+
+def get_closest_location((x1, y1, z), (x2, y2, z2), x, y):
+    """ return the location along a horizontal move being closest to a cell
+
+    The height of the cutter's surface grows with the distance from its axis.
+    Thus the closest location cuts deepest.
+    """
+    length_sq = (x2 - x1) ** 2 + (y2 - y1) ** 2
+    factor = ((x - x1) * (x2 - x1) + (y - y1) * (y2 - y1)) / length_sq
+    factor = min(1, max(0, factor))
+    return numpy.array([(x1 + factor * (x2 - x1), y1 + factor * (y2 - y1), z)])
+
+
+if __name__ == "__main__":
+    cell_size = (BOUNDS[1] - BOUNDS[0]) / float(STEPS)
+    for cutter in (CylindricalCutter(1.0), SphericalCutter(1.0),
+            ToroidalCutter(1.0, 0.3)):
+        name = cutter.__class__.__name__
+        # plunge
+        simulation = HeightFieldSimulation(cutter, BOUNDS, STEPS, STEPS)
+        simulation.process_cutter_movement(Point(0.1, -0.2, 5),
+                Point(0.1, -0.2, 1))
+        expected = get_expected_heights(simulation, cutter,
+                lambda x, y: numpy.array([(0.1, -0.2, 1)]))
+        error = abs(simulation.get_height_field()[2] - expected).max()
+        check(error < TOLERANCE, "%s: plunge (error %g)" % (name, error))
+        # horizontal move (partially below the bottom of the stock)
+        simulation = HeightFieldSimulation(cutter, BOUNDS, STEPS, STEPS)
+        start, end = (-1.5, -1, 0.2), (1.5, 0.5, 0.2)
+        simulation.process_moves([(Point(*start), False),
+                (Point(*end), False)])
+        expected = get_expected_heights(simulation, cutter,
+                lambda x, y: get_closest_location(start, end, x, y))
+        error = abs(simulation.get_height_field()[2] - expected).max()
+        check(error < TOLERANCE, "%s: horizontal move (error %g)" \
+                % (name, error))
+        # sloped move: split into pieces with a height difference of one cell
+        simulation = HeightFieldSimulation(cutter, BOUNDS, STEPS, STEPS)
+        start, end = (-1.5, 0, 1), (1.5, 0, 3)
+        simulation.process_cutter_movement(Point(*start), Point(*end))
+        factors = numpy.linspace(0, 1, 3001)[:, numpy.newaxis]
+        locations = numpy.array(start) \
+                + factors * (numpy.array(end) - numpy.array(start))
+        expected = get_expected_heights(simulation, cutter,
+                lambda x, y: locations)
+        error = abs(simulation.get_height_field()[2] - expected).max()
+        check(error < cell_size + TOLERANCE, "%s: sloped move (error %g)" \
+                % (name, error))
+        # removed volume of the flat cutter: a cylinder
+        if isinstance(cutter, CylindricalCutter):
+            simulation = HeightFieldSimulation(cutter, BOUNDS, STEPS, STEPS)
+            simulation.process_cutter_movement(Point(0, 0, 5), Point(0, 0, 3))
+            volume = math.pi * cutter.radius ** 2 * 2
+            error = abs(simulation.get_removed_volume() - volume) / volume
+            check(error < 0.01, "%s: removed volume (error %.2f%%)" \
+                    % (name, 100 * error))
+    exit_on_failures()
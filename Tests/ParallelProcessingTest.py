@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+sys.path.insert(0,'.')
+
+import time
+
+import pycam.Utils.threading
+from pycam.Utils.threading import run_in_parallel, init_threading, \
+        _get_chunk_size, MAX_CHUNK_SIZE
+
+from TestUtils import check, exit_on_failures
+
+
+# the number of items of each job - more than a single chunk
+ITEM_COUNT = 500
+
+# The functions need to be at the top level - otherwise they can't be
+# transferred to the workers.
+def square((index, delay)):
+    if delay:
+        time.sleep(delay)
+    return index * index
+
+def get_args(slow_items=0):
+    """ the first "slow_items" items take longer than the others """
+    return [(index, 0.05 if index < slow_items else 0)
+            for index in range(ITEM_COUNT)]
+
+def check_jobs(description):
+    expected = [index * index for index in range(ITEM_COUNT)]
+    # ordered: the results are returned in the order of the arguments
+    results = list(run_in_parallel(square, get_args()))
+    check(results == expected, "%s: ordered results" % description)
+    results = list(run_in_parallel(square, get_args(slow_items=3)))
+    check(results == expected,
+            "%s: ordered results with slow items" % description)
+    # unordered: every result is returned exactly once
+    results = list(run_in_parallel(square, get_args(slow_items=3),
+            unordered=True))
+    check(sorted(results) == expected, "%s: unordered results" % description)
+    # a job is cancelled via the callback
+    counter = [0]
+    def cancel_after_ten():
+        counter[0] += 1
+        return counter[0] > 10
+    results = list(run_in_parallel(square, get_args(),
+            callback=cancel_after_ten))
+    check(results == expected[:10], "%s: cancelled job" % description)
+    # the next job is not disturbed by the cancelled one
+    results = list(run_in_parallel(square, get_args(), unordered=True))
+    check(sorted(results) == expected,
+            "%s: job after cancellation" % description)
+
+
+if __name__ == "__main__":
+    # the chunk size adapts to the processing time of the items
+    check(_get_chunk_size(None, 1000, 2) == 1,
+            "chunk size: unknown processing time")
+    check(_get_chunk_size(10.0, 1000, 2) == 1, "chunk size: slow items")
+    check(_get_chunk_size(0.001, 1000, 2) == 250,
+            "chunk size: enough chunks for all workers")
+    check(_get_chunk_size(0.01, 100000, 2) == 30,
+            "chunk size: target processing time of a chunk")
+    check(_get_chunk_size(0, 100000, 2) == MAX_CHUNK_SIZE,
+            "chunk size: upper limit")
+    check(_get_chunk_size(0.001, 1, 4) == 1, "chunk size: lower limit")
+    init_threading(number_of_processes=0, enable_server=None)
+    check_jobs("serial")
+    if pycam.Utils.threading.is_multiprocessing_available():
+        init_threading(number_of_processes=2, enable_server=False)
+        check_jobs("local pool")
+        pycam.Utils.threading.cleanup()
+    else:
+        print "Skipping the local pool: multiprocessing is not available"
+    exit_on_failures()
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+sys.path.insert(0,'.')
+
+import random
+
+import numpy
+
+from pycam.Utils.polynomials import poly4_roots, poly4_roots_many
+
+from TestUtils import check, exit_on_failures
+
+
+RANDOM_COUNT = 1000
+# the roots of both implementations differ by rounding errors only
+ROOT_TOLERANCE = 1e-6
+# a rounding error "e" of the coefficients moves a double root by "sqrt(e)"
+DOUBLE_ROOT_TOLERANCE = 1e-3
+RESIDUAL_TOLERANCE = 1e-6
+
+# coefficients (a, b, c, d, e) with multiple roots or without real roots
+DEGENERATE = [(1, 0, 0, 0, 0), (2, 0, 0, 0, 0), (1, 0, 0, 0, -1),
+        (1, 0, 0, 0, 1), (1, 0, -2, 0, 1), (1, 0, 6, -60, 36),
+        (1, -10, 35, -50, 24), (1, -25, 235.895, -995.565, 1585.25),
+        tuple(numpy.poly([1, 1, 1, 1])), tuple(numpy.poly([1, 1, -2, -2])),
+        tuple(numpy.poly([3, 3, 3, -1])), tuple(numpy.poly([0, 0, 2, 5])),
+        tuple(numpy.poly([1e-3, 2e-3, -1e-3, 5]))]
+
+def get_value(coefficients, x):
+    a, b, c, d, e = coefficients
+    return (((a * x + b) * x + c) * x + d) * x + e
+
+def get_roots(coefficients):
+    """ return the sorted roots of both implementations """
+    single = sorted(poly4_roots(*coefficients) or [])
+    many = poly4_roots_many(*coefficients)[0]
+    return single, sorted(many[~numpy.isnan(many)])
+
+def get_random_coefficients():
+    if random.random() < 0.5:
+        # four real roots
+        roots = [random.uniform(-5, 5) for index in range(4)]
+        factor = random.choice((1, -2.5, 0.3))
+        return tuple(factor * numpy.poly(roots))
+    else:
+        return tuple([random.uniform(-10, 10) for index in range(5)])
+
+def get_residual(coefficients, roots):
+    """ return the largest value of the polynomial at the given roots
+    (relative to the largest coefficient)
+    """
+    scale = max([abs(value) for value in coefficients])
+    return max([0] + [abs(get_value(coefficients, x)) / scale for x in roots])
+
+def get_missing_roots(expected, found, tolerance):
+    return [x for x in expected
+            if not [y for y in found if abs(x - y) < tolerance]]
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    # random coefficients: all roots match
+    cases = [get_random_coefficients() for index in range(RANDOM_COUNT)]
+    results = poly4_roots_many(*numpy.array(cases).T)
+    count_errors = 0
+    worst_difference = 0
+    worst_residual = 0
+    for coefficients, many in zip(cases, results):
+        single = sorted(poly4_roots(*coefficients) or [])
+        many = sorted(many[~numpy.isnan(many)])
+        if len(single) != len(many):
+            count_errors += 1
+            continue
+        for x, y in zip(single, many):
+            worst_difference = max(worst_difference, abs(x - y))
+        worst_residual = max(worst_residual,
+                get_residual(coefficients, many)
+                - get_residual(coefficients, single))
+    check(count_errors == 0, "random: same number of roots (%d different)" \
+            % count_errors)
+    check(worst_difference < ROOT_TOLERANCE,
+            "random: same roots (difference %g)" % worst_difference)
+    check(worst_residual < RESIDUAL_TOLERANCE,
+            "random: refined roots are not worse (%g)" % worst_residual)
+    # degenerate coefficients: no root is lost
+    for coefficients in DEGENERATE:
+        single, many = get_roots(coefficients)
+        missing = get_missing_roots(single, many, DOUBLE_ROOT_TOLERANCE)
+        check(not missing, "%s: all roots found (missing: %s)" \
+                % (coefficients, missing))
+        residual = get_residual(coefficients, many)
+        check(residual < RESIDUAL_TOLERANCE, "%s: only real roots (%g)" \
+                % (coefficients, residual))
+    # a vanishing leading coefficient is not supported
+    many = poly4_roots_many(0, 1, 2, 3, 4)
+    check(numpy.isnan(many).all(), "zero leading coefficient: no roots")
+    # scalar coefficients are combined with arrays
+    c = numpy.array([-2.0, 0.0, 6.0])
+    many = poly4_roots_many(1.0, 0.0, c, 0.0, 1.0)
+    check(many.shape == (3, 4), "scalar and array coefficients")
+    for index, value in enumerate(c):
+        single = sorted(poly4_roots(1.0, 0.0, value, 0.0, 1.0) or [])
+        found = sorted(many[index][~numpy.isnan(many[index])])
+        check(not get_missing_roots(single, found, DOUBLE_ROOT_TOLERANCE),
+                "scalar and array coefficients: x^4%+gx^2+1" % value)
+    exit_on_failures()
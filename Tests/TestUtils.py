@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+
+
+failures = []
+
+def check(condition, description):
+    """ print the result of a single check and remember its failure """
+    if condition:
+        print "OK: %s" % description
+    else:
+        print "FAILED: %s" % description
+        failures.append(description)
+
+def exit_on_failures():
+    """ quit with a non-zero exit code if any check failed """
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+sys.path.insert(0,'.')
+
+import os
+import shutil
+import tempfile
+
+import pycam
+import pycam.Toolpath.Cache
+from pycam.Toolpath.Cache import ToolpathCache, get_toolpath_key
+from pycam.Importers.TestModel import get_test_model
+from pycam.Geometry.Point import Point
+from pycam.Geometry.Path import Path
+
+from TestUtils import check, exit_on_failures
+
+
+TOOL = {"shape": "SphericalCutter", "tool_radius": 1.0, "torus_radius": 0.25,
+        "feedrate": 200}
+BOUNDS = ((-10, -10, 0), (10, 10, 5))
+PARAMETERS = {"path_generator": "DropCutter", "overlap_percent": 10}
+
+def get_toolpath(length):
+    path = Path()
+    for index in range(length):
+        path.append(Point(index, 0, 0))
+    return [path]
+
+
+if __name__ == "__main__":
+    model = get_test_model()
+    key = get_toolpath_key(model, TOOL, BOUNDS, PARAMETERS)
+    # key invalidation
+    check(key == get_toolpath_key(model.copy(), dict(TOOL), BOUNDS,
+            dict(PARAMETERS)), "same settings - same key")
+    check(key == get_toolpath_key(model, dict(TOOL, feedrate=400), BOUNDS,
+            PARAMETERS), "feedrate does not change the key")
+    check(key != get_toolpath_key(model, dict(TOOL, tool_radius=2.0), BOUNDS,
+            PARAMETERS), "tool radius changes the key")
+    check(key != get_toolpath_key(model, TOOL, ((-10, -10, 1), BOUNDS[1]),
+            PARAMETERS), "bounds change the key")
+    check(key != get_toolpath_key(model, TOOL, BOUNDS,
+            dict(PARAMETERS, overlap_percent=20)), "parameters change the key")
+    check(key != get_toolpath_key(model, TOOL, BOUNDS, PARAMETERS,
+            support_model=get_test_model()), "support model changes the key")
+    shifted_model = model.copy()
+    shifted_model.shift(0, 0, 1)
+    check(key != get_toolpath_key(shifted_model, TOOL, BOUNDS, PARAMETERS),
+            "model geometry changes the key")
+    original_version = pycam.VERSION
+    pycam.VERSION = original_version + "-other"
+    try:
+        check(key != get_toolpath_key(model, TOOL, BOUNDS, PARAMETERS),
+                "program version changes the key")
+    finally:
+        pycam.VERSION = original_version
+    original_version = pycam.Toolpath.Cache.CACHE_FORMAT_VERSION
+    pycam.Toolpath.Cache.CACHE_FORMAT_VERSION = original_version + 1
+    try:
+        check(key != get_toolpath_key(model, TOOL, BOUNDS, PARAMETERS),
+                "cache format version changes the key")
+    finally:
+        pycam.Toolpath.Cache.CACHE_FORMAT_VERSION = original_version
+    # storage and eviction
+    cache_dir = tempfile.mkdtemp(prefix="pycam-cache-test-")
+    try:
+        cache = ToolpathCache(os.path.join(cache_dir, "cache"))
+        check(cache.get("first") is None, "empty cache returns nothing")
+        cache.put("first", get_toolpath(100))
+        toolpath = cache.get("first")
+        check(toolpath and (len(toolpath[0].points) == 100),
+                "stored toolpath is returned")
+        item_size = os.path.getsize(cache._get_filename("first"))
+        # room for two items
+        cache.max_size = int(2.5 * item_size)
+        cache.put("second", get_toolpath(100))
+        # mark "first" as being more recently used than "second"
+        os.utime(cache._get_filename("second"), (1, 1))
+        cache.get("first")
+        cache.put("third", get_toolpath(100))
+        check(cache.get("second") is None, "least recently used item removed")
+        check(not cache.get("first") is None, "recently used item kept")
+        check(not cache.get("third") is None, "new item kept")
+        # a single item exceeding the limit is kept until the next one
+        cache.max_size = item_size / 2
+        cache.put("fourth", get_toolpath(100))
+        check([cache.get(key) is None for key in ("first", "third", "fourth")]
+                == [True, True, False], "the new item survives a small limit")
+        # broken files are removed
+        broken_file = open(cache._get_filename("broken"), "wb")
+        broken_file.write("no pickle")
+        broken_file.close()
+        check(cache.get("broken") is None, "broken item is ignored")
+        check(not os.path.exists(cache._get_filename("broken")),
+                "broken item is removed")
+        cache.clear()
+        check(cache.get("fourth") is None, "cache is empty after clearing")
+        cache.max_size = 0
+        cache.put("fifth", get_toolpath(100))
+        check(cache.get("fifth") is None, "disabled cache stores nothing")
+    finally:
+        shutil.rmtree(cache_dir)
+    exit_on_failures()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+sys.path.insert(0,'.')
+
+import os
+import StringIO
+import tempfile
+
+import pycam.Toolpath.Storage
+import pycam.Exporters.GCodeExporter
+from pycam.Gui.Settings import ToolpathSettings
+from pycam.Toolpath import Toolpath, Bounds
+from pycam.Geometry.Point import Point
+from pycam.Geometry.Path import Path
+
+from TestUtils import check, exit_on_failures
+
+
+SAFETY_HEIGHT = 5.0
+
+def get_toolpath(with_settings=True):
+    paths = []
+    for line in range(5):
+        path = Path()
+        for step in range(20):
+            path.append(Point(0.25 * step, line, -0.125 * (step % 4)))
+        paths.append(path)
+    if with_settings:
+        settings = ToolpathSettings()
+        settings.set_bounds(Bounds(Bounds.TYPE_CUSTOM, (0, 0, -1), (5, 5, 0)))
+        settings.set_tool(1, "SphericalCutter", 0.5, feedrate=300.0)
+        settings.set_process_settings("DropCutter", "PathAccumulator", "x",
+                step_down=0.5)
+    else:
+        settings = None
+    return Toolpath(paths, parameters={"tool_radius": 0.5,
+            "tool_feedrate": 300.0}, toolpath_settings=settings)
+
+def get_gcode(toolpath):
+    output = StringIO.StringIO()
+    generator = pycam.Exporters.GCodeExporter.GCodeGenerator(output,
+            safety_height=SAFETY_HEIGHT)
+    generator.set_speed(300, 1000)
+    generator.add_moves(toolpath.iter_moves(SAFETY_HEIGHT),
+            comment=toolpath.get_meta_data())
+    generator.finish()
+    return output.getvalue()
+
+def get_stored_toolpath(toolpath, precision="double", use_mmap=True):
+    handle, filename = tempfile.mkstemp(prefix="pycam-test-", suffix=".bin")
+    try:
+        stream = os.fdopen(handle, "wb")
+        try:
+            pycam.Toolpath.Storage.write_toolpath(toolpath, stream,
+                    precision=precision, meta={"comment": "test"})
+        finally:
+            stream.close()
+        result, meta = pycam.Toolpath.Storage.read_toolpath(filename,
+                use_mmap=use_mmap)
+        # access all paths before removing the file
+        result.paths = [result.paths[index]
+                for index in range(len(result.paths))]
+        return result, meta
+    finally:
+        os.remove(filename)
+
+
+if __name__ == "__main__":
+    for with_settings in (True, False):
+        original = get_toolpath(with_settings=with_settings)
+        original_gcode = get_gcode(original)
+        for precision, use_mmap in (("double", True), ("double", False),
+                ("single", True)):
+            description = "%s settings, %s precision, %s" % (
+                    "with" if with_settings else "without", precision,
+                    "mapped" if use_mmap else "read")
+            loaded, meta = get_stored_toolpath(original, precision=precision,
+                    use_mmap=use_mmap)
+            check(meta.get("comment") == "test",
+                    "%s: meta data" % description)
+            check(loaded.get_params() == original.get_params(),
+                    "%s: parameters" % description)
+            check(loaded.get_moves(SAFETY_HEIGHT)
+                    == original.get_moves(SAFETY_HEIGHT),
+                    "%s: moves" % description)
+            if with_settings:
+                check(loaded.get_toolpath_settings().get_string()
+                        == original.get_toolpath_settings().get_string(),
+                        "%s: settings" % description)
+            else:
+                check(loaded.get_toolpath_settings() is None,
+                        "%s: no settings" % description)
+            check(get_gcode(loaded) == original_gcode,
+                    "%s: GCode" % description)
+        check((ToolpathSettings.META_MARKER_START in original_gcode)
+                == with_settings, "%s settings: GCode comment" \
+                % ("with" if with_settings else "without"))
+    exit_on_failures()
@@ -24,11 +24,25 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 
 from pycam.Geometry import IDGenerator
 from pycam.Geometry.Point import Point
-from pycam.Geometry.utils import number, INFINITE, epsilon
-from pycam.Geometry.intersection import intersect_cylinder_point, \
-        intersect_cylinder_line
+from pycam.Geometry.utils import number, INFINITE, epsilon, sqrt
+from pycam.Geometry.PointUtils import ptuple, padd, psub, pdot, pnorm, \
+        pnormalized, pcross, pcross_many, pnorm_many
+from pycam.Geometry.intersection import _intersect_cylinder_point, \
+        _intersect_cylinder_line, _is_point_inside_triangle, \
+        _get_plane_tuple, _get_line_tuple, _get_point_results
 import uuid
 
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+
+# number of golden section steps for locating the contact point on an edge
+EDGE_SEARCH_STEPS = 40
+GOLDEN_RATIO = (sqrt(5) - 1) / 2
+
 
 class BaseCutter(IDGenerator):
 
@@ -108,10 +122,26 @@ class BaseCutter(IDGenerator):
             set_pos_func(location.x, location.y, location.z)
 
     def intersect(self, direction, triangle, start=None):
+        """ return the cutter location touching the triangle
+
+        Subclasses implement this via the tuple based helper functions (see
+        "_get_tuples" and "_get_points").
+        @returns: the cutter location, the distance along the direction and
+            the contact point
+        @rtype: tuple(Point, float, Point)
+        """
         raise NotImplementedError("Inherited class of BaseCutter does not " \
                 + "implement the required function 'intersect'.")
 
     def drop(self, triangle, start=None):
+        """ return the cutter location touching the triangle (moving down)
+
+        This is the equivalent of "drop_many" for a single location. Both
+        describe the cutter by its radial profile (see "_get_profile_height")
+        - thus they deliver the same heights. It does not require numpy.
+        @returns: the cutter location or None (no contact)
+        @rtype: Point
+        """
         if start is None:
             start = self.location
         # check bounding box collision
@@ -131,74 +161,435 @@ class BaseCutter(IDGenerator):
                     * triangle.radius + triangle.radiussq) + epsilon:
             return None
 
-        return self.intersect(BaseCutter.vertical, triangle, start=start)[0]
+        # move the cutter axis to the origin
+        corners = [(point.x - start.x, point.y - start.y, point.z)
+                for point in (triangle.p1, triangle.p2, triangle.p3)]
+        height = max(self._drop_facet(corners),
+                *[self._drop_point(corner) for corner in corners])
+        # The lower surface of the cutter is at most "required_distance" below
+        # the cutter location. Thus an edge can't lift the cutter higher than
+        # its highest end (plus this distance).
+        offset = self.get_required_distance()
+        for index in range(3):
+            p1, p2 = corners[index], corners[(index + 1) % 3]
+            if max(p1[2], p2[2]) + offset > height:
+                height = max(height, self._drop_edge(p1, p2))
+        if height <= -INFINITE:
+            return None
+        return Point(start.x, start.y, height)
+
+    def drop_many(self, x, y, triangles):
+        """ calculate the drop heights for many pairs of positions and triangles
+
+        This is the array based equivalent of "drop" (it requires numpy).
+        The cutter is described by its radial profile (the height of its lower
+        surface above the cutter location depending on the distance from the
+        axis). The shape is expanded by the "required_distance" (the material
+        allowance) in all directions.
+
+        @value x: x coordinates of the cutter locations
+        @type x: array of shape (N,)
+        @value y: y coordinates of the cutter locations
+        @type y: array of shape (N,)
+        @value triangles: the corner points of one triangle for every location
+        @type triangles: array of shape (N, 3, 3)
+        @returns: the height of the cutter location touching the triangle or
+            -INFINITE (no contact)
+        @rtype: array of shape (N,)
+        """
+        # move the cutter axis to the origin
+        corners = numpy.array(triangles, dtype=numpy.float64)
+        corners[:, :, 0] -= x[:, numpy.newaxis]
+        corners[:, :, 1] -= y[:, numpy.newaxis]
+        heights = self._drop_many_facets(corners)
+        for index in range(3):
+            numpy.maximum(heights, self._drop_many_points(corners[:, index]),
+                    heights)
+            numpy.maximum(heights, self._drop_many_edges(corners[:, index],
+                    corners[:, (index + 1) % 3]), heights)
+        return heights
+
+    def _get_profile_heights(self, distances_sq):
+        """ return the height of the lower surface of the (expanded) cutter
+
+        The heights are relative to the cutter location. The given squared
+        distances from the axis never exceed "distance_radiussq".
+        """
+        raise NotImplementedError("Inherited class of BaseCutter does not " \
+                + "implement the required function '_get_profile_heights'.")
+
+    def _get_facet_contacts(self, normals):
+        """ return the contact points of planes with the given normals
+
+        @value normals: normalized upward plane normals of shape (N, 3)
+        @returns: the xy offsets of the contact points from the cutter axis
+            (shape (N, 2)) and the height of the cutter location above the
+            contact points (shape (N,))
+        """
+        raise NotImplementedError("Inherited class of BaseCutter does not " \
+                + "implement the required function '_get_facet_contacts'.")
+
+    def _get_profile_height(self, distance_sq):
+        """ see "_get_profile_heights" (for a single distance) """
+        raise NotImplementedError("Inherited class of BaseCutter does not " \
+                + "implement the required function '_get_profile_height'.")
+
+    def _get_facet_contact(self, normal):
+        """ see "_get_facet_contacts" (for a single normal)
+
+        @returns: the xy offset of the contact point from the cutter axis and
+            the height of the cutter location above the contact point
+        @rtype: tuple(tuple(float, float), float)
+        """
+        raise NotImplementedError("Inherited class of BaseCutter does not " \
+                + "implement the required function '_get_facet_contact'.")
+
+    def _drop_point(self, point):
+        distance_sq = point[0] ** 2 + point[1] ** 2
+        if distance_sq > self.distance_radiussq:
+            return -INFINITE
+        return point[2] - self._get_profile_height(distance_sq)
+
+    def _drop_facet(self, corners):
+        p1, p2, p3 = corners
+        normal = pcross(psub(p2, p1), psub(p3, p1))
+        length = pnorm(normal)
+        # vertical and degenerated triangles are handled by their edges
+        if abs(normal[2]) <= epsilon * length:
+            return -INFINITE
+        if normal[2] < 0:
+            length = -length
+        normal = (normal[0] / length, normal[1] / length, normal[2] / length)
+        (contact_x, contact_y), offset = self._get_facet_contact(normal)
+        # the contact point needs to be inside of the triangle
+        signs = [(q2[0] - q1[0]) * (contact_y - q1[1]) \
+                    - (q2[1] - q1[1]) * (contact_x - q1[0])
+                for q1, q2 in ((p1, p2), (p2, p3), (p3, p1))]
+        if (min(signs) < 0) and (max(signs) > 0):
+            return -INFINITE
+        return p1[2] - (normal[0] * (contact_x - p1[0]) \
+                + normal[1] * (contact_y - p1[1])) / normal[2] + offset
+
+    def _drop_edge(self, start, end):
+        """ see "_drop_many_edges" (for a single edge) """
+        edge_range = self._get_edge_range(start, end)
+        if edge_range is None:
+            return -INFINITE
+        (length, origin, slope, lower, upper) = edge_range
+        direction_x = (end[0] - start[0]) / length
+        direction_y = (end[1] - start[1]) / length
+        def get_height(position):
+            x = start[0] + direction_x * position
+            y = start[1] + direction_y * position
+            distance_sq = min(self.distance_radiussq, x ** 2 + y ** 2)
+            return start[2] + slope * position \
+                    - self._get_profile_height(distance_sq)
+        best = max(get_height(lower), get_height(upper))
+        left = lower + (1 - GOLDEN_RATIO) * (upper - lower)
+        right = lower + GOLDEN_RATIO * (upper - lower)
+        left_height = get_height(left)
+        right_height = get_height(right)
+        for step in range(EDGE_SEARCH_STEPS):
+            if left_height < right_height:
+                lower, left, left_height = left, right, right_height
+                right = lower + GOLDEN_RATIO * (upper - lower)
+                right_height = get_height(right)
+            else:
+                upper, right, right_height = right, left, left_height
+                left = lower + (1 - GOLDEN_RATIO) * (upper - lower)
+                left_height = get_height(left)
+        return max(best, left_height, right_height)
+
+    def _get_edge_range(self, start, end):
+        """ see "_get_edge_ranges" (for a single edge)
+
+        @returns: None (the edge is out of reach) or the horizontal length of
+            the edge, the position being closest to the cutter axis, the slope
+            and the lower and upper limits of the reachable positions
+        """
+        delta_x = end[0] - start[0]
+        delta_y = end[1] - start[1]
+        length = sqrt(delta_x ** 2 + delta_y ** 2)
+        if length <= epsilon:
+            return None
+        origin = -(start[0] * delta_x + start[1] * delta_y) / length
+        distance_sq = start[0] ** 2 + start[1] ** 2 - origin ** 2
+        if distance_sq >= self.distance_radiussq:
+            return None
+        half_width = sqrt(self.distance_radiussq - distance_sq)
+        lower = max(0, origin - half_width)
+        upper = min(length, origin + half_width)
+        if lower > upper:
+            return None
+        return (length, origin, (end[2] - start[2]) / length, lower, upper)
+
+    def _drop_many_points(self, points):
+        distances_sq = points[:, 0] ** 2 + points[:, 1] ** 2
+        inside = distances_sq <= self.distance_radiussq
+        heights = numpy.empty(len(points))
+        heights.fill(-INFINITE)
+        heights[inside] = points[inside, 2] \
+                - self._get_profile_heights(distances_sq[inside])
+        return heights
+
+    def _drop_many_facets(self, corners):
+        heights = numpy.empty(len(corners))
+        heights.fill(-INFINITE)
+        p1, p2, p3 = corners[:, 0], corners[:, 1], corners[:, 2]
+        normals = pcross_many(p2 - p1, p3 - p1)
+        lengths = pnorm_many(normals)
+        # vertical and degenerated triangles are handled by their edges
+        valid = numpy.abs(normals[:, 2]) > epsilon * lengths
+        normals = normals[valid] / lengths[valid, numpy.newaxis]
+        normals[normals[:, 2] < 0] *= -1
+        p1, p2, p3 = p1[valid], p2[valid], p3[valid]
+        contacts, offsets = self._get_facet_contacts(normals)
+        # the contact point needs to be inside of the triangle
+        signs = [(q2[:, 0] - q1[:, 0]) * (contacts[:, 1] - q1[:, 1]) \
+                    - (q2[:, 1] - q1[:, 1]) * (contacts[:, 0] - q1[:, 0])
+                for q1, q2 in ((p1, p2), (p2, p3), (p3, p1))]
+        inside = ((signs[0] >= 0) & (signs[1] >= 0) & (signs[2] >= 0)) \
+                | ((signs[0] <= 0) & (signs[1] <= 0) & (signs[2] <= 0))
+        plane_heights = p1[:, 2] - (normals[:, 0] * (contacts[:, 0] \
+                - p1[:, 0]) + normals[:, 1] * (contacts[:, 1] - p1[:, 1])) \
+                / normals[:, 2]
+        heights[numpy.flatnonzero(valid)[inside]] = plane_heights[inside] \
+                + offsets[inside]
+        return heights
+
+    def _drop_many_edges(self, starts, ends):
+        """ find the highest contact of the cutter with each edge
+
+        The lower surface of the cutter is convex. Thus the height of the
+        cutter location touching the edge is a concave function of the position
+        along the edge. Its maximum is located via a golden section search.
+        Subclasses may override this with an analytical solution.
+        """
+        heights = numpy.empty(len(starts))
+        heights.fill(-INFINITE)
+        (indices, origins, slopes, lower, upper) = self._get_edge_ranges(
+                starts, ends)
+        if len(indices) == 0:
+            return heights
+        starts = starts[indices]
+        directions = ends[indices, :2] - starts[:, :2]
+        directions /= numpy.sqrt((directions ** 2).sum(axis=1))[:, numpy.newaxis]
+        def get_heights(positions):
+            points = starts[:, :2] + directions * positions[:, numpy.newaxis]
+            distances_sq = numpy.minimum(self.distance_radiussq,
+                    (points ** 2).sum(axis=1))
+            return starts[:, 2] + slopes * positions \
+                    - self._get_profile_heights(distances_sq)
+        best = numpy.maximum(get_heights(lower), get_heights(upper))
+        left = lower + (1 - GOLDEN_RATIO) * (upper - lower)
+        right = lower + GOLDEN_RATIO * (upper - lower)
+        left_heights = get_heights(left)
+        right_heights = get_heights(right)
+        for step in range(EDGE_SEARCH_STEPS):
+            go_right = left_heights < right_heights
+            lower = numpy.where(go_right, left, lower)
+            upper = numpy.where(go_right, upper, right)
+            # one of the previous probes is reused as the new inner probe
+            new_left = numpy.where(go_right, right,
+                    lower + (1 - GOLDEN_RATIO) * (upper - lower))
+            new_right = numpy.where(go_right,
+                    lower + GOLDEN_RATIO * (upper - lower), left)
+            probes = numpy.where(go_right, new_right, new_left)
+            probe_heights = get_heights(probes)
+            left_heights, right_heights = (
+                    numpy.where(go_right, right_heights, probe_heights),
+                    numpy.where(go_right, probe_heights, left_heights))
+            left, right = new_left, new_right
+        numpy.maximum(best, numpy.maximum(left_heights, right_heights), best)
+        heights[indices] = best
+        return heights
+
+    def _get_edge_ranges(self, starts, ends):
+        """ return the part of each edge within the reach of the cutter
+
+        Only edges with a horizontal extent are considered. Vertical edges are
+        handled via their end points.
+        @returns: the indices of the relevant edges, the position along each
+            edge (in xy distance from its start) being closest to the cutter
+            axis, the slopes of the edges and the lower and upper limits of the
+            reachable positions along the edges
+        """
+        deltas = ends - starts
+        lengths = numpy.sqrt(deltas[:, 0] ** 2 + deltas[:, 1] ** 2)
+        indices = numpy.flatnonzero(lengths > epsilon)
+        starts = starts[indices]
+        deltas = deltas[indices]
+        lengths = lengths[indices]
+        origins = -(starts[:, 0] * deltas[:, 0] + starts[:, 1] * deltas[:, 1]) \
+                / lengths
+        distances_sq = starts[:, 0] ** 2 + starts[:, 1] ** 2 - origins ** 2
+        reachable = distances_sq < self.distance_radiussq
+        half_widths = numpy.sqrt(self.distance_radiussq
+                - distances_sq[reachable])
+        origins = origins[reachable]
+        lower = numpy.maximum(0, origins - half_widths)
+        upper = numpy.minimum(lengths[reachable], origins + half_widths)
+        overlapping = lower <= upper
+        slopes = deltas[reachable, 2] / lengths[reachable]
+        return (indices[reachable][overlapping], origins[overlapping],
+                slopes[overlapping], lower[overlapping], upper[overlapping])
+
+    def _get_tuples(self, direction, triangle, start=None):
+        """ convert the arguments of "intersect" into tuples
+
+        The helper functions of the cutters (e.g. "_intersect_circle_edge")
+        expect all points and vectors as tuples (x, y, z). A triangle is
+        represented by its three points, its three edges (pairs of points) and
+        its plane (a point and the normal).
+        """
+        if start is None:
+            start = self.location
+        return (ptuple(direction), self._get_triangle_tuple(triangle),
+                ptuple(start))
+
+    def _get_triangle_tuple(self, triangle):
+        """ return the points, the edges and the plane of a triangle as tuples
+        (see "_get_tuples")
+        """
+        p1, p2, p3 = ptuple(triangle.p1), ptuple(triangle.p2), \
+                ptuple(triangle.p3)
+        return ((p1, p2, p3), ((p1, p2), (p2, p3), (p3, p1)),
+                _get_plane_tuple(triangle))
+
+    def _call_with_points(self, function, direction, target, start):
+        """ call a tuple based helper function with a direction and a start
+        given as points and return its result as points
+
+        The public helper functions (e.g. "intersect_circle_edge") expect and
+        return points (as before) - they are thin wrappers around their tuple
+        based counterparts (e.g. "_intersect_circle_edge").
+        @value target: the (already converted) triangle, point or edge
+        """
+        if not start is None:
+            start = ptuple(start)
+        return _get_point_results(function(ptuple(direction), target,
+                start=start))
+
+    def _get_points(self, cl, d, cp):
+        """ convert the tuple based result of an intersection into points """
+        if cl:
+            cl = Point(cl[0], cl[1], cl[2])
+        if cp:
+            cp = Point(cp[0], cp[1], cp[2])
+        return (cl, d, cp)
+
+    def intersect_circle_plane(self, direction, triangle, start=None):
+        return self._call_with_points(self._intersect_circle_plane, direction,
+                _get_plane_tuple(triangle), start)
 
     def intersect_circle_triangle(self, direction, triangle, start=None):
-        (cl, ccp, cp, d) = self.intersect_circle_plane(direction, triangle,
+        return self._call_with_points(self._intersect_circle_triangle,
+                direction, self._get_triangle_tuple(triangle), start)
+
+    def intersect_circle_point(self, direction, point, start=None):
+        return self._call_with_points(self._intersect_circle_point, direction,
+                ptuple(point), start)
+
+    def intersect_circle_vertex(self, direction, point, start=None):
+        return self._call_with_points(self._intersect_circle_vertex, direction,
+                ptuple(point), start)
+
+    def intersect_circle_line(self, direction, edge, start=None):
+        return self._call_with_points(self._intersect_circle_line, direction,
+                _get_line_tuple(edge), start)
+
+    def intersect_circle_edge(self, direction, edge, start=None):
+        return self._call_with_points(self._intersect_circle_edge, direction,
+                _get_line_tuple(edge), start)
+
+    def intersect_cylinder_point(self, direction, point, start=None):
+        return self._call_with_points(self._intersect_cylinder_point,
+                direction, ptuple(point), start)
+
+    def intersect_cylinder_vertex(self, direction, point, start=None):
+        return self._call_with_points(self._intersect_cylinder_vertex,
+                direction, ptuple(point), start)
+
+    def intersect_cylinder_line(self, direction, edge, start=None):
+        return self._call_with_points(self._intersect_cylinder_line, direction,
+                _get_line_tuple(edge), start)
+
+    def intersect_cylinder_edge(self, direction, edge, start=None):
+        return self._call_with_points(self._intersect_cylinder_edge, direction,
+                _get_line_tuple(edge), start)
+
+    def _get_center(self, start):
+        """ return the center of the cutter moved along with the location """
+        return padd(psub(start, ptuple(self.location)), ptuple(self.center))
+
+    def _intersect_circle_triangle(self, direction, triangle, start=None):
+        (cl, ccp, cp, d) = self._intersect_circle_plane(direction, triangle[2],
                 start=start)
-        if cp and triangle.is_point_inside(cp):
+        if cp and _is_point_inside_triangle(triangle[0][0], triangle[0][1],
+                triangle[0][2], cp):
             return (cl, d, cp)
         return (None, INFINITE, None)
 
-    def intersect_circle_vertex(self, direction, point, start=None):
-        (cl, ccp, cp, l) = self.intersect_circle_point(direction, point,
+    def _intersect_circle_vertex(self, direction, point, start=None):
+        (cl, ccp, cp, l) = self._intersect_circle_point(direction, point,
                 start=start)
         return (cl, l, cp)
 
-    def intersect_circle_edge(self, direction, edge, start=None):
-        (cl, ccp, cp, l) = self.intersect_circle_line(direction, edge,
+    def _intersect_circle_edge(self, direction, edge, start=None):
+        (cl, ccp, cp, l) = self._intersect_circle_line(direction, edge,
                 start=start)
         if cp:
             # check if the contact point is between the endpoints
-            m = cp.sub(edge.p1).dot(edge.dir)
-            if (m < -epsilon) or (m > edge.len + epsilon):
+            vector = psub(edge[1], edge[0])
+            m = pdot(psub(cp, edge[0]), pnormalized(vector))
+            if (m < -epsilon) or (m > pnorm(vector) + epsilon):
                 return (None, INFINITE, cp)
         return (cl, l, cp)
 
-    def intersect_cylinder_point(self, direction, point, start=None):
+    def _intersect_cylinder_point(self, direction, point, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_cylinder_point(
-                start.sub(self.location).add(self.center), self.axis,
-                self.distance_radius, self.distance_radiussq, direction, point)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_cylinder_point(self._get_center(start),
+                ptuple(self.axis), self.distance_radius,
+                self.distance_radiussq, direction, point)
         # offset intersection
         if ccp:
-            cl = cp.add(start.sub(ccp))
+            cl = padd(cp, psub(start, ccp))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
-    def intersect_cylinder_vertex(self, direction, point, start=None):
+    def _intersect_cylinder_vertex(self, direction, point, start=None):
         if start is None:
-            start = self.location
-        (cl, ccp, cp, l) = self.intersect_cylinder_point(direction, point,
+            start = ptuple(self.location)
+        (cl, ccp, cp, l) = self._intersect_cylinder_point(direction, point,
                 start=start)
-        if ccp and ccp.z < start.sub(self.location).add(self.center).z:
+        if ccp and ccp[2] < self._get_center(start)[2]:
             return (None, INFINITE, None)
         return (cl, l, cp)
 
-    def intersect_cylinder_line(self, direction, edge, start=None):
+    def _intersect_cylinder_line(self, direction, edge, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_cylinder_line(
-                start.sub(self.location).add(self.center), self.axis,
-                self.distance_radius, self.distance_radiussq, direction, edge)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_cylinder_line(self._get_center(start),
+                ptuple(self.axis), self.distance_radius,
+                self.distance_radiussq, direction, edge)
         # offset intersection
         if ccp:
-            cl = start.add(cp.sub(ccp))
+            cl = padd(start, psub(cp, ccp))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
-    def intersect_cylinder_edge(self, direction, edge, start=None):
+    def _intersect_cylinder_edge(self, direction, edge, start=None):
         if start is None:
-            start = self.location
-        (cl, ccp, cp, l) = self.intersect_cylinder_line(direction, edge,
+            start = ptuple(self.location)
+        (cl, ccp, cp, l) = self._intersect_cylinder_line(direction, edge,
                 start=start)
         if not ccp:
             return (None, INFINITE, None)
-        m = cp.sub(edge.p1).dot(edge.dir)
-        if (m < -epsilon) or (m > edge.len + epsilon):
+        vector = psub(edge[1], edge[0])
+        m = pdot(psub(cp, edge[0]), pnormalized(vector))
+        if (m < -epsilon) or (m > pnorm(vector) + epsilon):
             return (None, INFINITE, None)
-        if ccp.z < start.sub(self.location).add(self.center).z:
+        if ccp[2] < self._get_center(start)[2]:
             return (None, INFINITE, None)
         return (cl, l, cp)
-
@@ -21,10 +21,11 @@ You should have received a copy of the GNU General Public License
 along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from pycam.Geometry.utils import INFINITE, sqrt
+from pycam.Geometry.utils import INFINITE, epsilon, sqrt
 from pycam.Geometry.Point import Point, Vector
-from pycam.Geometry.intersection import intersect_circle_plane, \
-        intersect_circle_point, intersect_circle_line
+from pycam.Geometry.PointUtils import ptuple, padd, psub
+from pycam.Geometry.intersection import _intersect_circle_plane, \
+        _intersect_circle_point, _intersect_circle_line
 from pycam.Cutters.BaseCutter import BaseCutter
 
 
@@ -35,6 +36,11 @@ try:
 except ImportError:
     GL_enabled = False
 
+try:
+    import numpy
+except ImportError:
+    pass
+
 
 class CylindricalCutter(BaseCutter):
 
@@ -134,42 +140,88 @@ class CylindricalCutter(BaseCutter):
         self.center = Point(location.x, location.y,
                 location.z - self.get_required_distance())
 
-    def intersect_circle_plane(self, direction, triangle, start=None):
+    def _intersect_circle_plane(self, direction, plane, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, d) = intersect_circle_plane(
-                start.sub(self.location).add(self.center), self.distance_radius,
-                direction, triangle)
+            start = ptuple(self.location)
+        (ccp, cp, d) = _intersect_circle_plane(self._get_center(start),
+                self.distance_radius, direction, plane)
         if ccp and cp:
-            cl = cp.add(start.sub(ccp))
+            cl = padd(cp, psub(start, ccp))
             return (cl, ccp, cp, d)
         return (None, None, None, INFINITE)
 
-    def intersect_circle_point(self, direction, point, start=None):
+    def _intersect_circle_point(self, direction, point, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_circle_point(
-                start.sub(self.location).add(self.center), self.axis,
-                self.distance_radius, self.distance_radiussq, direction, point)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_circle_point(self._get_center(start),
+                ptuple(self.axis), self.distance_radius,
+                self.distance_radiussq, direction, point)
         if ccp:
-            cl = cp.add(start.sub(ccp))
+            cl = padd(cp, psub(start, ccp))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
-    def intersect_circle_line(self, direction, edge, start=None):
+    def _intersect_circle_line(self, direction, edge, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_circle_line(
-                start.sub(self.location).add(self.center), self.axis,
-                self.distance_radius, self.distance_radiussq, direction, edge)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_circle_line(self._get_center(start),
+                ptuple(self.axis), self.distance_radius,
+                self.distance_radiussq, direction, edge)
         if ccp:
-            cl = cp.add(start.sub(ccp))
+            cl = padd(cp, psub(start, ccp))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
+    def _get_profile_heights(self, distances_sq):
+        # the flat bottom is lowered by the required distance
+        return numpy.zeros(len(distances_sq)) - self.get_required_distance()
+
+    def _get_facet_contacts(self, normals):
+        # the point on the circle closest to the rising side of the plane
+        flat = numpy.sqrt(normals[:, 0] ** 2 + normals[:, 1] ** 2)
+        flat[flat < epsilon] = INFINITE
+        contacts = -self.distance_radius * normals[:, :2] \
+                / flat[:, numpy.newaxis]
+        offsets = numpy.zeros(len(normals)) + self.get_required_distance()
+        return contacts, offsets
+
+    def _drop_many_edges(self, starts, ends):
+        # The highest point of the edge below the flat bottom is located at
+        # one of the intersections with the circle or at one of its ends.
+        heights = numpy.empty(len(starts))
+        heights.fill(-INFINITE)
+        (indices, origins, slopes, lower, upper) = self._get_edge_ranges(
+                starts, ends)
+        heights[indices] = starts[indices, 2] \
+                + numpy.maximum(slopes * lower, slopes * upper) \
+                + self.get_required_distance()
+        return heights
+
+    def _get_profile_height(self, distance_sq):
+        return -self.get_required_distance()
+
+    def _get_facet_contact(self, normal):
+        flat = sqrt(normal[0] ** 2 + normal[1] ** 2)
+        if flat < epsilon:
+            flat = INFINITE
+        return ((-self.distance_radius * normal[0] / flat,
+                -self.distance_radius * normal[1] / flat),
+                self.get_required_distance())
+
+    def _drop_edge(self, start, end):
+        edge_range = self._get_edge_range(start, end)
+        if edge_range is None:
+            return -INFINITE
+        (length, origin, slope, lower, upper) = edge_range
+        return start[2] + max(slope * lower, slope * upper) \
+                + self.get_required_distance()
+
     def intersect(self, direction, triangle, start=None):
-        (cl_t, d_t, cp_t) = self.intersect_circle_triangle(direction, triangle,
+        (direction, triangle, start) = self._get_tuples(direction, triangle,
                 start=start)
+        points, edges = triangle[0], triangle[1]
+        (cl_t, d_t, cp_t) = self._intersect_circle_triangle(direction,
+                triangle, start=start)
         d = INFINITE
         cl = None
         cp = None
@@ -177,16 +229,16 @@ class CylindricalCutter(BaseCutter):
             d = d_t
             cl = cl_t
             cp = cp_t
-        if cl and (direction.x == 0) and (direction.y == 0):
+        if cl and (direction[0] == 0) and (direction[1] == 0):
             #print 'circle_triangle:'
             #print 'cl is:', cl, 'd is:', d, 'cp is:', cp
-            return (cl, d, cp)
-        (cl_e1, d_e1, cp_e1) = self.intersect_circle_edge(direction,
-                triangle.e1, start=start)
-        (cl_e2, d_e2, cp_e2) = self.intersect_circle_edge(direction,
-                triangle.e2, start=start)
-        (cl_e3, d_e3, cp_e3) = self.intersect_circle_edge(direction,
-                triangle.e3, start=start)
+            return self._get_points(cl, d, cp)
+        (cl_e1, d_e1, cp_e1) = self._intersect_circle_edge(direction,
+                edges[0], start=start)
+        (cl_e2, d_e2, cp_e2) = self._intersect_circle_edge(direction,
+                edges[1], start=start)
+        (cl_e3, d_e3, cp_e3) = self._intersect_circle_edge(direction,
+                edges[2], start=start)
         if d_e1 < d:
             d = d_e1
             cl = cl_e1
@@ -202,16 +254,16 @@ class CylindricalCutter(BaseCutter):
             cl = cl_e3
             cp = cp_e3
             #print 'circle_edge e3:'
-        if cl and (direction.x == 0) and (direction.y == 0):
+        if cl and (direction[0] == 0) and (direction[1] == 0):
             #print 'circle_edge:'
             #print 'cl is:', cl, 'd is:', d, 'cp is:', cp
-            return (cl, d, cp)
-        (cl_p1, d_p1, cp_p1) = self.intersect_circle_vertex(direction,
-                triangle.p1, start=start)
-        (cl_p2, d_p2, cp_p2) = self.intersect_circle_vertex(direction,
-                triangle.p2, start=start)
-        (cl_p3, d_p3, cp_p3) = self.intersect_circle_vertex(direction,
-                triangle.p3, start=start)
+            return self._get_points(cl, d, cp)
+        (cl_p1, d_p1, cp_p1) = self._intersect_circle_vertex(direction,
+                points[0], start=start)
+        (cl_p2, d_p2, cp_p2) = self._intersect_circle_vertex(direction,
+                points[1], start=start)
+        (cl_p3, d_p3, cp_p3) = self._intersect_circle_vertex(direction,
+                points[2], start=start)
         if d_p1 < d:
             d = d_p1
             cl = cl_p1
@@ -227,17 +279,17 @@ class CylindricalCutter(BaseCutter):
             cl = cl_p3
             cp = cp_p3
             #print 'circle vertex p3:'
-        if cl and (direction.x == 0) and (direction.y == 0):
+        if cl and (direction[0] == 0) and (direction[1] == 0):
             #print 'circle vertex:'
             #print 'cl is:', cl, 'd is:', d, 'cp is:', cp
-            return (cl, d, cp)
-        if (direction.x != 0) or (direction.y != 0):
-            (cl_p1, d_p1, cp_p1) = self.intersect_cylinder_vertex(direction,
-                    triangle.p1, start=start)
-            (cl_p2, d_p2, cp_p2) = self.intersect_cylinder_vertex(direction,
-                    triangle.p2, start=start)
-            (cl_p3, d_p3, cp_p3) = self.intersect_cylinder_vertex(direction,
-                    triangle.p3, start=start)
+            return self._get_points(cl, d, cp)
+        if (direction[0] != 0) or (direction[1] != 0):
+            (cl_p1, d_p1, cp_p1) = self._intersect_cylinder_vertex(direction,
+                    points[0], start=start)
+            (cl_p2, d_p2, cp_p2) = self._intersect_cylinder_vertex(direction,
+                    points[1], start=start)
+            (cl_p3, d_p3, cp_p3) = self._intersect_cylinder_vertex(direction,
+                    points[2], start=start)
             if d_p1 < d:
                 d = d_p1
                 cl = cl_p1
@@ -253,12 +305,12 @@ class CylindricalCutter(BaseCutter):
                 cl = cl_p3
                 cp = cp_p3
                 #print 'cyl vertex p3:'
-            (cl_e1, d_e1, cp_e1) = self.intersect_cylinder_edge(direction,
-                    triangle.e1, start=start)
-            (cl_e2, d_e2, cp_e2) = self.intersect_cylinder_edge(direction,
-                    triangle.e2, start=start)
-            (cl_e3, d_e3, cp_e3) = self.intersect_cylinder_edge(direction,
-                    triangle.e3, start=start)
+            (cl_e1, d_e1, cp_e1) = self._intersect_cylinder_edge(direction,
+                    edges[0], start=start)
+            (cl_e2, d_e2, cp_e2) = self._intersect_cylinder_edge(direction,
+                    edges[1], start=start)
+            (cl_e3, d_e3, cp_e3) = self._intersect_cylinder_edge(direction,
+                    edges[2], start=start)
             if d_e1 < d:
                 d = d_e1
                 cl = cl_e1
@@ -276,5 +328,5 @@ class CylindricalCutter(BaseCutter):
                 #print 'cyl edge e3:'
         #print 'cyl:'
         #print 'cl is:', cl, 'd is:', d, 'cp is:', cp
-        return (cl, d, cp)
+        return self._get_points(cl, d, cp)
 
@@ -24,8 +24,11 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 from pycam.Geometry import Matrix
 from pycam.Geometry.Point import Point, Vector
 from pycam.Geometry.utils import INFINITE, epsilon, sqrt
-from pycam.Geometry.intersection import intersect_sphere_plane, \
-        intersect_sphere_point, intersect_sphere_line
+from pycam.Geometry.PointUtils import ptuple, padd, psub, pmul, pdot, \
+        pnormsq
+from pycam.Geometry.intersection import _intersect_sphere_plane, \
+        _intersect_sphere_point, _intersect_sphere_line, \
+        _is_point_inside_triangle, _get_plane_tuple, _get_line_tuple
 from pycam.Cutters.BaseCutter import BaseCutter
 
 
@@ -36,6 +39,11 @@ try:
 except ImportError:
     GL_enabled = False
 
+try:
+    import numpy
+except ImportError:
+    pass
+
 
 class SphericalCutter(BaseCutter):
 
@@ -143,72 +151,145 @@ class SphericalCutter(BaseCutter):
         BaseCutter.moveto(self, location, **kwargs)
         self.center = Point(location.x, location.y, location.z + self.radius)
 
-    def intersect_sphere_plane(self, direction, triangle, start=None):
+    def _intersect_sphere_plane(self, direction, plane, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, d) = intersect_sphere_plane(
-                start.sub(self.location).add(self.center), self.distance_radius,
-                direction, triangle)
+            start = ptuple(self.location)
+        (ccp, cp, d) = _intersect_sphere_plane(self._get_center(start),
+                self.distance_radius, direction, plane)
         # offset intersection
         if ccp:
-            cl = cp.add(start.sub(ccp))
+            cl = padd(cp, psub(start, ccp))
             return (cl, ccp, cp, d)
         return (None, None, None, INFINITE)
 
-    def intersect_sphere_triangle(self, direction, triangle, start=None):
-        (cl, ccp, cp, d) = self.intersect_sphere_plane(direction, triangle,
+    def _intersect_sphere_triangle(self, direction, triangle, start=None):
+        (cl, ccp, cp, d) = self._intersect_sphere_plane(direction, triangle[2],
                 start=start)
-        if cp and triangle.is_point_inside(cp):
+        if cp and _is_point_inside_triangle(triangle[0][0], triangle[0][1],
+                triangle[0][2], cp):
             return (cl, d, cp)
         return (None, INFINITE, None)
 
-    def intersect_sphere_point(self, direction, point, start=None):
+    def _intersect_sphere_point(self, direction, point, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_sphere_point(
-                start.sub(self.location).add(self.center), self.distance_radius,
-                self.distance_radiussq, direction, point)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_sphere_point(self._get_center(start),
+                self.distance_radius, self.distance_radiussq, direction, point)
         # offset intersection
         cl = None
         if cp:
-            cl = start.add(direction.mul(l))
+            cl = padd(start, pmul(direction, l))
         return (cl, ccp, cp, l)
 
-    def intersect_sphere_vertex(self, direction, point, start=None):
-        (cl, ccp, cp, l) = self.intersect_sphere_point(direction, point,
+    def _intersect_sphere_vertex(self, direction, point, start=None):
+        (cl, ccp, cp, l) = self._intersect_sphere_point(direction, point,
                 start=start)
         return (cl, l, cp)
 
-    def intersect_sphere_line(self, direction, edge, start=None):
+    def _intersect_sphere_line(self, direction, edge, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_sphere_line(
-                start.sub(self.location).add(self.center), self.distance_radius,
-                self.distance_radiussq, direction, edge)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_sphere_line(self._get_center(start),
+                self.distance_radius, self.distance_radiussq, direction, edge)
         # offset intersection
         if ccp:
-            cl = cp.sub(ccp.sub(start))
+            cl = psub(cp, psub(ccp, start))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
-    def intersect_sphere_edge(self, direction, edge, start=None):
-        (cl, ccp, cp, l) = self.intersect_sphere_line(direction, edge,
+    def _intersect_sphere_edge(self, direction, edge, start=None):
+        (cl, ccp, cp, l) = self._intersect_sphere_line(direction, edge,
                 start=start)
         if cp:
             # check if the contact point is between the endpoints
-            d = edge.p2.sub(edge.p1)
-            m = cp.sub(edge.p1).dot(d)
-            if (m < -epsilon) or (m > d.normsq + epsilon):
+            d = psub(edge[1], edge[0])
+            m = pdot(psub(cp, edge[0]), d)
+            if (m < -epsilon) or (m > pnormsq(d) + epsilon):
                 return (None, INFINITE, None)
         return (cl, l, cp)
 
+    def intersect_sphere_plane(self, direction, triangle, start=None):
+        return self._call_with_points(self._intersect_sphere_plane, direction,
+                _get_plane_tuple(triangle), start)
+
+    def intersect_sphere_triangle(self, direction, triangle, start=None):
+        return self._call_with_points(self._intersect_sphere_triangle,
+                direction, self._get_triangle_tuple(triangle), start)
+
+    def intersect_sphere_point(self, direction, point, start=None):
+        return self._call_with_points(self._intersect_sphere_point, direction,
+                ptuple(point), start)
+
+    def intersect_sphere_vertex(self, direction, point, start=None):
+        return self._call_with_points(self._intersect_sphere_vertex, direction,
+                ptuple(point), start)
+
+    def intersect_sphere_line(self, direction, edge, start=None):
+        return self._call_with_points(self._intersect_sphere_line, direction,
+                _get_line_tuple(edge), start)
+
+    def intersect_sphere_edge(self, direction, edge, start=None):
+        return self._call_with_points(self._intersect_sphere_edge, direction,
+                _get_line_tuple(edge), start)
+
     def intersect_point(self, direction, point, start=None):
         # TODO: probably obsolete?
         return self.intersect_sphere_point(direction, point, start=start)
 
+    def _get_profile_heights(self, distances_sq):
+        return self.radius - numpy.sqrt(self.distance_radiussq - distances_sq)
+
+    def _get_facet_contacts(self, normals):
+        # the sphere touches the plane where its surface normal is "-normal"
+        contacts = -self.distance_radius * normals[:, :2]
+        offsets = self.distance_radius * normals[:, 2] - self.radius
+        return contacts, offsets
+
+    def _drop_many_edges(self, starts, ends):
+        # The vertical plane through the edge cuts a circle out of the sphere.
+        # This circle touches the edge where its radius is orthogonal to it.
+        heights = numpy.empty(len(starts))
+        heights.fill(-INFINITE)
+        (indices, origins, slopes, lower, upper) = self._get_edge_ranges(
+                starts, ends)
+        starts = starts[indices]
+        distances_sq = starts[:, 0] ** 2 + starts[:, 1] ** 2 - origins ** 2
+        radii = numpy.sqrt(numpy.maximum(0,
+                self.distance_radiussq - distances_sq))
+        factors = 1 / numpy.sqrt(1 + slopes ** 2)
+        contacts = origins + radii * slopes * factors
+        inside = (lower <= contacts) & (contacts <= upper)
+        heights[indices[inside]] = (starts[:, 2] + slopes * contacts
+                + radii * factors)[inside] - self.radius
+        return heights
+
+    def _get_profile_height(self, distance_sq):
+        return self.radius - sqrt(max(0, self.distance_radiussq - distance_sq))
+
+    def _get_facet_contact(self, normal):
+        return ((-self.distance_radius * normal[0],
+                -self.distance_radius * normal[1]),
+                self.distance_radius * normal[2] - self.radius)
+
+    def _drop_edge(self, start, end):
+        edge_range = self._get_edge_range(start, end)
+        if edge_range is None:
+            return -INFINITE
+        (length, origin, slope, lower, upper) = edge_range
+        distance_sq = start[0] ** 2 + start[1] ** 2 - origin ** 2
+        radius = sqrt(max(0, self.distance_radiussq - distance_sq))
+        factor = 1 / sqrt(1 + slope ** 2)
+        contact = origin + radius * slope * factor
+        if (contact < lower) or (contact > upper):
+            return -INFINITE
+        return start[2] + slope * contact + radius * factor - self.radius
+
     def intersect(self, direction, triangle, start=None):
-        (cl_t, d_t, cp_t) = self.intersect_sphere_triangle(direction, triangle,
+        (direction, triangle, start) = self._get_tuples(direction, triangle,
                 start=start)
+        points, edges = triangle[0], triangle[1]
+        (cl_t, d_t, cp_t) = self._intersect_sphere_triangle(direction,
+                triangle, start=start)
         d = INFINITE
         cl = None
         cp = None
@@ -216,14 +297,14 @@ class SphericalCutter(BaseCutter):
             d = d_t
             cl = cl_t
             cp = cp_t
-        if cl and (direction.x == 0) and (direction.y == 0):
-            return (cl, d, cp)
-        (cl_e1, d_e1, cp_e1) = self.intersect_sphere_edge(direction,
-                triangle.e1, start=start)
-        (cl_e2, d_e2, cp_e2) = self.intersect_sphere_edge(direction,
-                triangle.e2, start=start)
-        (cl_e3, d_e3, cp_e3) = self.intersect_sphere_edge(direction,
-                triangle.e3, start=start)
+        if cl and (direction[0] == 0) and (direction[1] == 0):
+            return self._get_points(cl, d, cp)
+        (cl_e1, d_e1, cp_e1) = self._intersect_sphere_edge(direction,
+                edges[0], start=start)
+        (cl_e2, d_e2, cp_e2) = self._intersect_sphere_edge(direction,
+                edges[1], start=start)
+        (cl_e3, d_e3, cp_e3) = self._intersect_sphere_edge(direction,
+                edges[2], start=start)
         if d_e1 < d:
             d = d_e1
             cl = cl_e1
@@ -236,12 +317,12 @@ class SphericalCutter(BaseCutter):
             d = d_e3
             cl = cl_e3
             cp = cp_e3
-        (cl_p1, d_p1, cp_p1) = self.intersect_sphere_vertex(direction,
-                triangle.p1, start=start)
-        (cl_p2, d_p2, cp_p2) = self.intersect_sphere_vertex(direction,
-                triangle.p2, start=start)
-        (cl_p3, d_p3, cp_p3) = self.intersect_sphere_vertex(direction,
-                triangle.p3, start=start)
+        (cl_p1, d_p1, cp_p1) = self._intersect_sphere_vertex(direction,
+                points[0], start=start)
+        (cl_p2, d_p2, cp_p2) = self._intersect_sphere_vertex(direction,
+                points[1], start=start)
+        (cl_p3, d_p3, cp_p3) = self._intersect_sphere_vertex(direction,
+                points[2], start=start)
         if d_p1 < d:
             d = d_p1
             cl = cl_p1
@@ -254,15 +335,15 @@ class SphericalCutter(BaseCutter):
             d = d_p3
             cl = cl_p3
             cp = cp_p3
-        if cl and (direction.x == 0) and (direction.y == 0):
-            return (cl, d, cp)
-        if (direction.x != 0) or (direction.y != 0):
-            (cl_p1, d_p1, cp_p1) = self.intersect_cylinder_vertex(direction,
-                    triangle.p1, start=start)
-            (cl_p2, d_p2, cp_p2) = self.intersect_cylinder_vertex(direction,
-                    triangle.p2, start=start)
-            (cl_p3, d_p3, cp_p3) = self.intersect_cylinder_vertex(direction,
-                    triangle.p3, start=start)
+        if cl and (direction[0] == 0) and (direction[1] == 0):
+            return self._get_points(cl, d, cp)
+        if (direction[0] != 0) or (direction[1] != 0):
+            (cl_p1, d_p1, cp_p1) = self._intersect_cylinder_vertex(direction,
+                    points[0], start=start)
+            (cl_p2, d_p2, cp_p2) = self._intersect_cylinder_vertex(direction,
+                    points[1], start=start)
+            (cl_p3, d_p3, cp_p3) = self._intersect_cylinder_vertex(direction,
+                    points[2], start=start)
             if d_p1 < d:
                 d = d_p1
                 cl = cl_p1
@@ -275,12 +356,12 @@ class SphericalCutter(BaseCutter):
                 d = d_p3
                 cl = cl_p3
                 cp = cp_p3
-            (cl_e1, d_e1, cp_e1) = self.intersect_cylinder_edge(direction,
-                    triangle.e1, start=start)
-            (cl_e2, d_e2, cp_e2) = self.intersect_cylinder_edge(direction,
-                    triangle.e2, start=start)
-            (cl_e3, d_e3, cp_e3) = self.intersect_cylinder_edge(direction,
-                    triangle.e3, start=start)
+            (cl_e1, d_e1, cp_e1) = self._intersect_cylinder_edge(direction,
+                    edges[0], start=start)
+            (cl_e2, d_e2, cp_e2) = self._intersect_cylinder_edge(direction,
+                    edges[1], start=start)
+            (cl_e3, d_e3, cp_e3) = self._intersect_cylinder_edge(direction,
+                    edges[2], start=start)
             if d_e1 < d:
                 d = d_e1
                 cl = cl_e1
@@ -293,5 +374,5 @@ class SphericalCutter(BaseCutter):
                 d = d_e3
                 cl = cl_e3
                 cp = cp_e3
-        return (cl, d, cp)
+        return self._get_points(cl, d, cp)
 
@@ -22,10 +22,15 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from pycam.Geometry.Point import Point
-from pycam.Geometry.utils import INFINITE, number, epsilon
-from pycam.Geometry.intersection import intersect_torus_plane, \
-        intersect_torus_point, intersect_circle_plane, intersect_circle_point, \
-        intersect_cylinder_point, intersect_cylinder_line, intersect_circle_line
+from pycam.Geometry.PointUtils import ptuple, padd, psub, pmul, pdot, pnorm, \
+        pnormalized
+from pycam.Geometry.utils import INFINITE, number, epsilon, sqrt
+from pycam.Geometry.intersection import _intersect_torus_plane, \
+        _intersect_torus_point, _intersect_circle_plane, \
+        _intersect_circle_point, _intersect_cylinder_point, \
+        _intersect_cylinder_line, _intersect_circle_line, \
+        _is_point_inside_triangle, _intersect_torus_points, _get_plane_tuple, \
+        _get_line_tuple
 from pycam.Cutters.BaseCutter import BaseCutter
 
 
@@ -37,6 +42,12 @@ try:
 except ImportError:
     GL_enabled = False
 
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
 
 class ToroidalCutter(BaseCutter):
 
@@ -115,153 +126,285 @@ class ToroidalCutter(BaseCutter):
         BaseCutter.moveto(self, location, **kwargs)
         self.center = Point(location.x, location.y, location.z+self.minorradius)
 
-    def intersect_torus_plane(self, direction, triangle, start=None):
+    def _intersect_torus_plane(self, direction, plane, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_torus_plane(
-                start.sub(self.location).add(self.center), self.axis,
-                self.distance_majorradius, self.distance_minorradius, direction,
-                triangle)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_torus_plane(self._get_center(start),
+                ptuple(self.axis), self.distance_majorradius,
+                self.distance_minorradius, direction, plane)
         if cp:
-            cl = cp.add(start.sub(ccp))
+            cl = padd(cp, psub(start, ccp))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
-    def intersect_torus_triangle(self, direction, triangle, start=None):
-        (cl, ccp, cp, d) = self.intersect_torus_plane(direction, triangle,
+    def _intersect_torus_triangle(self, direction, triangle, start=None):
+        (cl, ccp, cp, d) = self._intersect_torus_plane(direction, triangle[2],
                 start=start)
-        if cp and triangle.is_point_inside(cp):
+        if cp and _is_point_inside_triangle(triangle[0][0], triangle[0][1],
+                triangle[0][2], cp):
             return (cl, d, cp)
         return (None, INFINITE, None)
 
-    def intersect_torus_point(self, direction, point, start=None):
+    def _intersect_torus_point(self, direction, point, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_torus_point(
-                start.sub(self.location).add(self.center), self.axis,
-                self.distance_majorradius, self.distance_minorradius,
-                self.distance_majorradiussq, self.distance_minorradiussq,
-                direction, point)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_torus_point(self._get_center(start),
+                ptuple(self.axis), self.distance_majorradius,
+                self.distance_minorradius, self.distance_majorradiussq,
+                self.distance_minorradiussq, direction, point)
         if ccp:
-            cl = point.add(start.sub(ccp))
+            cl = padd(point, psub(start, ccp))
             return (cl, ccp, point, l)
         return (None, None, None, INFINITE)
 
-    def intersect_torus_vertex(self, direction, point, start=None):
-        (cl, ccp, cp, l) = self.intersect_torus_point(direction, point,
+    def _intersect_torus_vertex(self, direction, point, start=None):
+        (cl, ccp, cp, l) = self._intersect_torus_point(direction, point,
                 start=start)
         return (cl, l, cp)
 
-    def intersect_torus_edge(self, direction, edge, start=None):
+    def _intersect_torus_samples(self, direction, samples, start=None):
+        """ find the closest contacts of the torus with points along edges
+
+        @value samples: pairs of an edge and the positions of the points to
+            be checked along the edge (0 for its start and 1 for its end)
+        @type samples: list(tuple(edge, list(float)))
+        @returns: for each edge: the position of the closest point along the
+            edge, the cutter location, the distance and the contact point (or
+            (None, None, INFINITE, None) if no point is touched)
+        @rtype: list(tuple)
+        """
+        if start is None:
+            start = ptuple(self.location)
+        results = []
+        if not numpy_enabled:
+            for edge, multipliers in samples:
+                vector = psub(edge[1], edge[0])
+                length = pnorm(vector)
+                edge_dir = pnormalized(vector)
+                result = (None, None, INFINITE, None)
+                for m in multipliers:
+                    p = padd(edge[0], pmul(edge_dir, m * length))
+                    (cl, ccp, cp, l) = self._intersect_torus_point(direction,
+                            p, start=start)
+                    if cl and (l < result[2]):
+                        result = (m, cl, l, cp)
+                results.append(result)
+            return results
+        counts = [len(multipliers) for edge, multipliers in samples]
+        if sum(counts) == 0:
+            return [(None, None, INFINITE, None)] * len(samples)
+        edges = numpy.array([edge for edge, multipliers in samples],
+                dtype=numpy.float64)
+        vectors = edges[:, 1] - edges[:, 0]
+        lengths = numpy.sqrt((vectors * vectors).sum(axis=1))
+        lengths[lengths == 0] = 1
+        factors = numpy.array(sum([multipliers
+                for edge, multipliers in samples], []), dtype=numpy.float64) \
+                * numpy.repeat(lengths, counts)
+        points = numpy.repeat(edges[:, 0], counts, axis=0) \
+                + numpy.repeat(vectors / lengths[:, numpy.newaxis], counts,
+                        axis=0) * factors[:, numpy.newaxis]
+        (ccps, dists) = _intersect_torus_points(self._get_center(start),
+                ptuple(self.axis), self.distance_majorradius,
+                self.distance_minorradius, self.distance_majorradiussq,
+                self.distance_minorradiussq, direction, points)
+        offset = 0
+        for (edge, multipliers), count in zip(samples, counts):
+            if count == 0:
+                results.append((None, None, INFINITE, None))
+                continue
+            index = dists[offset:offset + count].argmin()
+            position = offset + index
+            offset += count
+            if dists[position] == INFINITE:
+                results.append((None, None, INFINITE, None))
+            else:
+                point = tuple(points[position].tolist())
+                ccp = tuple(ccps[position].tolist())
+                results.append((multipliers[index],
+                        padd(point, psub(start, ccp)),
+                        float(dists[position]), point))
+        return results
+
+    def _intersect_torus_edges(self, direction, edges, start=None):
+        """ calculate the intersections of the torus with multiple edges
+
+        The edges are processed together - this reduces the overhead of the
+        array based calculation.
+        @returns: the cutter location, the distance and the contact point for
+            each edge (see "_intersect_torus_edge")
+        @rtype: list(tuple)
+        """
         # TODO: calculate "optimal" scale:
         #  max(dir.dot(axis)/minor,dir.dot(dir.cross(axis).normalized())/major)
         # "When in doubt, use brute force." Ken Thompson
-        min_m = 0
-        min_l = INFINITE
-        min_cl = None
-        scale = int(edge.len / self.distance_minorradius * 2)
-        scale = max(3, scale)
-        for i in range(scale + 1):
-            m = float(i) / scale
-            p = edge.point_with_length_multiply(m)
-            (cl, ccp, cp, l) = self.intersect_torus_point(direction, p,
-                    start=start)
-            if not cl:
-                continue
-            if l < min_l:
-                min_m = m
-                min_l = l
-                min_cl = cl
-                min_cp = cp
-        if min_l == INFINITE:
-            return (None, INFINITE, None)
+        scales = []
+        samples = []
+        for edge in edges:
+            length = pnorm(psub(edge[1], edge[0]))
+            scale = int(length / self.distance_minorradius * 2)
+            scale = max(3, scale)
+            scales.append(scale)
+            if length == 0:
+                samples.append((edge, []))
+            else:
+                samples.append((edge,
+                        [float(i) / scale for i in range(scale + 1)]))
+        first_results = self._intersect_torus_samples(direction, samples,
+                start=start)
         scale2 = 10
-        for i in range(1, scale2 + 1):
-            m = min_m + ((float(i) / (scale2)) * 2 - 1)/scale
-            if (m < -epsilon) or (m > 1 + epsilon):
-                continue
-            p = edge.point_with_length_multiply(m)
-            (cl, ccp, cp, l) = self.intersect_torus_point(direction, p,
-                    start=start)
-            if not cl:
-                continue
-            if l < min_l:
-                min_l = l
-                min_cl = cl
-                min_cp = cp
-        return (min_cl, min_l, min_cp)
+        samples = []
+        for edge, scale, (min_m, min_cl, min_l, min_cp) in zip(edges, scales,
+                first_results):
+            multipliers = []
+            if min_l != INFINITE:
+                for i in range(1, scale2 + 1):
+                    m = min_m + ((float(i) / (scale2)) * 2 - 1)/scale
+                    if (m < -epsilon) or (m > 1 + epsilon):
+                        continue
+                    multipliers.append(m)
+            samples.append((edge, multipliers))
+        second_results = self._intersect_torus_samples(direction, samples,
+                start=start)
+        results = []
+        for (min_m, min_cl, min_l, min_cp), (m, cl, l, cp) in zip(
+                first_results, second_results):
+            if min_l == INFINITE:
+                results.append((None, INFINITE, None))
+            elif l < min_l:
+                results.append((cl, l, cp))
+            else:
+                results.append((min_cl, min_l, min_cp))
+        return results
 
-    def intersect_cylinder_point(self, direction, point, start=None):
+    def _intersect_torus_edge(self, direction, edge, start=None):
+        return self._intersect_torus_edges(direction, [edge], start=start)[0]
+
+    def intersect_torus_plane(self, direction, triangle, start=None):
+        return self._call_with_points(self._intersect_torus_plane, direction,
+                _get_plane_tuple(triangle), start)
+
+    def intersect_torus_triangle(self, direction, triangle, start=None):
+        return self._call_with_points(self._intersect_torus_triangle,
+                direction, self._get_triangle_tuple(triangle), start)
+
+    def intersect_torus_point(self, direction, point, start=None):
+        return self._call_with_points(self._intersect_torus_point, direction,
+                ptuple(point), start)
+
+    def intersect_torus_vertex(self, direction, point, start=None):
+        return self._call_with_points(self._intersect_torus_vertex, direction,
+                ptuple(point), start)
+
+    def intersect_torus_edge(self, direction, edge, start=None):
+        return self._call_with_points(self._intersect_torus_edge, direction,
+                _get_line_tuple(edge), start)
+
+    def _intersect_cylinder_point(self, direction, point, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_cylinder_point(
-                start.sub(self.location).add(self.center), self.axis,
-                self.distance_radius, self.distance_radiussq, direction, point)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_cylinder_point(self._get_center(start),
+                ptuple(self.axis), self.distance_radius,
+                self.distance_radiussq, direction, point)
         # offset intersection
         if ccp:
-            cl = start.add(direction.mul(l))
+            cl = padd(start, pmul(direction, l))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
-    def intersect_cylinder_line(self, direction, edge, start=None):
+    def _intersect_cylinder_line(self, direction, edge, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_cylinder_line(
-                start.sub(self.location).add(self.center), self.axis,
-                self.distance_radius, self.distance_radiussq, direction, edge)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_cylinder_line(self._get_center(start),
+                ptuple(self.axis), self.distance_radius,
+                self.distance_radiussq, direction, edge)
         # offset intersection
         if ccp:
-            cl = start.add(cp.sub(ccp))
+            cl = padd(start, psub(cp, ccp))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
-    def intersect_cylinder_edge(self, direction, edge, start=None):
-        (cl, ccp, cp, l) = self.intersect_cylinder_line(direction, edge,
+    def _intersect_cylinder_edge(self, direction, edge, start=None):
+        (cl, ccp, cp, l) = self._intersect_cylinder_line(direction, edge,
                 start=start)
-        if ccp and ccp.z < self.center.z:
+        if ccp and ccp[2] < self.center.z:
             return (None, INFINITE, None)
         if ccp:
-            m = cp.sub(edge.p1).dot(edge.dir)
-            if (m < -epsilon) or (m > edge.len + epsilon):
+            vector = psub(edge[1], edge[0])
+            m = pdot(psub(cp, edge[0]), pnormalized(vector))
+            if (m < -epsilon) or (m > pnorm(vector) + epsilon):
                 return (None, INFINITE, None)
         return (cl, l, cp)
 
-    def intersect_circle_plane(self, direction, triangle, start=None):
+    def _intersect_circle_plane(self, direction, plane, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_circle_plane(start,
-                self.distance_majorradius, direction, triangle)
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_circle_plane(start,
+                self.distance_majorradius, direction, plane)
         # offset intersection
         if ccp:
-            cl = cp.sub(ccp.sub(start))
+            cl = psub(cp, psub(ccp, start))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
-    def intersect_circle_point(self, direction, point, start=None):
+    def _intersect_circle_point(self, direction, point, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_circle_point(start, self.axis,
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_circle_point(start, ptuple(self.axis),
                 self.distance_majorradius, self.distance_majorradiussq,
                 direction, point)
         if ccp:
-            cl = cp.sub(ccp.sub(start))
+            cl = psub(cp, psub(ccp, start))
             return (cl, ccp, point, l)
         return (None, None, None, INFINITE)
 
-    def intersect_circle_line(self, direction, edge, start=None):
+    def _intersect_circle_line(self, direction, edge, start=None):
         if start is None:
-            start = self.location
-        (ccp, cp, l) = intersect_circle_line(start, self.axis,
+            start = ptuple(self.location)
+        (ccp, cp, l) = _intersect_circle_line(start, ptuple(self.axis),
                 self.distance_majorradius, self.distance_majorradiussq,
                 direction, edge)
         if ccp:
-            cl = cp.sub(ccp.sub(start))
+            cl = psub(cp, psub(ccp, start))
             return (cl, ccp, cp, l)
         return (None, None, None, INFINITE)
 
+    def _get_profile_heights(self, distances_sq):
+        # The torus is expanded by the required distance (keeping its major
+        # radius). Its flat bottom is the lowest part of the lower surface.
+        distances = numpy.sqrt(distances_sq) - self.majorradius
+        ring = numpy.maximum(0, self.distance_minorradiussq
+                - numpy.maximum(0, distances) ** 2)
+        return self.minorradius - numpy.sqrt(ring)
+
+    def _get_facet_contacts(self, normals):
+        # the torus touches the plane where its surface normal is "-normal"
+        flat = numpy.sqrt(normals[:, 0] ** 2 + normals[:, 1] ** 2)
+        flat[flat < epsilon] = INFINITE
+        contacts = -(self.majorradius / flat[:, numpy.newaxis]
+                + self.distance_minorradius) * normals[:, :2]
+        offsets = self.distance_minorradius * normals[:, 2] - self.minorradius
+        return contacts, offsets
+
+    def _get_profile_height(self, distance_sq):
+        distance = max(0, sqrt(distance_sq) - self.majorradius)
+        return self.minorradius \
+                - sqrt(max(0, self.distance_minorradiussq - distance ** 2))
+
+    def _get_facet_contact(self, normal):
+        flat = sqrt(normal[0] ** 2 + normal[1] ** 2)
+        if flat < epsilon:
+            flat = INFINITE
+        factor = self.majorradius / flat + self.distance_minorradius
+        return ((-factor * normal[0], -factor * normal[1]),
+                self.distance_minorradius * normal[2] - self.minorradius)
+
     def intersect(self, direction, triangle, start=None):
-        (cl_t, d_t, cp_t) = self.intersect_torus_triangle(direction, triangle,
+        (direction, triangle, start) = self._get_tuples(direction, triangle,
                 start=start)
+        points, edges = triangle[0], triangle[1]
+        (cl_t, d_t, cp_t) = self._intersect_torus_triangle(direction,
+                triangle, start=start)
         d = INFINITE
         cl = None
         cp = None
@@ -269,12 +412,8 @@ class ToroidalCutter(BaseCutter):
             d = d_t
             cl = cl_t
             cp = cp_t
-        (cl_e1, d_e1, cp_e1) = self.intersect_torus_edge(direction, triangle.e1,
-                start=start)
-        (cl_e2, d_e2, cp_e2) = self.intersect_torus_edge(direction, triangle.e2,
-                start=start)
-        (cl_e3, d_e3, cp_e3) = self.intersect_torus_edge(direction, triangle.e3,
-                start=start)
+        ((cl_e1, d_e1, cp_e1), (cl_e2, d_e2, cp_e2), (cl_e3, d_e3, cp_e3)) = \
+                self._intersect_torus_edges(direction, edges, start=start)
         if d_e1 < d:
             d = d_e1
             cl = cl_e1
@@ -287,12 +426,12 @@ class ToroidalCutter(BaseCutter):
             d = d_e3
             cl = cl_e3
             cp = cp_e3
-        (cl_p1, d_p1, cp_p1) = self.intersect_torus_vertex(direction,
-                triangle.p1, start=start)
-        (cl_p2, d_p2, cp_p2) = self.intersect_torus_vertex(direction,
-                triangle.p2, start=start)
-        (cl_p3, d_p3, cp_p3) = self.intersect_torus_vertex(direction,
-                triangle.p3, start=start)
+        (cl_p1, d_p1, cp_p1) = self._intersect_torus_vertex(direction,
+                points[0], start=start)
+        (cl_p2, d_p2, cp_p2) = self._intersect_torus_vertex(direction,
+                points[1], start=start)
+        (cl_p3, d_p3, cp_p3) = self._intersect_torus_vertex(direction,
+                points[2], start=start)
         if d_p1 < d:
             d = d_p1
             cl = cl_p1
@@ -305,18 +444,18 @@ class ToroidalCutter(BaseCutter):
             d = d_p3
             cl = cl_p3
             cp = cp_p3
-        (cl_t, d_t, cp_t) = self.intersect_circle_triangle(direction, triangle,
-                start=start)
+        (cl_t, d_t, cp_t) = self._intersect_circle_triangle(direction,
+                triangle, start=start)
         if d_t < d:
             d = d_t
             cl = cl_t
             cp = cp_t
-        (cl_p1, d_p1, cp_p1) = self.intersect_circle_vertex(direction,
-                triangle.p1, start=start)
-        (cl_p2, d_p2, cp_p2) = self.intersect_circle_vertex(direction,
-                triangle.p2, start=start)
-        (cl_p3, d_p3, cp_p3) = self.intersect_circle_vertex(direction,
-                triangle.p3, start=start)
+        (cl_p1, d_p1, cp_p1) = self._intersect_circle_vertex(direction,
+                points[0], start=start)
+        (cl_p2, d_p2, cp_p2) = self._intersect_circle_vertex(direction,
+                points[1], start=start)
+        (cl_p3, d_p3, cp_p3) = self._intersect_circle_vertex(direction,
+                points[2], start=start)
         if d_p1 < d:
             d = d_p1
             cl = cl_p1
@@ -329,12 +468,12 @@ class ToroidalCutter(BaseCutter):
             d = d_p3
             cl = cl_p3
             cp = cp_p3
-        (cl_e1, d_e1, cp_e1) = self.intersect_circle_edge(direction,
-                triangle.e1, start=start)
-        (cl_e2, d_e2, cp_e2) = self.intersect_circle_edge(direction,
-                triangle.e2, start=start)
-        (cl_e3, d_e3, cp_e3) = self.intersect_circle_edge(direction,
-                triangle.e3, start=start)
+        (cl_e1, d_e1, cp_e1) = self._intersect_circle_edge(direction,
+                edges[0], start=start)
+        (cl_e2, d_e2, cp_e2) = self._intersect_circle_edge(direction,
+                edges[1], start=start)
+        (cl_e3, d_e3, cp_e3) = self._intersect_circle_edge(direction,
+                edges[2], start=start)
         if d_e1 < d:
             d = d_e1
             cl = cl_e1
@@ -347,13 +486,13 @@ class ToroidalCutter(BaseCutter):
             d = d_e3
             cl = cl_e3
             cp = cp_e3
-        if direction.x != 0 or direction.y != 0:
-            (cl_p1, d_p1, cp_p1) = self.intersect_cylinder_vertex(direction,
-                    triangle.p1, start=start)
-            (cl_p2, d_p2, cp_p2) = self.intersect_cylinder_vertex(direction,
-                    triangle.p2, start=start)
-            (cl_p3, d_p3, cp_p3) = self.intersect_cylinder_vertex(direction,
-                    triangle.p3, start=start)
+        if direction[0] != 0 or direction[1] != 0:
+            (cl_p1, d_p1, cp_p1) = self._intersect_cylinder_vertex(direction,
+                    points[0], start=start)
+            (cl_p2, d_p2, cp_p2) = self._intersect_cylinder_vertex(direction,
+                    points[1], start=start)
+            (cl_p3, d_p3, cp_p3) = self._intersect_cylinder_vertex(direction,
+                    points[2], start=start)
             if d_p1 < d:
                 d = d_p1
                 cl = cl_p1
@@ -366,12 +505,12 @@ class ToroidalCutter(BaseCutter):
                 d = d_p3
                 cl = cl_p3
                 cp = cp_p3
-            (cl_e1, d_e1, cp_e1) = self.intersect_cylinder_edge(direction,
-                    triangle.e1, start=start)
-            (cl_e2, d_e2, cp_e2) = self.intersect_cylinder_edge(direction,
-                    triangle.e2, start=start)
-            (cl_e3, d_e3, cp_e3) = self.intersect_cylinder_edge(direction,
-                    triangle.e3, start=start)
+            (cl_e1, d_e1, cp_e1) = self._intersect_cylinder_edge(direction,
+                    edges[0], start=start)
+            (cl_e2, d_e2, cp_e2) = self._intersect_cylinder_edge(direction,
+                    edges[1], start=start)
+            (cl_e3, d_e3, cp_e3) = self._intersect_cylinder_edge(direction,
+                    edges[2], start=start)
             if d_e1 < d:
                 d = d_e1
                 cl = cl_e1
@@ -384,5 +523,5 @@ class ToroidalCutter(BaseCutter):
                 d = d_e3
                 cl = cl_e3
                 cp = cp_e3
-        return (cl, d, cp)
+        return self._get_points(cl, d, cp)
 
@@ -22,8 +22,15 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import decimal
+import itertools
 import os
 
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
 
 DEFAULT_HEADER = ("G40 (disable tool radius compensation)",
                 "G49 (disable tool length compensation)",
@@ -33,6 +40,13 @@ DEFAULT_HEADER = ("G40 (disable tool radius compensation)",
 
 PATH_MODES = {"exact_path": 0, "exact_stop": 1, "continuous": 2}
 MAX_DIGITS = 12
+# Numbers with more digits are written in scientific notation by "Decimal".
+# Only the simple formatting is supported by the batched move processing.
+MAX_BATCH_DIGITS = 6
+# number of moves to be processed at once by "add_moves"
+MOVES_CHUNK_SIZE = 10000
+# buffer size for output files opened by the GCodeGenerator
+OUTPUT_BUFFER_SIZE = 1024 * 1024
 
 
 def _get_num_of_significant_digits(number):
@@ -77,7 +91,7 @@ class GCodeGenerator(object):
             touch_off_pause_execution=False):
         if isinstance(destination, basestring):
             # open the file
-            self.destination = file(destination,"w")
+            self.destination = file(destination, "w", OUTPUT_BUFFER_SIZE)
             self._close_stream_on_exit = True
         else:
             # assume that "destination" is something like a StringIO instance
@@ -91,6 +105,9 @@ class GCodeGenerator(object):
         self.comment = comment
         # define all axes steps and the corresponding formatters
         self._axes_formatter = []
+        # number of digits and minimum steps (in units of the last digit)
+        self._axes_digits = []
+        self._axes_step_units = []
         if not minimum_steps:
             # default: minimum steps for all axes = 0.0001
             minimum_steps = [0.0001]
@@ -101,6 +118,10 @@ class GCodeGenerator(object):
                 step_width = minimum_steps[-1]
             conv = _get_num_converter(step_width)
             self._axes_formatter.append((conv(step_width), conv))
+            digits = _get_num_of_significant_digits(step_width)
+            self._axes_digits.append(digits)
+            self._axes_step_units.append(
+                    int(conv(step_width).scaleb(digits)))
         self._finished = False
         if comment:
             self.add_comment(comment)
@@ -238,8 +259,17 @@ class GCodeGenerator(object):
         if not skip_safety_height_move:
             self.add_move_to_safety()
         self.set_spindle_status(True)
-        for pos, rapid in moves:
-            self.add_move(pos, rapid=rapid)
+        if numpy_enabled and (max(self._axes_digits) <= MAX_BATCH_DIGITS):
+            # process the moves in chunks - "moves" may be a generator
+            moves = iter(moves)
+            while True:
+                chunk = list(itertools.islice(moves, MOVES_CHUNK_SIZE))
+                if not chunk:
+                    break
+                self._add_move_chunk(chunk)
+        else:
+            for pos, rapid in moves:
+                self.add_move(pos, rapid=rapid)
         # go back to safety height
         self.add_move_to_safety()
         self.set_spindle_status(False)
@@ -313,6 +343,129 @@ class GCodeGenerator(object):
         self.last_rapid = rapid
         self.append("%s %s" % (prefix, " ".join(pos_string)))
 
+    def _add_move_chunk(self, moves):
+        """ add a list of moves (position, rapid) at once
+
+        The result is the same as calling "add_move" for each move. But the
+        coordinates are rounded as arrays (represented as integer multiples of
+        the precision of each axis) and the resulting lines are written at
+        once.
+        """
+        if self._finished:
+            raise TypeError("GCodeGenerator: can't add further commands to " \
+                    + "a finished GCodeGenerator instance")
+        try:
+            positions = numpy.array([(pos.x, pos.y, pos.z)
+                    if hasattr(pos, "z") else pos for pos, rapid in moves],
+                    dtype=numpy.float64).reshape(-1, self.NUM_OF_AXES)
+        except (TypeError, ValueError):
+            # some coordinates are missing (None)
+            for pos, rapid in moves:
+                self.add_move(pos, rapid=rapid)
+            return
+        scales = numpy.array([10 ** digits for digits in self._axes_digits],
+                dtype=numpy.float64)
+        scaled = positions * scales
+        units = numpy.rint(scaled)
+        # Rounding the scaled values may differ from the string formatting
+        # (used by "add_move") for values close to the middle of two steps.
+        ambiguous = numpy.abs(numpy.abs(scaled - numpy.floor(scaled)) - 0.5) \
+                < 1e-6
+        for row, axis in zip(*numpy.nonzero(ambiguous)):
+            units[row, axis] = float(self._axes_formatter[axis][1](
+                    positions[row, axis]).scaleb(self._axes_digits[axis]))
+        units = units.astype(numpy.int64)
+        negative = numpy.signbit(positions)
+        # the last position (in units) or None
+        last = []
+        for index, value in enumerate(self.last_position):
+            if value is None:
+                last.append(None)
+            else:
+                last.append(int(value.scaleb(self._axes_digits[index])))
+        step_units = self._axes_step_units
+        if step_units == [1] * self.NUM_OF_AXES:
+            # A move is skipped, if it does not change any coordinate. Thus
+            # the previous move always equals the last written position.
+            previous = numpy.empty_like(units)
+            previous[1:] = units[:-1]
+            previous[0] = [0 if value is None else value for value in last]
+            changed = units != previous
+            for index, value in enumerate(last):
+                if value is None:
+                    changed[0, index] = True
+            selected = numpy.flatnonzero(changed.any(axis=1))
+            changed = changed[selected].tolist()
+            if len(selected):
+                last = units[selected[-1]].tolist()
+        else:
+            # the minimum step is bigger than the precision of the numbers
+            selected = []
+            changed = []
+            for row_index, row in enumerate(units.tolist()):
+                for index in range(self.NUM_OF_AXES):
+                    if (last[index] is None) or \
+                            (abs(row[index] - last[index]) >= step_units[index]):
+                        break
+                else:
+                    # no significant move
+                    continue
+                selected.append(row_index)
+                changed.append([(last[index] is None)
+                        or (row[index] != last[index])
+                        for index in range(self.NUM_OF_AXES)])
+                last = [row[index] if changed[-1][index] else last[index]
+                        for index in range(self.NUM_OF_AXES)]
+        if len(selected) == 0:
+            return
+        selected = numpy.asarray(selected, dtype=numpy.intp)
+        absolute = numpy.abs(units[selected])
+        signs = (negative[selected] | (units[selected] < 0)).tolist()
+        integers = []
+        fractions = []
+        for index, digits in enumerate(self._axes_digits):
+            scale = 10 ** digits
+            integers.append((absolute[:, index] // scale).tolist())
+            fractions.append((absolute[:, index] % scale).tolist())
+        templates = []
+        for axis_spec, digits in zip("XYZ", self._axes_digits):
+            if digits > 0:
+                templates.append("%s%%s%%d.%%0%dd" % (axis_spec, digits))
+            else:
+                templates.append("%s%%s%%d" % axis_spec)
+        rapids = [moves[index][1] for index in selected.tolist()]
+        lines = []
+        last_rapid = self.last_rapid
+        for row_index in range(len(selected)):
+            pos_string = []
+            row_changed = changed[row_index]
+            row_signs = signs[row_index]
+            for index in range(self.NUM_OF_AXES):
+                if row_changed[index]:
+                    if self._axes_digits[index] > 0:
+                        pos_string.append(templates[index] % (
+                                row_signs[index] and "-" or "",
+                                integers[index][row_index],
+                                fractions[index][row_index]))
+                    else:
+                        pos_string.append(templates[index] % (
+                                row_signs[index] and "-" or "",
+                                integers[index][row_index]))
+            rapid = rapids[row_index]
+            if rapid == last_rapid:
+                prefix = ""
+            elif rapid:
+                prefix = "G0"
+            else:
+                prefix = "G1"
+            last_rapid = rapid
+            lines.append("%s %s" % (prefix, " ".join(pos_string)))
+        self.last_rapid = last_rapid
+        self.last_position = [decimal.Decimal(value).scaleb(-digits)
+                for value, digits in zip(last, self._axes_digits)]
+        lines.append("")
+        self.destination.write(os.linesep.join(lines))
+
     def finish(self):
         self.add_move_to_safety()
         self.append("M2 (end program)")
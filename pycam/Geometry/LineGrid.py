@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from pycam.Geometry.utils import epsilon
+import math
+
+
+class LineGrid(object):
+    """ a uniform grid of lines for finding intersection candidates quickly
+
+    Every line is registered in all cells (in the x/y plane) touched by its
+    bounding box. Lines spanning a huge number of cells are kept in a
+    separate list instead - they are checked for every query.
+    The grid only returns candidates with overlapping bounding boxes (with
+    a tolerance of epsilon). The exact intersection test is left to the
+    caller (e.g. via "Line.get_intersection").
+    """
+
+    # lines covering more cells are not registered in the grid
+    MAX_CELLS_PER_LINE = 64
+
+    def __init__(self, lines, cell_size=None):
+        """ build the grid
+
+        @value lines: the lines to be indexed - their position in this list
+            is used as their index in all results
+        @type lines: list(pycam.Geometry.Line.Line)
+        @value cell_size: the width of a cell - the average size of the
+            lines is used by default
+        @type cell_size: float
+        """
+        self.lines = list(lines)
+        self._bounds = [(line.minx - epsilon, line.maxx + epsilon,
+                line.miny - epsilon, line.maxy + epsilon,
+                line.minz - epsilon, line.maxz + epsilon)
+                for line in self.lines]
+        if cell_size is None:
+            if self.lines:
+                cell_size = sum([max(line.maxx - line.minx,
+                        line.maxy - line.miny) for line in self.lines]) \
+                        / len(self.lines)
+            else:
+                cell_size = 0
+        # avoid tiny cells (e.g. for axis-parallel lines of zero length)
+        self.cell_size = max(cell_size, 16 * epsilon)
+        self._cells = {}
+        self._large_lines = []
+        for index, bounds in enumerate(self._bounds):
+            x_range, y_range = self._get_cell_ranges(*bounds[:4])
+            if len(x_range) * len(y_range) > self.MAX_CELLS_PER_LINE:
+                self._large_lines.append(index)
+                continue
+            for cell_x in x_range:
+                for cell_y in y_range:
+                    self._cells.setdefault((cell_x, cell_y), []).append(index)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def _get_cell_ranges(self, minx, maxx, miny, maxy):
+        size = self.cell_size
+        return (xrange(int(math.floor(minx / size)),
+                    int(math.floor(maxx / size)) + 1),
+                xrange(int(math.floor(miny / size)),
+                    int(math.floor(maxy / size)) + 1))
+
+    def get_bounds(self, index):
+        """ return the bounding box of a line (including epsilon)
+
+        @returns: minx, maxx, miny, maxy, minz, maxz
+        """
+        return self._bounds[index]
+
+    def search_indices(self, minx, maxx, miny, maxy, minz=None, maxz=None):
+        """ return the indices of all lines overlapping the given box
+
+        The z limits are ignored if they are not given.
+        @rtype: sorted list of int
+        """
+        x_range, y_range = self._get_cell_ranges(minx, maxx, miny, maxy)
+        candidates = set(self._large_lines)
+        if len(x_range) * len(y_range) > len(self._cells):
+            # the box covers the whole grid - look only at the used cells
+            for (cell_x, cell_y), indices in self._cells.iteritems():
+                if (x_range[0] <= cell_x <= x_range[-1]) \
+                        and (y_range[0] <= cell_y <= y_range[-1]):
+                    candidates.update(indices)
+        else:
+            cells = self._cells
+            for cell_x in x_range:
+                for cell_y in y_range:
+                    try:
+                        candidates.update(cells[(cell_x, cell_y)])
+                    except KeyError:
+                        pass
+        result = []
+        all_bounds = self._bounds
+        for index in candidates:
+            bounds = all_bounds[index]
+            if (bounds[0] <= maxx) and (minx <= bounds[1]) \
+                    and (bounds[2] <= maxy) and (miny <= bounds[3]) \
+                    and ((minz is None) or (bounds[4] <= maxz)) \
+                    and ((maxz is None) or (minz <= bounds[5])):
+                result.append(index)
+        result.sort()
+        return result
+
+    def search_line(self, index):
+        """ return the indices of all other lines close to the given line
+
+        @value index: the index of a line within the grid
+        @type index: int
+        @rtype: sorted list of int
+        """
+        result = self.search_indices(*self._bounds[index])
+        result.remove(index)
+        return result
+
+    def get_candidate_pairs(self):
+        """ return all pairs of lines with overlapping bounding boxes
+
+        @returns: pairs of line indices (the lower index first)
+        @rtype: sorted list of tuple(int, int)
+        """
+        pairs = set()
+        for index in xrange(len(self.lines)):
+            for other in self.search_line(index):
+                if index < other:
+                    pairs.add((index, other))
+        return sorted(pairs)
+
@@ -30,14 +30,18 @@ import pycam.Exporters.SVGExporter
 from pycam.Geometry.Triangle import Triangle
 from pycam.Geometry.Line import Line
 from pycam.Geometry.Plane import Plane
-from pycam.Geometry.Polygon import Polygon
+from pycam.Geometry.LineGrid import LineGrid
+from pycam.Geometry.Polygon import Polygon, PolygonContainmentTree
 from pycam.Geometry.Point import Point, Vector
-from pycam.Geometry.TriangleKdtree import TriangleKdtree
+from pycam.Geometry.TriangleKdtree import FlatTriangleKdtree
+from pycam.Geometry.TriangleMesh import TriangleMesh
+import pycam.Geometry.TriangleMesh
 from pycam.Geometry.Matrix import TRANSFORMATIONS
 from pycam.Toolpath import Bounds
 from pycam.Geometry.utils import INFINITE, epsilon
 from pycam.Geometry import TransformableContainer, IDGenerator
 from pycam.Utils import ProgressCounter
+from pycam.Utils.threading import run_in_parallel
 import pycam.Utils.log
 
 
@@ -48,6 +52,12 @@ except ImportError:
     GL_enabled = False
 
 
+try:
+    import numpy
+except ImportError:
+    pass
+
+
 log = pycam.Utils.log.get_logger()
 
 
@@ -70,13 +80,85 @@ def get_combined_bounds(models):
     return low, high
 
 def get_combined_model(models):
+    """ combine multiple triangle models without copying them
+
+    @returns: None (no models), the only model or a L{CompositeModel}
+    """
     # remove all "None" models
     models = [model for model in models if not model is None]
     if not models:
         return None
-    result = models.pop(0).copy()
-    while models:
-        result += models.pop(0)
+    elif len(models) == 1:
+        return models[0]
+    else:
+        return CompositeModel(models)
+
+
+# We need to use a global function here - otherwise it does not work with
+# the multiprocessing Pool.
+def _get_waterline_polygons((model, z, indices)):
+    """ slice the given triangles of a model and combine the lines
+
+    @returns: the "is_closed" flag and the coordinates of all points of each
+        resulting polygon
+    """
+    contour = ContourModel(plane=Plane(Point(0, 0, z), Vector(0, 0, 1)))
+    for p1, p2 in model.get_waterline_lines(z, indices):
+        contour.append(Line(Point(*p1), Point(*p2)))
+    return [(polygon.is_closed, [(point.x, point.y, point.z)
+                for point in polygon.get_points()])
+            for polygon in contour.get_polygons()]
+
+
+def _get_triangle_arrays_waterline_lines(corners, normals, z):
+    """ vectorized version of "Plane.intersect_triangle" for horizontal planes
+
+    @value corners: the three points of each triangle (clockwise)
+    @type corners: array of shape (N, 3, 3)
+    @value normals: the normal of each triangle
+    @type normals: array of shape (N, 3)
+    @value z: the height of the plane
+    @type z: float
+    @returns: start and end point of each line (running counter-clockwise)
+        or None for triangles without a line of intersection
+    @rtype: list of tuple(tuple(float), tuple(float))
+    """
+    starts = corners
+    ends = numpy.roll(corners, -1, axis=1)
+    edges = ends - starts
+    lengths = numpy.sqrt((edges * edges).sum(axis=2))
+    # flat edges cause divisions by zero - they are handled separately
+    old_settings = numpy.seterr(divide="ignore", invalid="ignore")
+    try:
+        directions = edges / lengths[:, :, numpy.newaxis]
+        # the distance between the start of an edge and the plane
+        distances = -(starts[:, :, 2] - z) / directions[:, :, 2]
+        collisions = starts + directions * distances[:, :, numpy.newaxis]
+        is_flat = directions[:, :, 2] == 0
+        crossing = ~is_flat & (-epsilon < distances) \
+                & (distances < lengths - epsilon)
+    finally:
+        numpy.seterr(**old_settings)
+    # flat edges on the plane contribute their start point
+    on_plane = is_flat & (numpy.abs(z - starts[:, :, 2]) < epsilon)
+    collisions[on_plane] = starts[on_plane]
+    valid = crossing | on_plane
+    # triangles with a single point or with all points on the plane are
+    # ignored
+    hits = valid.sum(axis=1) == 2
+    rows = numpy.nonzero(hits)[0]
+    first = valid[rows].argmax(axis=1)
+    second = 2 - valid[rows, ::-1].argmax(axis=1)
+    p1 = collisions[rows, first]
+    p2 = collisions[rows, second]
+    # the lines should run counter-clockwise through the triangles
+    diff = p2 - p1
+    reverse = (-diff[:, 1] * normals[rows, 0] + diff[:, 0] * normals[rows, 1]
+            >= 0) & diff.any(axis=1)
+    p1[reverse], p2[reverse] = p2[reverse], p1[reverse]
+    result = [None] * len(corners)
+    for row, start, end in zip(rows.tolist(), p1.tolist(), p2.tolist()):
+        result[row] = (tuple(start), tuple(end))
     return result
 
 
@@ -220,9 +302,27 @@ class BaseModel(IDGenerator, TransformableContainer):
 
 class Model(BaseModel):
 
-    def __init__(self, use_kdtree=True):
+    def __init__(self, use_kdtree=True, compact=False):
+        """ create a new triangle model
+
+        @value use_kdtree: use a kdtree for spatial queries via "triangles"
+        @type use_kdtree: bool
+        @value compact: store the triangles in contiguous arrays (see
+            L{TriangleMesh}) instead of keeping a L{Triangle} object for each
+            of them. This requires numpy and reduces the memory consumption of
+            large models significantly.
+        @type compact: bool
+        """
         super(Model, self).__init__()
-        self._triangles = []
+        if compact and not pycam.Geometry.TriangleMesh.numpy_enabled:
+            log.warn("The compact model storage requires numpy - falling " \
+                    + "back to the default storage.")
+            compact = False
+        if compact:
+            self._triangles = TriangleMesh()
+        else:
+            self._triangles = []
+        self._compact = compact
         self._item_groups.append(self._triangles)
         self._export_function = pycam.Exporters.STLExporter.STLExporter
         # marker for state of kdtree and uuid
@@ -232,7 +332,8 @@ class Model(BaseModel):
         self._t_kdtree = None
         self.__flat_groups_cache = {}
         self.__uuid = None
-        
+        self._z_order_cache = None
+
     def __len__(self):
         """ Return the number of available items in the model.
         This is mainly useful for evaluating an empty model as False.
@@ -240,9 +341,62 @@ class Model(BaseModel):
         return len(self._triangles)
 
     def copy(self):
-        result = self.__class__(use_kdtree=self._use_kdtree)
-        for triangle in self.triangles():
-            result.append(triangle.copy())
+        result = self.__class__(use_kdtree=self._use_kdtree,
+                compact=self._compact)
+        if self._compact:
+            result.extend_arrays(*self._triangles.get_arrays())
+        else:
+            for triangle in self.triangles():
+                result.append(triangle.copy())
+        return result
+
+    def is_compact(self):
+        return self._compact
+
+    def get_shared_arrays(self):
+        """ return the triangles and the kdtree of the model as flat arrays
+
+        The result is suitable for transferring the model to other processes
+        without pickling every triangle (see L{from_shared_arrays}). Models
+        that are not compact are converted. This requires numpy.
+        @rtype: dict of arrays
+        """
+        if self._dirty:
+            self._update_caches()
+        if self._compact:
+            mesh = self._triangles
+        else:
+            mesh = TriangleMesh()
+            for triangle in self._triangles:
+                mesh.append(triangle)
+        result = {"vertices": mesh.vertices, "faces": mesh.faces,
+                "normals": mesh.normals, "bounds": mesh.bounds}
+        if self._use_kdtree:
+            for name, values in self._t_kdtree.get_arrays().iteritems():
+                result["kdtree_" + name] = values
+        return result
+
+    @classmethod
+    def from_shared_arrays(cls, arrays, model_uuid=None):
+        """ create a compact model based on the result of "get_shared_arrays"
+
+        The arrays are used without copying them. Read-only arrays are copied
+        before the model is transformed.
+        @value model_uuid: the uuid of the original model
+        @type model_uuid: str
+        """
+        use_kdtree = "kdtree_item_order" in arrays
+        result = cls(use_kdtree=use_kdtree, compact=True)
+        result._triangles.set_arrays(arrays["vertices"], arrays["faces"],
+                arrays["normals"], arrays["bounds"])
+        result._update_mesh_limits()
+        if use_kdtree:
+            kdtree_arrays = dict([(name, arrays["kdtree_" + name])
+                    for name in FlatTriangleKdtree.ARRAY_NAMES])
+            result._t_kdtree = FlatTriangleKdtree.from_arrays(kdtree_arrays,
+                    result._triangles)
+        result.__uuid = model_uuid or str(uuid.uuid4())
+        result._dirty = False
         return result
 
     @property
@@ -258,14 +412,69 @@ class Model(BaseModel):
             # we assume, that the kdtree needs to be rebuilt again
             self._dirty = True
 
+    def extend_arrays(self, vertices, faces, normals=None):
+        """ add triangles given as arrays (see L{TriangleMesh.extend_arrays})
+
+        Models that are not compact create a L{Triangle} for every face.
+        """
+        if not self._compact:
+            points = [Point(float(x), float(y), float(z))
+                    for x, y, z in vertices]
+            if normals is None:
+                normals = [None] * len(faces)
+            for (index1, index2, index3), normal in zip(faces, normals):
+                if (normal is None) or not any(normal):
+                    # the triangle calculates its normal
+                    normal = None
+                else:
+                    normal = Vector(*[float(value) for value in normal])
+                self.append(Triangle(points[index1], points[index2],
+                        points[index3], normal))
+            return
+        self._triangles.extend_arrays(vertices, faces, normals)
+        self._update_mesh_limits()
+        self._dirty = True
+
+    def _update_mesh_limits(self):
+        limits = self._triangles.get_limits()
+        if limits is None:
+            self.minx = self.miny = self.minz = None
+            self.maxx = self.maxy = self.maxz = None
+        else:
+            (self.minx, self.miny, self.minz), \
+                    (self.maxx, self.maxy, self.maxz) = limits
+
+    def get_children_count(self):
+        if self._compact:
+            return self._triangles.get_children_count()
+        else:
+            return super(Model, self).get_children_count()
+
+    def transform_by_matrix(self, matrix, transformed_list=None, callback=None):
+        if self._compact:
+            # transform the arrays directly instead of all triangle views
+            self._triangles.transform_by_matrix(matrix, callback=callback)
+            self.reset_cache()
+        else:
+            super(Model, self).transform_by_matrix(matrix,
+                    transformed_list=transformed_list, callback=callback)
+
     def reset_cache(self):
-        super(Model, self).reset_cache()
+        if self._compact:
+            self._update_mesh_limits()
+        else:
+            super(Model, self).reset_cache()
         # the triangle kdtree needs to be reset after transforming the model
         self._update_caches()
 
     def _update_caches(self):
         if self._use_kdtree:
-            self._t_kdtree = TriangleKdtree(self.triangles())
+            if self._compact:
+                bounds = self._triangles.bounds[:, :4]
+            else:
+                bounds = [(t.minx, t.maxx, t.miny, t.maxy)
+                        for t in self._triangles]
+            self._t_kdtree = FlatTriangleKdtree(bounds, self._triangles)
         self.__uuid = str(uuid.uuid4())
         self.__flat_groups_cache = {}
         # the kdtree is up-to-date again
@@ -283,7 +492,42 @@ class Model(BaseModel):
             return self._t_kdtree.Search(minx, maxx, miny, maxy)
         return self._triangles
 
+    def get_triangle_arrays(self, minx=-INFINITE, miny=-INFINITE,
+            maxx=+INFINITE, maxy=+INFINITE):
+        """ return the corner points of all triangles overlapping a rectangle
+
+        This requires numpy. Compact models just pick the relevant rows of
+        their arrays.
+        @returns: the three corner points of each triangle
+        @rtype: array of shape (N, 3, 3)
+        """
+        if self._dirty:
+            self._update_caches()
+        if self._use_kdtree:
+            indices = self._t_kdtree.search_indices(minx, maxx, miny, maxy)
+        else:
+            indices = range(len(self._triangles))
+        if self._compact:
+            indices = numpy.array(indices, dtype=numpy.intp)
+            return self._triangles.vertices[self._triangles.faces[indices]]
+        else:
+            triangles = self._triangles
+            coords = []
+            for index in indices:
+                t = triangles[index]
+                coords.append(((t.p1.x, t.p1.y, t.p1.z),
+                        (t.p2.x, t.p2.y, t.p2.z), (t.p3.x, t.p3.y, t.p3.z)))
+            return numpy.array(coords, dtype=numpy.float64).reshape(-1, 3, 3)
+
     def get_waterline_contour(self, plane, callback=None):
+        if (plane.n.x == 0) and (plane.n.y == 0) and (plane.n.z > 0):
+            # horizontal planes are handled by the slicing of layers
+            result = self.get_waterline_contours([plane.p.z],
+                    callback=callback, disable_multiprocessing=True)
+            if result is None:
+                return
+            else:
+                return result[0]
         collision_lines = []
         progress_max = 2 * len(self._triangles)
         counter = 0
@@ -308,6 +552,127 @@ class Model(BaseModel):
                 [len(p.get_lines()) for p in contour.get_polygons()]))
         return contour
 
+    def _get_z_order(self):
+        """ return the triangles sorted by their lower and upper z limits
+
+        The result is cached until the model changes.
+        @returns: minz and maxz of all triangles and the indices of all
+            triangles sorted by minz and by maxz
+        """
+        model_uuid = self.uuid
+        if (self._z_order_cache is None) \
+                or (self._z_order_cache[0] != model_uuid):
+            if self._compact:
+                bounds = self._triangles.bounds
+                minz = bounds[:, 4].tolist()
+                maxz = bounds[:, 5].tolist()
+                order_min = numpy.argsort(bounds[:, 4], kind="mergesort")
+                order_max = numpy.argsort(bounds[:, 5], kind="mergesort")
+                order_min, order_max = order_min.tolist(), order_max.tolist()
+            else:
+                minz = [t.minz for t in self._triangles]
+                maxz = [t.maxz for t in self._triangles]
+                order_min = sorted(range(len(minz)), key=minz.__getitem__)
+                order_max = sorted(range(len(maxz)), key=maxz.__getitem__)
+            self._z_order_cache = (model_uuid,
+                    (minz, maxz, order_min, order_max))
+        return self._z_order_cache[1]
+
+    def get_waterline_lines(self, z, indices=None):
+        """ intersect triangles with a horizontal plane
+
+        @value z: the height of the plane
+        @type z: float
+        @value indices: the indices of the triangles to be checked (all
+            triangles by default)
+        @type indices: list of int
+        @returns: the start and end point of each line of intersection
+            (running counter-clockwise through its triangle)
+        @rtype: list of tuple(tuple(float), tuple(float))
+        """
+        if indices is None:
+            indices = range(len(self._triangles))
+        if self._compact:
+            if not indices:
+                return []
+            indices = numpy.array(indices, dtype=numpy.intp)
+            corners = self._triangles.vertices[self._triangles.faces[indices]]
+            lines = _get_triangle_arrays_waterline_lines(corners,
+                    self._triangles.normals[indices], z)
+            return [line for line in lines if not line is None]
+        result = []
+        plane = Plane(Point(0, 0, z), Vector(0, 0, 1))
+        for index in indices:
+            line = plane.intersect_triangle(self._triangles[index],
+                    counter_clockwise=True)
+            if not line is None:
+                result.append(((line.p1.x, line.p1.y, line.p1.z),
+                        (line.p2.x, line.p2.y, line.p2.z)))
+        return result
+
+    def get_waterline_contours(self, z_levels, callback=None,
+            disable_multiprocessing=False):
+        """ calculate the waterlines of the model for multiple heights
+
+        The triangles are sorted by their z limits once. The planes are
+        processed in ascending order - only the triangles crossing the
+        current height are checked for each layer. The layers are sliced in
+        parallel.
+        @value z_levels: the heights of the horizontal planes
+        @type z_levels: list of float
+        @value callback: a function accepting the "percent" of progress and
+            returning True if the operation should be cancelled
+        @type callback: function
+        @returns: one contour model for every height (in the given order)
+            or None if the operation was cancelled
+        @rtype: list of ContourModel
+        """
+        minz, maxz, order_min, order_max = self._get_z_order()
+        heights = sorted(set(z_levels))
+        active = set()
+        add_index = 0
+        remove_index = 0
+        args = []
+        for z in heights:
+            # add all triangles starting below the plane
+            while (add_index < len(order_min)) \
+                    and (minz[order_min[add_index]] <= z + epsilon):
+                active.add(order_min[add_index])
+                add_index += 1
+            # remove all triangles ending below the plane
+            while (remove_index < len(order_max)) \
+                    and (maxz[order_max[remove_index]] < z - epsilon):
+                active.discard(order_max[remove_index])
+                remove_index += 1
+            args.append((self, z, sorted(active)))
+        progress_counter = ProgressCounter(len(args), callback)
+        contours = {}
+        # the lines are combined into polygons by the parallel processes
+        for (model, z, indices), polygons in zip(args,
+                run_in_parallel(_get_waterline_polygons, args,
+                    disable_multiprocessing=disable_multiprocessing,
+                    callback=progress_counter.update)):
+            plane = Plane(Point(0, 0, z), Vector(0, 0, 1))
+            contour = ContourModel(plane=plane)
+            for is_closed, coords in polygons:
+                points = [Point(*values) for values in coords]
+                if is_closed:
+                    points.append(points[0])
+                polygon = Polygon(plane=plane)
+                for index in range(len(points) - 1):
+                    polygon.append(Line(points[index], points[index + 1]))
+                contour.append(polygon)
+            log.debug("Waterline: %f - %d - %s" % (z,
+                    len(contour.get_polygons()),
+                    [len(p.get_lines()) for p in contour.get_polygons()]))
+            contours[z] = contour
+            if progress_counter.increment():
+                return None
+        if len(contours) < len(heights):
+            # the operation was cancelled
+            return None
+        return [contours[z] for z in z_levels]
+
     def get_flat_areas(self, min_area=None):
         """ Find plane areas (combinations of triangles) bigger than 'min_area'
         and ignore vertical planes. The result is cached.
@@ -352,8 +717,111 @@ class Model(BaseModel):
         return self.__flat_groups_cache[min_area]
 
 
+class CompositeModel(object):
+    """ a read-only view combining multiple triangle models
+
+    Spatial queries ("triangles" and "get_triangle_arrays") are passed to the
+    kdtrees of all models. Their results are merged - the triangles are
+    neither copied nor indexed again. Changes of the models are visible
+    via the view immediately.
+    """
+
+    def __init__(self, models):
+        self.models = list(models)
+
+    def __len__(self):
+        return sum([len(model) for model in self.models])
+
+    def _get_limit(self, attr, func):
+        values = [getattr(model, attr) for model in self.models]
+        values = [value for value in values if not value is None]
+        if values:
+            return func(values)
+        else:
+            return None
+
+    minx = property(lambda self: self._get_limit("minx", min))
+    miny = property(lambda self: self._get_limit("miny", min))
+    minz = property(lambda self: self._get_limit("minz", min))
+    maxx = property(lambda self: self._get_limit("maxx", max))
+    maxy = property(lambda self: self._get_limit("maxy", max))
+    maxz = property(lambda self: self._get_limit("maxz", max))
+
+    @property
+    def uuid(self):
+        """ the uuid changes whenever one of the models is changed """
+        return str(uuid.uuid5(uuid.NAMESPACE_OID,
+                " ".join([str(model.uuid) for model in self.models])))
+
+    def is_compact(self):
+        return False
+
+    def maxsize(self):
+        return max(abs(self.maxx), abs(self.minx), abs(self.maxy),
+                abs(self.miny), abs(self.maxz), abs(self.minz))
+
+    def get_bounds(self):
+        return Bounds(Bounds.TYPE_CUSTOM, (self.minx, self.miny, self.minz),
+                (self.maxx, self.maxy, self.maxz))
+
+    def triangles(self, minx=-INFINITE, miny=-INFINITE, minz=-INFINITE,
+            maxx=+INFINITE, maxy=+INFINITE, maxz=+INFINITE):
+        results = [model.triangles(minx=minx, miny=miny, minz=minz, maxx=maxx,
+                maxy=maxy, maxz=maxz) for model in self.models]
+        if len(results) == 1:
+            return results[0]
+        elif (minx == miny == minz == -INFINITE) \
+                and (maxx == maxy == maxz == +INFINITE):
+            # all triangles are requested - avoid a huge list
+            return _ChainedSequence(results)
+        else:
+            result = []
+            for triangles in results:
+                result.extend(triangles)
+            return result
+
+    def get_triangle_arrays(self, minx=-INFINITE, miny=-INFINITE,
+            maxx=+INFINITE, maxy=+INFINITE):
+        """ see L{Model.get_triangle_arrays} """
+        arrays = [model.get_triangle_arrays(minx, miny, maxx, maxy)
+                for model in self.models]
+        if len(arrays) == 1:
+            return arrays[0]
+        else:
+            return numpy.concatenate(arrays)
+
+
+class _ChainedSequence(object):
+    """ a read-only sequence consisting of multiple sequences """
+
+    def __init__(self, sequences):
+        self._sequences = sequences
+
+    def __len__(self):
+        return sum([len(sequence) for sequence in self._sequences])
+
+    def __iter__(self):
+        for sequence in self._sequences:
+            for item in sequence:
+                yield item
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        for sequence in self._sequences:
+            if index < len(sequence):
+                return sequence[index]
+            index -= len(sequence)
+        raise IndexError("sequence index out of range")
+
+
 class ContourModel(BaseModel):
 
+    # The endpoints of open polygons are indexed by their coordinates divided
+    # by this size. Points closer than "epsilon" are located in the same or
+    # in neighbouring cells.
+    ENDPOINT_CELL_SIZE = 2 * epsilon
+
     def __init__(self, plane=None):
         super(ContourModel, self).__init__()
         self.name = "contourmodel%d" % self.id
@@ -369,6 +837,11 @@ class ContourModel(BaseModel):
         self._cached_offset_models = {}
         self._export_function = \
                 pycam.Exporters.SVGExporter.SVGExporterContourModel
+        # the index of the endpoints of all open polygons
+        self._endpoint_index = None
+        self._endpoint_cells = {}
+        self._line_group_order = {}
+        self._line_group_counter = 0
 
     def __len__(self):
         """ Return the number of available items in the model.
@@ -386,6 +859,98 @@ class ContourModel(BaseModel):
         super(ContourModel, self).reset_cache()
         # reset the offset model cache
         self._cached_offset_models = {}
+        # the polygons were probably changed
+        self._reset_endpoint_index()
+
+    def _reset_endpoint_index(self):
+        # the index is rebuilt when it is used the next time
+        self._endpoint_index = None
+        self._endpoint_cells = {}
+        self._line_group_order = {}
+
+    def _get_endpoint_index(self):
+        """ return the endpoint index of all open polygons
+
+        Every cell (see L{ENDPOINT_CELL_SIZE}) contains the list of polygons
+        with an endpoint within this cell. Empty polygons are stored in the
+        cell "None" - they are connectable with any line.
+        """
+        if self._endpoint_index is None:
+            self._endpoint_index = {}
+            self._line_group_counter = 0
+            for polygon in self._line_groups:
+                self._line_group_order[polygon] = self._line_group_counter
+                self._line_group_counter += 1
+                self._update_endpoint_index(polygon)
+        return self._endpoint_index
+
+    def _get_endpoint_cell(self, point):
+        size = self.ENDPOINT_CELL_SIZE
+        return (int(math.floor(float(point.x) / size)),
+                int(math.floor(float(point.y) / size)),
+                int(math.floor(float(point.z) / size)))
+
+    def _update_endpoint_index(self, polygon):
+        """ update the index entries of a polygon after it was changed """
+        index = self._endpoint_index
+        if index is None:
+            return
+        for cell in self._endpoint_cells.pop(polygon, ()):
+            polygons = index[cell]
+            polygons.remove(polygon)
+            if not polygons:
+                del index[cell]
+        if polygon.is_closed or not polygon in self._line_group_order:
+            return
+        points = polygon.get_points()
+        if points:
+            cells = set((self._get_endpoint_cell(points[0]),
+                    self._get_endpoint_cell(points[-1])))
+        else:
+            cells = (None, )
+        for cell in cells:
+            index.setdefault(cell, []).append(polygon)
+        self._endpoint_cells[polygon] = cells
+
+    def _add_line_group(self, polygon):
+        self._line_groups.append(polygon)
+        if not self._endpoint_index is None:
+            self._line_group_order[polygon] = self._line_group_counter
+            self._line_group_counter += 1
+            self._update_endpoint_index(polygon)
+
+    def _remove_line_group(self, polygon):
+        self._line_groups.remove(polygon)
+        if not self._endpoint_index is None:
+            del self._line_group_order[polygon]
+            self._update_endpoint_index(polygon)
+
+    def _get_line_groups_near_points(self, points, reverse=False):
+        """ return all open polygons with an endpoint near one of the given
+        points
+
+        The polygons are returned in the order of L{get_polygons} (or in
+        reversed order). Some of them may be too far away - use
+        "is_connectable" for an exact check.
+        """
+        index = self._get_endpoint_index()
+        size = self.ENDPOINT_CELL_SIZE
+        result = set(index.get(None, ()))
+        for point in points:
+            # usually two cells per dimension contain all points within
+            # epsilon (three in case of rounding errors)
+            cell_ranges = []
+            for value in (point.x, point.y, point.z):
+                value = float(value)
+                cell_ranges.append(xrange(
+                        int(math.floor((value - epsilon) / size)),
+                        int(math.floor((value + epsilon) / size)) + 1))
+            for cell_x in cell_ranges[0]:
+                for cell_y in cell_ranges[1]:
+                    for cell_z in cell_ranges[2]:
+                        result.update(index.get((cell_x, cell_y, cell_z), ()))
+        return sorted(result, key=self._line_group_order.get,
+                reverse=reverse)
 
     def _merge_polygon_if_possible(self, other_polygon, allow_reverse=False):
         """ Check if the given 'other_polygon' can be connected to another
@@ -400,14 +965,23 @@ class ContourModel(BaseModel):
         connectors.append(other_polygon.get_points()[-1])
         # filter all polygons that can be combined with 'other_polygon'
         connectables = []
-        for lg in self._line_groups:
+        for lg in self._get_line_groups_near_points(connectors):
             if lg is other_polygon:
                 continue
             for connector in connectors:
                 if lg.is_connectable(connector):
                     connectables.append(lg)
                     break
-        # merge 'other_polygon' with all other connectable polygons
+        self._merge_polygons(other_polygon, connectors, connectables,
+                allow_reverse)
+        # update the index of all changed polygons
+        self._update_endpoint_index(other_polygon)
+        for polygon in connectables:
+            self._update_endpoint_index(polygon)
+
+    def _merge_polygons(self, other_polygon, connectors, connectables,
+            allow_reverse):
+        """ merge 'other_polygon' with all other connectable polygons """
         for polygon in connectables:
             # check again, if the polygon is still connectable
             for connector in connectors:
@@ -416,12 +990,23 @@ class ContourModel(BaseModel):
             else:
                 # skip this polygon
                 continue
+            if len(polygon.get_points()) > len(other_polygon.get_points()):
+                # Append the lines of the shorter polygon - otherwise long
+                # chains of lines would be copied again and again.
+                for attribute in ("_points", "minx", "maxx", "miny", "maxy",
+                        "minz", "maxz"):
+                    other_value = getattr(other_polygon, attribute)
+                    setattr(other_polygon, attribute,
+                            getattr(polygon, attribute))
+                    setattr(polygon, attribute, other_value)
+                other_polygon._reset_shape_cache()
+                polygon._reset_shape_cache()
             if other_polygon.get_points()[-1] == polygon.get_points()[0]:
                 for line in polygon.get_lines():
                     if other_polygon.is_closed:
                         return
                     other_polygon.append(line)
-                self._line_groups.remove(polygon)
+                self._remove_line_group(polygon)
             elif other_polygon.get_points()[0] == polygon.get_points()[-1]:
                 lines = polygon.get_lines()
                 lines.reverse()
@@ -429,7 +1014,7 @@ class ContourModel(BaseModel):
                     if other_polygon.is_closed:
                         return
                     other_polygon.append(line)
-                self._line_groups.remove(polygon)
+                self._remove_line_group(polygon)
             elif allow_reverse:
                 if other_polygon.get_points()[-1] == polygon.get_points()[-1]:
                     polygon.reverse_direction()
@@ -437,7 +1022,7 @@ class ContourModel(BaseModel):
                         if other_polygon.is_closed:
                             return
                         other_polygon.append(line)
-                    self._line_groups.remove(polygon)
+                    self._remove_line_group(polygon)
                 elif other_polygon.get_points()[0] == polygon.get_points()[0]:
                     polygon.reverse_direction()
                     lines = polygon.get_lines()
@@ -446,7 +1031,7 @@ class ContourModel(BaseModel):
                         if other_polygon.is_closed:
                             return
                         other_polygon.append(line)
-                    self._line_groups.remove(polygon)
+                    self._remove_line_group(polygon)
                 else:
                     pass
             else:
@@ -464,12 +1049,13 @@ class ContourModel(BaseModel):
             found = False
             # Going back from the end to start. The last line_group always has
             # the highest chance of being suitable for the next line.
-            line_group_indexes = xrange(len(self._line_groups) - 1, -1, -1)
-            for line_group_index in line_group_indexes:
-                line_group = self._line_groups[line_group_index]
+            line_groups = self._get_line_groups_near_points((item.p1, item.p2),
+                    reverse=True)
+            for line_group in line_groups:
                 for candidate in item_list:
                     if line_group.is_connectable(candidate):
                         line_group.append(candidate)
+                        self._update_endpoint_index(line_group)
                         self._merge_polygon_if_possible(line_group,
                                 allow_reverse=allow_reverse)
                         found = True
@@ -480,10 +1066,10 @@ class ContourModel(BaseModel):
                 # add a single line as part of a new group
                 new_line_group = Polygon(plane=self._plane)
                 new_line_group.append(item)
-                self._line_groups.append(new_line_group)
+                self._add_line_group(new_line_group)
         elif isinstance(item, Polygon):
             if not unify_overlaps or (len(self._line_groups) == 0):
-                self._line_groups.append(item)
+                self._add_line_group(item)
                 for subitem in item.next():
                     self._update_limits(subitem)
             else:
@@ -569,7 +1155,7 @@ class ContourModel(BaseModel):
             progress_callback = None
         # try to connect all open polygons
         for poly in open_polygons:
-            self._line_groups.remove(poly)
+            self._remove_line_group(poly)
         poly_open_before = len(open_polygons)
         for poly in open_polygons:
             for line in poly.get_lines():
@@ -592,21 +1178,28 @@ class ContourModel(BaseModel):
             progress_callback(2 * (number_of_initial_closed_polygons - \
                     len(remaining_polys)))
         remaining_polys.sort(key=lambda poly: abs(poly.get_area()))
+        tree = PolygonContainmentTree(remaining_polys)
+        # the position within "finished" and the direction of each polygon
+        finished_polys = {}
         while remaining_polys:
             # pick the largest polygon
             current = remaining_polys.pop()
-            # start with the smallest finished polygon
-            for comp, is_outer in finished:
-                if comp.is_polygon_inside(current):
-                    finished.insert(0, (current, not is_outer))
-                    break
+            # use the smallest (most recently) finished enclosing polygon
+            enclosing = [comp for comp in tree.get_containers(current)
+                    if comp in finished_polys]
+            if enclosing:
+                comp = max(enclosing, key=lambda poly: finished_polys[poly][0])
+                is_outer = not finished_polys[comp][1]
             else:
                 # no enclosing polygon was found
-                finished.insert(0, (current, True))
+                is_outer = True
+            finished_polys[current] = (len(finished), is_outer)
+            finished.append((current, is_outer))
             if progress_callback and progress_callback():
                 return
         # Adjust the directions of all polygons according to the result
-        # of the previous analysis.
+        # of the previous analysis (the smallest polygons first).
+        finished.reverse()
         change_counter = 0
         for polygon, is_outer in finished:
             if polygon.is_outer() != is_outer:
@@ -708,6 +1301,9 @@ class ContourModel(BaseModel):
         Returns None if the optional "callback" returns True (e.g. the user
         interrupted the operation).
         Otherwise it returns False if no intersections were found.
+        If "find_all_collisions" is enabled, then a list of the indices of
+        all pairs of colliding line groups is returned instead (each pair
+        only once).
         """
         def check_bounds_of_groups(g1, g2):
             if (g1.minx <= g2.minx <= g1.maxx) \
@@ -727,25 +1323,50 @@ class ContourModel(BaseModel):
                         # z overlaps as well
                         return True
             return False
-        # check each pair of line groups for intersections
+        # all lines of the model are indexed in a uniform grid - thus only
+        # lines with overlapping bounding boxes need to be checked
+        all_lines = []
+        line_owners = []
+        for index, group in enumerate(self._line_groups):
+            for line_index, line in enumerate(group.get_lines()):
+                all_lines.append(line)
+                line_owners.append((index, line_index))
+        grid = LineGrid(all_lines)
         intersections = []
-        for index1, group1 in enumerate(self._line_groups[:-1]):
-            for index2, group2 in enumerate(self._line_groups):
-                if index2 <= index1:
-                    # avoid double-checks
+        line_offset = 0
+        for index1, group1 in enumerate(self._line_groups):
+            lines1 = group1.get_lines()
+            # collect the candidates of all lines of this group - they are
+            # checked in the order of the groups (as if comparing pairs)
+            candidates = []
+            overlapping_groups = {}
+            for line_index1 in range(len(lines1)):
+                for other in grid.search_line(line_offset + line_index1):
+                    index2, line_index2 = line_owners[other]
+                    if index2 <= index1:
+                        # avoid double-checks
+                        continue
+                    if not index2 in overlapping_groups:
+                        overlapping_groups[index2] = check_bounds_of_groups(
+                                group1, self._line_groups[index2])
+                    if overlapping_groups[index2]:
+                        candidates.append((index2, line_index1, line_index2,
+                                other))
+            line_offset += len(lines1)
+            candidates.sort()
+            colliding_groups = set()
+            for index2, line_index1, line_index2, other in candidates:
+                if index2 in colliding_groups:
                     continue
-                # check if both groups overlap - otherwise skip this pair
-                if check_bounds_of_groups(group1, group2):
-                    # check each pair of lines for intersections
-                    for line1 in group1.get_lines():
-                        for line2 in group2.get_lines():
-                            intersection, factor = line1.get_intersection(line2)
-                            if intersection:
-                                if find_all_collisions:
-                                    intersections.append((index1, index2))
-                                else:
-                                    # return just the place of intersection
-                                    return intersection
+                intersection, factor = lines1[line_index1].get_intersection(
+                        all_lines[other])
+                if intersection:
+                    if find_all_collisions:
+                        colliding_groups.add(index2)
+                        intersections.append((index1, index2))
+                    else:
+                        # return just the place of intersection
+                        return intersection
             # update the progress visualization and quit if requested
             if callback and callback():
                 if find_all_collisions:
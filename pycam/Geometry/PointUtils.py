@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+
+Vector operations for plain tuples (x, y, z).
+
+The methods of L{pycam.Geometry.Point.Point} create a new object (with a new
+id) for every result. The functions below are meant for the inner loops of
+the collision detection - they work on tuples and return tuples.
+The "*_many" functions are the equivalents for arrays of shape (N, 3). They
+require numpy.
+"""
+
+from pycam.Geometry.utils import sqrt
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+
+def ptuple(point):
+    """ return the coordinates of a L{Point} as a tuple """
+    return (point.x, point.y, point.z)
+
+def padd(a, b):
+    return (a[0] + b[0], a[1] + b[1], a[2] + b[2])
+
+def psub(a, b):
+    return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+def pmul(a, c):
+    return (a[0] * c, a[1] * c, a[2] * c)
+
+def pdiv(a, c):
+    return (a[0] / c, a[1] / c, a[2] / c)
+
+def pdot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def pcross(a, b):
+    return (a[1] * b[2] - b[1] * a[2], b[0] * a[2] - a[0] * b[2],
+            a[0] * b[1] - b[0] * a[1])
+
+def pnormsq(a):
+    return a[0] * a[0] + a[1] * a[1] + a[2] * a[2]
+
+def pnorm(a):
+    return sqrt(pnormsq(a))
+
+def pnormalized(a):
+    """ return the vector with a length of one (or None for a null vector) """
+    n = pnorm(a)
+    if n == 0:
+        return None
+    else:
+        return (a[0] / n, a[1] / n, a[2] / n)
+
+def pdot_many(a, b):
+    return (a * b).sum(axis=1)
+
+def pcross_many(a, b):
+    return numpy.cross(a, b)
+
+def pnormsq_many(a):
+    return (a * a).sum(axis=1)
+
+def pnorm_many(a):
+    return numpy.sqrt(pnormsq_many(a))
+
+def pnormalized_many(a):
+    """ return the vectors with a length of one (null vectors stay null) """
+    lengths = pnorm_many(a)
+    lengths[lengths == 0] = 1
+    return a / lengths[:, numpy.newaxis]
+
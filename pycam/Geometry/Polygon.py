@@ -23,6 +23,8 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 from pycam.Geometry.Line import Line
 from pycam.Geometry.Point import Point, Vector
 from pycam.Geometry.Plane import Plane
+from pycam.Geometry.TriangleKdtree import FlatTriangleKdtree
+from pycam.Geometry.LineGrid import LineGrid
 from pycam.Geometry import TransformableContainer, IDGenerator, get_bisector
 from pycam.Geometry.utils import number, epsilon
 import pycam.Utils.log
@@ -35,13 +37,104 @@ try:
 except ImportError:
     GL_enabled = False
 
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
 
 LINE_WIDTH_INNER = 0.7
 LINE_WIDTH_OUTER = 1.3
+# use numpy for point-in-polygon tests with at least this number of
+# combinations of points and polygon vertices
+VECTORIZED_POINTS_INSIDE_MIN_SIZE = 1000
 
 log = pycam.Utils.log.get_logger()
 
 
+def _get_convex_hull_2d(points):
+    """ return the points of the convex hull (in the x/y plane)
+
+    The hull is calculated via Andrew's monotone chain algorithm.
+    """
+    ordered = sorted(points, key=lambda p: (p.x, p.y))
+    def get_hull_part(sequence):
+        hull = []
+        for point in sequence:
+            while (len(hull) > 1) and ((hull[-1].x - hull[-2].x) \
+                    * (point.y - hull[-2].y) - (hull[-1].y - hull[-2].y) \
+                    * (point.x - hull[-2].x) <= 0):
+                hull.pop()
+            hull.append(point)
+        return hull
+    lower = get_hull_part(ordered)
+    upper = get_hull_part(reversed(ordered))
+    return lower[:-1] + upper[:-1]
+
+
+class PolygonContainmentTree(object):
+    """ the nesting hierarchy of a number of polygons
+
+    A polygon contains another one, if "is_polygon_inside" is True. Only
+    closed polygons whose bounding box includes the first point of the other
+    polygon are tested. These candidates are found via a kdtree of the
+    bounding boxes. Thus the number of expensive tests is usually close to
+    the number of polygons instead of its square.
+    The polygons are expected to be distinct objects.
+    """
+
+    def __init__(self, polygons):
+        self.polygons = list(polygons)
+        self._order = dict([(polygon, index)
+                for index, polygon in enumerate(self.polygons)])
+        self._children = dict([(polygon, []) for polygon in self.polygons])
+        self._containers = dict([(polygon, []) for polygon in self.polygons])
+        # only closed polygons may contain other polygons
+        containers = [polygon for polygon in self.polygons
+                if polygon.is_closed and polygon.get_points()]
+        if not containers:
+            return
+        bounds = [(polygon.minx, polygon.maxx, polygon.miny, polygon.maxy)
+                for polygon in containers]
+        tree = FlatTriangleKdtree(bounds, containers)
+        for polygon in self.polygons:
+            points = polygon.get_points()
+            if not points:
+                continue
+            # "is_point_inside" accepts points close to the bounding box
+            point = points[0]
+            for container in tree.Search(point.x - epsilon, point.x + epsilon,
+                    point.y - epsilon, point.y + epsilon):
+                if (not container is polygon) \
+                        and container.is_polygon_inside(polygon):
+                    self._children[container].append(polygon)
+                    self._containers[polygon].append(container)
+        for items in self._children.values() + self._containers.values():
+            items.sort(key=self._order.get)
+
+    def get_children(self, polygon):
+        """ return all polygons inside of the given polygon (in the order of
+        the original list of polygons)
+        """
+        return self._children[polygon]
+
+    def get_containers(self, polygon):
+        """ return all polygons surrounding the given polygon (in the order of
+        the original list of polygons)
+        """
+        return self._containers[polygon]
+
+    def get_parent(self, polygon):
+        """ return the innermost polygon surrounding the given polygon or None
+        """
+        containers = self._containers[polygon]
+        if containers:
+            return min(containers, key=lambda item: abs(item.get_area()))
+        else:
+            return None
+
+
 class PolygonInTree(IDGenerator):
     """ This class is a wrapper around Polygon objects that is used for sorting.
     """
@@ -167,20 +260,34 @@ class PolygonSorter(object):
     The order of polygons is slightly optimized (minimizing the way length).
     """
 
-    def __init__(self, polygons, callback=None):
+    def __init__(self, polygons, callback=None, tree=None):
+        """ sort the given polygons
+
+        @value tree: the nesting hierarchy of the polygons (it may contain
+            additional polygons) - it is calculated if it is not given
+        @type tree: PolygonContainmentTree
+        """
         self.polygons = []
         self.sorter = None
         self.callback = callback
+        polygons = list(polygons)
+        if tree is None:
+            tree = PolygonContainmentTree(polygons)
+        self.tree = tree
+        items = {}
         for poly in polygons:
-            self._append(poly)
+            items[poly] = self._append(poly)
+        for item in self.polygons:
+            item.children = [items[child]
+                    for child in tree.get_children(item.polygon)
+                    if child in items]
         self.optimize_order()
 
     def _append(self, polygon):
+        # the children are based on the tree (see "__init__")
         new_item = PolygonInTree(polygon)
-        for item in self.polygons:
-            item.insert_if_child(new_item)
-            new_item.insert_if_child(item)
         self.polygons.append(new_item)
+        return new_item
 
     def optimize_order(self):
         self.polygons.sort()
@@ -263,8 +370,9 @@ class Polygon(TransformableContainer):
                     self._update_limits(line.p2)
                 else:
                     self.is_closed = True
-                # take care that the line_cache is flushed
-                self.reset_cache()
+                # take care that the line_cache is flushed (the limits are
+                # still valid - removed points were between other points)
+                self._reset_shape_cache()
             else:
                 # the new Line can be added to the beginning of the polygon
                 if (len(self._points) > 1) \
@@ -277,8 +385,9 @@ class Polygon(TransformableContainer):
                     self._update_limits(line.p1)
                 else:
                     self.is_closed = True
-                # take care that the line_cache is flushed
-                self.reset_cache()
+                # take care that the line_cache is flushed (the limits are
+                # still valid - removed points were between other points)
+                self._reset_shape_cache()
 
     def __len__(self):
         return len(self._points)
@@ -438,9 +547,21 @@ class Polygon(TransformableContainer):
         """
         if len(self._points) < 2:
             return None
+        points = self._points
+        if self.maxz - self.minz < epsilon:
+            # The most distant points of a flat polygon are part of its
+            # convex hull.
+            points = _get_convex_hull_2d(points)
         distance = self._points[1].sub(self._points[0]).norm
-        for p1 in self._points:
-            for p2 in self._points:
+        if numpy_enabled and (len(points) > 50):
+            coords = numpy.array([(p.x, p.y, p.z) for p in points])
+            for index in range(len(coords) - 1):
+                diff = coords[index + 1:] - coords[index]
+                distance = max(distance,
+                        numpy.sqrt((diff * diff).sum(axis=1).max()))
+            return float(distance)
+        for p1 in points:
+            for p2 in points:
                 if p1 is p2:
                     continue
                 distance = max(distance, p2.sub(p1).norm)
@@ -456,6 +577,9 @@ class Polygon(TransformableContainer):
                 (self.miny > polygon.maxy) or (self.maxy < polygon.miny) or \
                 (self.minz > polygon.maxz) or (self.maxz < polygon.minz):
             return False
+        if numpy_enabled and (len(polygon._points) * len(self._points) \
+                >= VECTORIZED_POINTS_INSIDE_MIN_SIZE):
+            return self._are_points_inside(polygon._points).all()
         for point in polygon._points:
             if not self.is_point_inside(point):
                 return False
@@ -515,6 +639,45 @@ class Polygon(TransformableContainer):
             log.debug("polygon.is_point_inside: unclear decision")
             return True
 
+    def _are_points_inside(self, points):
+        """ vectorized version of "is_point_inside" for many points
+
+        @returns: the result of "is_point_inside" for each point
+        @rtype: numpy array of bool
+        """
+        coords = numpy.array([(p.x, p.y, p.z) for p in points])
+        if not self.is_closed:
+            return numpy.zeros(len(coords), dtype=bool)
+        result = (self.minx - epsilon <= coords[:, 0]) \
+                & (coords[:, 0] <= self.maxx + epsilon) \
+                & (self.miny - epsilon <= coords[:, 1]) \
+                & (coords[:, 1] <= self.maxy + epsilon) \
+                & (self.minz - epsilon <= coords[:, 2]) \
+                & (coords[:, 2] <= self.maxz + epsilon)
+        vertices = numpy.array([(p.x, p.y) for p in self._points])
+        x1, y1 = vertices[:, 0], vertices[:, 1]
+        x2, y2 = numpy.roll(x1, -1), numpy.roll(y1, -1)
+        # Horizontal edges never cross the ray. A dummy divisor avoids NaN
+        # values and their warnings.
+        dy = numpy.where(y2 == y1, 1.0, y2 - y1)
+        # process the points in chunks (the matrix is points x vertices)
+        chunk_size = max(1, 100000 // len(vertices))
+        candidates = numpy.nonzero(result)[0]
+        for start in range(0, len(candidates), chunk_size):
+            indices = candidates[start:start + chunk_size]
+            px = coords[indices, 0][:, numpy.newaxis]
+            py = coords[indices, 1][:, numpy.newaxis]
+            # see "is_point_inside" for the details of the ray casting
+            crossing = ((y1 < py) & (py <= y2)) | ((y2 < py) & (py <= y1))
+            intersection_x = x1 + (py - y1) / dy * (x2 - x1)
+            left_odd = (crossing & (intersection_x < px + epsilon)).sum(
+                    axis=1) % 2 == 1
+            right_odd = (crossing & (intersection_x > px - epsilon)).sum(
+                    axis=1) % 2 == 1
+            # an unclear decision (on the line) counts as inside
+            result[indices] = left_odd | right_odd
+        return result
+
     def get_points(self):
         return self._points[:]
 
@@ -576,10 +739,13 @@ class Polygon(TransformableContainer):
         self._lines_cache = None
         self._area_cache = None
 
-    def reset_cache(self):
+    def _reset_shape_cache(self):
         self._cached_offset_polygons = {}
         self._lines_cache = None
         self._area_cache = None
+
+    def reset_cache(self):
+        self._reset_shape_cache()
         self.minx, self.miny, self.minz = None, None, None
         self.maxx, self.maxy, self.maxz = None, None, None
         # update the limit for each line
@@ -592,6 +758,39 @@ class Polygon(TransformableContainer):
         p3 = self._points[(index + 1) % len(self._points)]
         return get_bisector(p1, p2, p3, self.plane.n)
 
+    def _get_shifted_points(self, offset):
+        """ move all points along their bisectors (for "get_offset_polygons")
+
+        This is a vectorized version of shifting each point via
+        "get_bisector" - all points are processed at once.
+        """
+        def normalize(vectors):
+            lengths = numpy.sqrt((vectors * vectors).sum(axis=1))
+            valid = lengths != 0
+            result = numpy.zeros_like(vectors)
+            result[valid] = vectors[valid] / lengths[valid][:, numpy.newaxis]
+            return result, valid
+        coords = numpy.array([(p.x, p.y, p.z) for p in self._points])
+        normal = numpy.array((self.plane.n.x, self.plane.n.y, self.plane.n.z))
+        previous_coords = numpy.roll(coords, 1, axis=0)
+        next_coords = numpy.roll(coords, -1, axis=0)
+        cross_offset = normalize(numpy.cross(next_coords - coords, normal))[0]
+        # see "pycam.Geometry.get_bisector"
+        d1 = normalize(coords - previous_coords)[0]
+        d2 = normalize(coords - next_coords)[0]
+        bisectors, valid = normalize(d1 + d2)
+        # the two vectors pointed to opposite directions
+        bisectors[~valid] = normalize(numpy.cross(d1[~valid], normal))[0]
+        skel_up_vector = numpy.cross(bisectors, coords - previous_coords)
+        reverse = valid & (numpy.dot(skel_up_vector, normal) < 0)
+        bisectors[reverse] *= -1
+        factors = (cross_offset * bisectors).sum(axis=1)
+        shiftable = factors != 0
+        result = next_coords.copy()
+        result[shiftable] = coords[shiftable] + bisectors[shiftable] \
+                * (offset / factors[shiftable])[:, numpy.newaxis]
+        return [Point(x, y, z) for x, y, z in result.tolist()]
+
     def get_offset_polygons_validated(self, offset):
         def get_shifted_vertex(index, offset):
             p1 = self._points[index]
@@ -872,54 +1071,41 @@ class Polygon(TransformableContainer):
             else:
                 return p2
         def simplify_polygon_intersections(lines):
-            new_group = lines[:]
-            # remove all non-adjacent intersecting lines (this splits the group)
-            if len(new_group) > 0:
+            # Split all lines at their intersections with non-adjacent lines
+            # (this splits the group). Only lines with overlapping bounding
+            # boxes are checked for intersections.
+            if len(lines) > 0:
+                grid = LineGrid(lines)
+                new_group = []
                 group_starts = []
-                index1 = 0
-                fallout3 = 0
-                while index1 < len(new_group):
-                    index2 = 0
-                    fallout2 = len(new_group)
-                    fallout3 += 1
-                    while index2 < len(new_group):
-                        fallout2 -= 1
-                        index_distance = min(abs(index2 - index1), \
-                                abs(len(new_group) - (index2 - index1))) 
-                        if fallout3 > 10000:
-                            print "FALLOUT3"
-                            print index_distance, index2, index1, len(new_group), len(group_starts)
-                            import sys
-                            sys.exit(1)
+                for index1, line1 in enumerate(lines):
+                    split_points = []
+                    for index2 in grid.search_line(index1):
+                        index_distance = abs(index2 - index1)
+                        index_distance = min(index_distance,
+                                len(lines) - index_distance)
                         # skip neighbours
-                        if index_distance > 1:
-                            line1 = new_group[index1]
-                            line2 = new_group[index2]
-                            intersection, factor = line1.get_intersection(line2)
-                            if intersection and (intersection != line1.p1) \
-                                    and (intersection != line1.p2):
-                                del new_group[index1]
-                                new_group.insert(index1,
-                                        Line(line1.p1, intersection))
-                                new_group.insert(index1 + 1,
-                                        Line(intersection, line1.p2))
-                                # Shift all items in "group_starts" by one if
-                                # they reference a line whose index changed.
-                                for i in range(len(group_starts)):
-                                    if group_starts[i] > index1:
-                                        group_starts[i] += 1
-                                if not index1 + 1 in group_starts:
-                                    group_starts.append(index1 + 1)
-                                # don't update index2 -> maybe there are other hits
-                            elif intersection and (intersection == line1.p1):
-                                if not index1 in group_starts:
-                                    group_starts.append(index1)
-                                index2 += 1
-                            else:
-                                index2 += 1
-                        else:
-                            index2 += 1
-                    index1 += 1
+                        if index_distance <= 1:
+                            continue
+                        intersection, factor = line1.get_intersection(
+                                lines[index2])
+                        if not intersection:
+                            continue
+                        elif intersection == line1.p1:
+                            if not len(new_group) in group_starts:
+                                group_starts.append(len(new_group))
+                        elif intersection != line1.p2:
+                            split_points.append((factor, intersection))
+                    # split the line at all intersections (in their order)
+                    split_points.sort(key=lambda (factor, point): factor)
+                    start = line1.p1
+                    for factor, point in split_points:
+                        if point == start:
+                            continue
+                        new_group.append(Line(start, point))
+                        group_starts.append(len(new_group))
+                        start = point
+                    new_group.append(Line(start, line1.p2))
                 # The lines intersect each other
                 # We need to split the group.
                 if len(group_starts) > 0:
@@ -927,11 +1113,12 @@ class Polygon(TransformableContainer):
                     groups = []
                     last_start = 0
                     for group_start in group_starts:
-                        groups.append(new_group[last_start:group_start])
+                        if group_start > last_start:
+                            groups.append(new_group[last_start:group_start])
                         last_start = group_start
                     # Add the remaining lines to the first group or as a new
                     # group.
-                    if groups[0][0].p1 == new_group[-1].p2:
+                    if groups and (groups[0][0].p1 == new_group[-1].p2):
                         groups[0] = new_group[last_start:] + groups[0]
                     else:
                         groups.append(new_group[last_start:])
@@ -975,9 +1162,12 @@ class Polygon(TransformableContainer):
             # something like a circle.
             log.debug("Skipping offset polygon: polygon is too small")
             return []
-        points = []
-        for index in range(len(self._points)):
-            points.append(get_shifted_vertex(index, offset))
+        if numpy_enabled:
+            points = self._get_shifted_points(offset)
+        else:
+            points = []
+            for index in range(len(self._points)):
+                points.append(get_shifted_vertex(index, offset))
         new_lines = []
         for index in range(len(points)):
             p1 = points[index]
@@ -1022,18 +1212,14 @@ class Polygon(TransformableContainer):
             if not groups:
                 log.debug("Skipping offset polygon: toggled polygon removed")
             # remove all polygons that are within other polygons
-            result = []
-            for group in groups:
-                inside = False
-                for group_test in groups:
-                    if callback and callback():
-                        return None
-                    if group_test is group:
-                        continue
-                    if group_test.is_polygon_inside(group):
-                        inside = True
-                if not inside:
-                    result.append(group)
+            if len(groups) > 1:
+                tree = PolygonContainmentTree(groups)
+                if callback and callback():
+                    return None
+                result = [group for group in groups
+                        if not tree.get_containers(group)]
+            else:
+                result = groups
             if not result:
                 log.debug("Skipping offset polygon: polygon is inside of " \
                         + "another one")
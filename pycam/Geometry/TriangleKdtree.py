@@ -21,6 +21,13 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from pycam.Geometry.kdtree import kdtree, Node
+import array
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
 
 overlaptest = True
 
@@ -89,3 +96,351 @@ class TriangleKdtree(kdtree):
     def Search(self, minx, maxx, miny, maxy):
         return SearchKdtree2d(self, minx, maxx, miny, maxy)
 
+
+
+
+class FlatTriangleKdtree(object):
+    """ a non-recursive variant of L{TriangleKdtree}
+
+    The tree uses the same splitting rules as L{TriangleKdtree}, but all nodes
+    are encoded in flat arrays. Queries walk the tree with an explicit stack.
+    Every node covers a contiguous range of the sorted items. Thus subtrees
+    that overlap the query rectangle completely are returned as a whole.
+
+    The items of the tree are referenced by their index. Thus any indexable
+    sequence of objects (e.g. a L{TriangleMesh}) may be used.
+    """
+
+    def __init__(self, bounds, objects, cutoff=3, cutoff_distance=1.0):
+        """ build the tree
+
+        @value bounds: minx, maxx, miny and maxy of every item
+        @type bounds: sequence of 4-tuples or an array of shape (N, 4)
+        @value objects: the items of the tree (returned by "Search")
+        @type objects: list or any other indexable sequence
+        """
+        self.objects = objects
+        if numpy_enabled:
+            bounds = numpy.asarray(bounds, dtype=numpy.float64).reshape(-1, 4)
+            analyze = self._analyze_numpy
+        else:
+            bounds = [tuple(bound) for bound in bounds]
+            analyze = self._analyze
+        item_order = range(len(bounds))
+        cutdims = []
+        cutvals = []
+        limits = []
+        children = []
+        ranges = []
+        inner_bounds = []
+        outer_bounds = []
+        def add_node():
+            cutdims.append(-1)
+            cutvals.append(0)
+            limits.append(0)
+            children.extend((-1, -1))
+            ranges.extend((0, 0))
+            inner_bounds.extend((0, 0, 0, 0))
+            outer_bounds.extend((0, 0, 0, 0))
+            return len(cutdims) - 1
+        todo = []
+        if item_order:
+            todo.append((add_node(), 0, len(item_order)))
+        while todo:
+            node, start, end = todo.pop()
+            inner, outer, split = analyze(bounds, item_order, start, end,
+                    end - start > cutoff, cutoff_distance)
+            inner_bounds[4 * node:4 * node + 4] = inner
+            outer_bounds[4 * node:4 * node + 4] = outer
+            ranges[2 * node:2 * node + 2] = (start, end)
+            if split is None:
+                # leaf
+                continue
+            cutdims[node], cutvals[node], limits[node] = split
+            median = start + (end - start) / 2
+            low, high = add_node(), add_node()
+            children[2 * node:2 * node + 2] = (low, high)
+            todo.append((high, median, end))
+            todo.append((low, start, median))
+        self._cutdims = array.array("b", cutdims)
+        self._cutvals = array.array("d", cutvals)
+        self._limits = array.array("d", limits)
+        self._children = array.array("i", children)
+        self._ranges = array.array("i", ranges)
+        # the largest lower and the smallest upper limits of each subtree
+        self._inner_bounds = array.array("d", inner_bounds)
+        # the bounding box of each subtree
+        self._outer_bounds = array.array("d", outer_bounds)
+        self._item_order = array.array("i", item_order)
+        # the bounds of all items in the order of the leaves
+        self._item_bounds = array.array("d")
+        if not item_order:
+            pass
+        elif numpy_enabled:
+            self._item_bounds.fromstring(bounds[numpy.array(item_order,
+                    dtype=numpy.intp)].tostring())
+        else:
+            for index in item_order:
+                self._item_bounds.extend(bounds[index])
+
+    @staticmethod
+    def _analyze(bounds, item_order, start, end, allow_split,
+            cutoff_distance):
+        """ calculate the inner and outer bounds of a range of items and sort
+        them along the dimension with the largest spread (see
+        L{pycam.Geometry.kdtree.find_max_spread}) if a split is allowed
+
+        @returns: the inner bounds, the outer bounds and None (for leaves) or
+            the tuple (cutdim, cutval, limit)
+        """
+        items = item_order[start:end]
+        columns = [[bounds[index][dim] for index in items] for dim in range(4)]
+        inner = (max(columns[0]), min(columns[1]), max(columns[2]),
+                min(columns[3]))
+        outer = (min(columns[0]), max(columns[1]), min(columns[2]),
+                max(columns[3]))
+        if not allow_split:
+            return inner, outer, None
+        cutdim = None
+        maxspread = None
+        for dim in range(4):
+            spread = max(columns[dim]) - min(columns[dim])
+            if (maxspread is None) or (spread > maxspread):
+                maxspread = spread
+                cutdim = dim
+        if maxspread <= cutoff_distance:
+            return inner, outer, None
+        items.sort(key=lambda index: bounds[index][cutdim])
+        item_order[start:end] = items
+        return inner, outer, _get_split_values(cutdim, [bounds[index][cutdim]
+                for index in (items[0], items[len(items) / 2], items[-1])])
+
+    @staticmethod
+    def _analyze_numpy(bounds, item_order, start, end, allow_split,
+            cutoff_distance):
+        items = numpy.array(item_order[start:end])
+        values = bounds[items]
+        low = values.min(axis=0)
+        high = values.max(axis=0)
+        inner = (high[0], low[1], high[2], low[3])
+        outer = (low[0], high[1], low[2], high[3])
+        if not allow_split:
+            return inner, outer, None
+        spreads = high - low
+        # the first dimension with the largest spread (see "find_max_spread")
+        cutdim = int(spreads.argmax())
+        if spreads[cutdim] <= cutoff_distance:
+            return inner, outer, None
+        column = values[:, cutdim]
+        median = len(items) / 2
+        partition = numpy.argpartition(column, median)
+        item_order[start:end] = items[partition].tolist()
+        return inner, outer, _get_split_values(cutdim,
+                (low[cutdim], column[partition[median]], high[cutdim]))
+
+    # the names of all flat arrays describing the tree
+    ARRAY_NAMES = ("cutdims", "cutvals", "limits", "children", "ranges",
+            "inner_bounds", "outer_bounds", "item_order", "item_bounds")
+
+    def get_arrays(self):
+        """ return the nodes of the tree as numpy arrays (see "from_arrays")
+
+        The arrays share their memory with the tree. This requires numpy.
+        @rtype: dict
+        """
+        result = {}
+        for name in self.ARRAY_NAMES:
+            values = getattr(self, "_" + name)
+            if values:
+                result[name] = numpy.frombuffer(values,
+                        dtype=values.typecode)
+            else:
+                result[name] = numpy.zeros(0, dtype=values.typecode)
+        return result
+
+    @classmethod
+    def from_arrays(cls, arrays, objects):
+        """ restore a tree from the result of "get_arrays"
+
+        The nodes are copied into plain arrays (without any further parsing)
+        since queries access them one by one.
+        """
+        result = cls.__new__(cls)
+        result.objects = objects
+        for name in cls.ARRAY_NAMES:
+            values = arrays[name]
+            nodes = array.array(values.dtype.char)
+            nodes.fromstring(buffer(numpy.ascontiguousarray(values)))
+            setattr(result, "_" + name, nodes)
+        return result
+
+    def __len__(self):
+        return len(self._item_order)
+
+    def Search(self, minx, maxx, miny, maxy):
+        """ return all objects overlapping the given rectangle """
+        objects = self.objects
+        return [objects[index]
+                for index in self.search_indices(minx, maxx, miny, maxy)]
+
+    def search_indices(self, minx, maxx, miny, maxy):
+        """ return the indices of all items overlapping the given rectangle """
+        result = []
+        if not self._item_order:
+            return result
+        cutdims = self._cutdims
+        cutvals = self._cutvals
+        limits = self._limits
+        children = self._children
+        ranges = self._ranges
+        inner_bounds = self._inner_bounds
+        outer_bounds = self._outer_bounds
+        item_order = self._item_order
+        item_bounds = self._item_bounds
+        todo = [0]
+        while todo:
+            node = todo.pop()
+            offset = 4 * node
+            if (outer_bounds[offset] > maxx) \
+                    or (outer_bounds[offset + 1] < minx) \
+                    or (outer_bounds[offset + 2] > maxy) \
+                    or (outer_bounds[offset + 3] < miny):
+                # no item of this subtree overlaps the rectangle
+                continue
+            if (inner_bounds[offset] <= maxx) \
+                    and (inner_bounds[offset + 1] >= minx) \
+                    and (inner_bounds[offset + 2] <= maxy) \
+                    and (inner_bounds[offset + 3] >= miny):
+                # all items of this subtree overlap the rectangle
+                result.extend(item_order[ranges[2 * node]:ranges[2 * node + 1]])
+                continue
+            cutdim = cutdims[node]
+            if cutdim < 0:
+                for position in xrange(ranges[2 * node], ranges[2 * node + 1]):
+                    offset = 4 * position
+                    if not ((item_bounds[offset] > maxx) or
+                            (item_bounds[offset + 1] < minx) or
+                            (item_bounds[offset + 2] > maxy) or
+                            (item_bounds[offset + 3] < miny)):
+                        result.append(item_order[position])
+                continue
+            if cutdim == 0:
+                query_value = maxx
+            elif cutdim == 1:
+                query_value = minx
+            elif cutdim == 2:
+                query_value = maxy
+            else:
+                query_value = miny
+            if cutdim % 2 == 0:
+                # the items are sorted by their lower limit
+                if query_value < limits[node]:
+                    continue
+                elif query_value < cutvals[node]:
+                    todo.append(children[2 * node])
+                    continue
+            else:
+                # the items are sorted by their upper limit
+                if query_value > limits[node]:
+                    continue
+                elif query_value > cutvals[node]:
+                    todo.append(children[2 * node + 1])
+                    continue
+            # the results of the lower half are returned first
+            todo.append(children[2 * node + 1])
+            todo.append(children[2 * node])
+        return result
+
+    def search_many(self, boxes):
+        """ run multiple queries at once
+
+        @value boxes: the query rectangles (minx, maxx, miny, maxy)
+        @type boxes: sequence of 4-tuples or an array of shape (N, 4)
+        @returns: one list of objects for every query rectangle
+        """
+        objects = self.objects
+        return [[objects[index] for index in indices]
+                for indices in self.search_many_indices(boxes)]
+
+    def search_many_indices(self, boxes):
+        """ return the indices of the overlapping items for multiple queries
+
+        All queries walk through the tree together. Thus every node is
+        visited only once for all rectangles touching it.
+        """
+        if not numpy_enabled:
+            return [self.search_indices(*box) for box in boxes]
+        boxes = numpy.asarray(boxes, dtype=numpy.float64).reshape(-1, 4)
+        results = [[] for box in boxes]
+        if (not self._item_order) or (len(boxes) == 0):
+            return results
+        item_bounds = numpy.frombuffer(self._item_bounds,
+                dtype=numpy.float64).reshape(-1, 4)
+        inner_bounds = numpy.frombuffer(self._inner_bounds,
+                dtype=numpy.float64).reshape(-1, 4)
+        outer_bounds = numpy.frombuffer(self._outer_bounds,
+                dtype=numpy.float64).reshape(-1, 4)
+        item_order = self._item_order
+        # the query value of each cut dimension: maxx, minx, maxy, miny
+        query_columns = (1, 0, 3, 2)
+        todo = [(0, numpy.arange(len(boxes)))]
+        while todo:
+            node, active = todo.pop()
+            start, end = self._ranges[2 * node], self._ranges[2 * node + 1]
+            queries = boxes[active]
+            outer = outer_bounds[node]
+            overlap = (outer[0] <= queries[:, 1]) \
+                    & (outer[1] >= queries[:, 0]) \
+                    & (outer[2] <= queries[:, 3]) \
+                    & (outer[3] >= queries[:, 2])
+            if not overlap.all():
+                active = active[overlap]
+                if len(active) == 0:
+                    continue
+                queries = boxes[active]
+            inner = inner_bounds[node]
+            complete = (inner[0] <= queries[:, 1]) \
+                    & (inner[1] >= queries[:, 0]) \
+                    & (inner[2] <= queries[:, 3]) \
+                    & (inner[3] >= queries[:, 2])
+            if complete.any():
+                subtree = item_order[start:end]
+                for query_index in active[complete]:
+                    results[query_index].extend(subtree)
+                active = active[~complete]
+                if len(active) == 0:
+                    continue
+                queries = boxes[active]
+            cutdim = self._cutdims[node]
+            if cutdim < 0:
+                items = item_bounds[start:end]
+                hits = ~((items[:, 0] > queries[:, 1:2]) |
+                        (items[:, 1] < queries[:, 0:1]) |
+                        (items[:, 2] > queries[:, 3:4]) |
+                        (items[:, 3] < queries[:, 2:3]))
+                for query_index, position in zip(*numpy.nonzero(hits)):
+                    results[active[query_index]].append(
+                            item_order[start + position])
+                continue
+            values = queries[:, query_columns[cutdim]]
+            if cutdim % 2 == 0:
+                use_low = values >= self._limits[node]
+                use_high = values >= self._cutvals[node]
+            else:
+                use_low = values <= self._cutvals[node]
+                use_high = values <= self._limits[node]
+            if use_high.any():
+                todo.append((self._children[2 * node + 1], active[use_high]))
+            if use_low.any():
+                todo.append((self._children[2 * node], active[use_low]))
+        return results
+
+
+def _get_split_values(cutdim, (minval, cutval, maxval)):
+    """ the limit of a node is the minimum of its items for lower bounds
+    (even dimensions) and the maximum for upper bounds
+    """
+    if cutdim % 2 == 0:
+        return (cutdim, float(cutval), float(minval))
+    else:
+        return (cutdim, float(cutval), float(maxval))
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from pycam.Geometry.Point import Point, Vector
+from pycam.Geometry.Triangle import Triangle
+import collections
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+
+# number of rows to be transformed between two calls of the "callback"
+TRANSFORM_CHUNK_SIZE = 10000
+
+
+class TriangleMesh(object):
+    """ compact storage for a large number of triangles
+
+    Vertices, faces, normals and the bounding box of each triangle are kept
+    in contiguous numpy arrays. The vertex indices of each face are stored in
+    clockwise order - just like the points of a L{Triangle}.
+
+    The mesh behaves like a list of triangles: L{Triangle} objects are created
+    on demand (as read-only views) and only a limited number of them is kept.
+    Changes of these views are not written back to the mesh.
+    """
+
+    def __init__(self, max_views=20000):
+        self._vertices = numpy.zeros((0, 3), dtype=numpy.float64)
+        self._faces = numpy.zeros((0, 3), dtype=numpy.int32)
+        self._normals = numpy.zeros((0, 3), dtype=numpy.float64)
+        self._bounds = numpy.zeros((0, 6), dtype=numpy.float64)
+        # triangles appended one by one are collected before packing them
+        self._pending_vertices = []
+        self._pending_vertex_map = {}
+        self._pending_faces = []
+        self._pending_normals = []
+        self._max_views = max_views
+        self._views = collections.OrderedDict()
+
+    def __getstate__(self):
+        self._pack()
+        state = self.__dict__.copy()
+        # the views are cheap to restore
+        state["_views"] = collections.OrderedDict()
+        return state
+
+    def __len__(self):
+        return len(self._faces) + len(self._pending_faces)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TriangleMesh index out of range: %d" % index)
+        try:
+            return self._views[index]
+        except KeyError:
+            pass
+        self._pack()
+        p1, p2, p3 = [Point(x, y, z) for x, y, z
+                in self._vertices[self._faces[index]].tolist()]
+        normal = Vector(*self._normals[index].tolist())
+        triangle = Triangle(p1, p2, p3, normal)
+        if len(self._views) >= self._max_views:
+            # drop the oldest view
+            self._views.popitem(last=False)
+        self._views[index] = triangle
+        return triangle
+
+    @property
+    def vertices(self):
+        self._pack()
+        return self._vertices
+
+    @property
+    def faces(self):
+        self._pack()
+        return self._faces
+
+    @property
+    def normals(self):
+        self._pack()
+        return self._normals
+
+    @property
+    def bounds(self):
+        """ the bounding boxes of all triangles
+
+        Every row contains minx, maxx, miny, maxy, minz and maxz (the first
+        four values use the order of L{TriangleKdtree} nodes).
+        """
+        self._pack()
+        return self._bounds
+
+    def append(self, triangle):
+        indices = []
+        for point in (triangle.p1, triangle.p2, triangle.p3):
+            key = (point.x, point.y, point.z)
+            try:
+                indices.append(self._pending_vertex_map[key])
+            except KeyError:
+                index = len(self._vertices) + len(self._pending_vertices)
+                self._pending_vertex_map[key] = index
+                self._pending_vertices.append(key)
+                indices.append(index)
+        self._pending_faces.append(indices)
+        normal = triangle.normal
+        self._pending_normals.append((normal.x, normal.y, normal.z))
+
+    def extend_arrays(self, vertices, faces, normals=None):
+        """ add triangles given as arrays
+
+        @value vertices: coordinates of the new vertices
+        @type vertices: array of shape (V, 3)
+        @value faces: vertex indices (in clockwise order) of the new triangles
+            - relative to the given vertices
+        @type faces: array of shape (F, 3)
+        @value normals: optional normals of the new triangles; missing rows
+            (all zero) are calculated from the vertices
+        @type normals: array of shape (F, 3)
+        """
+        self._pack()
+        vertices = numpy.asarray(vertices, dtype=numpy.float64).reshape(-1, 3)
+        faces = numpy.asarray(faces, dtype=numpy.int32).reshape(-1, 3) \
+                + len(self._vertices)
+        self._vertices = numpy.concatenate((self._vertices, vertices))
+        new_normals = self._get_normals(faces, normals)
+        self._faces = numpy.concatenate((self._faces, faces))
+        self._normals = numpy.concatenate((self._normals, new_normals))
+        self._bounds = numpy.concatenate((self._bounds,
+                self._get_bounds(faces)))
+
+    def set_arrays(self, vertices, faces, normals, bounds):
+        """ replace the triangles of the mesh by the given arrays
+
+        The arrays are used directly - without copying or checking them. Thus
+        read-only arrays (e.g. mapped from a file) are suitable, too. They are
+        copied before the mesh is transformed.
+        """
+        self._pending_vertices = []
+        self._pending_vertex_map = {}
+        self._pending_faces = []
+        self._pending_normals = []
+        self._vertices = vertices
+        self._faces = faces
+        self._normals = normals
+        self._bounds = bounds
+        self._views.clear()
+
+    def get_arrays(self):
+        """ return copies of the vertices, faces and normals """
+        self._pack()
+        return (self._vertices.copy(), self._faces.copy(),
+                self._normals.copy())
+
+    def copy(self):
+        result = self.__class__(max_views=self._max_views)
+        result.extend_arrays(*self.get_arrays())
+        return result
+
+    def get_limits(self):
+        """ return the lower and upper limits of all vertices in use """
+        if len(self) == 0:
+            return None
+        bounds = self.bounds
+        low = (bounds[:, 0].min(), bounds[:, 2].min(), bounds[:, 4].min())
+        high = (bounds[:, 1].max(), bounds[:, 3].max(), bounds[:, 5].max())
+        return [float(value) for value in low], \
+                [float(value) for value in high]
+
+    def get_children_count(self):
+        # the number of callback calls during "transform_by_matrix"
+        return (len(self.vertices) + len(self._normals)) \
+                // TRANSFORM_CHUNK_SIZE + 2
+
+    def transform_by_matrix(self, matrix, callback=None):
+        self._pack()
+        # accept 3x4 matrices as well as 3x3 matrices
+        rotation = numpy.array([row[:3] for row in matrix], dtype=numpy.float64)
+        offsets = numpy.array([(len(row) > 3) and row[3] or 0
+                for row in matrix], dtype=numpy.float64)
+        # Shared arrays (e.g. mapped from a file) are read-only. They are
+        # copied before the first change.
+        if not self._vertices.flags.writeable:
+            self._vertices = self._vertices.copy()
+        if not self._normals.flags.writeable:
+            self._normals = self._normals.copy()
+        cancelled = False
+        for array, shift in ((self._vertices, True), (self._normals, False)):
+            for start in xrange(0, len(array), TRANSFORM_CHUNK_SIZE):
+                chunk = array[start:start + TRANSFORM_CHUNK_SIZE]
+                chunk[:] = numpy.dot(chunk, rotation.T)
+                if shift:
+                    chunk += offsets
+                if callback and callback():
+                    # user requested abort
+                    cancelled = True
+                    break
+            if cancelled:
+                break
+        self._normals = self._normalize(self._normals)
+        self._bounds = self._get_bounds(self._faces)
+        self._views.clear()
+
+    def _pack(self):
+        if not self._pending_faces:
+            return
+        faces = numpy.array(self._pending_faces, dtype=numpy.int32)
+        self._vertices = numpy.concatenate((self._vertices,
+                numpy.array(self._pending_vertices,
+                    dtype=numpy.float64).reshape(-1, 3)))
+        normals = self._get_normals(faces, self._pending_normals)
+        self._faces = numpy.concatenate((self._faces, faces))
+        self._normals = numpy.concatenate((self._normals, normals))
+        self._bounds = numpy.concatenate((self._bounds,
+                self._get_bounds(faces)))
+        self._pending_vertices = []
+        self._pending_vertex_map = {}
+        self._pending_faces = []
+        self._pending_normals = []
+
+    def _get_bounds(self, faces):
+        corners = self._vertices[faces]
+        low = corners.min(axis=1)
+        high = corners.max(axis=1)
+        return numpy.column_stack((low[:, 0], high[:, 0], low[:, 1],
+                high[:, 1], low[:, 2], high[:, 2]))
+
+    def _get_normals(self, faces, normals=None):
+        # see Triangle.reset_cache: (p3 - p1) x (p2 - p1) for clockwise points
+        corners = self._vertices[faces]
+        calculated = numpy.cross(corners[:, 2] - corners[:, 0],
+                corners[:, 1] - corners[:, 0])
+        if normals is None:
+            result = calculated
+        else:
+            result = numpy.array(normals, dtype=numpy.float64).reshape(-1, 3)
+            missing = ~result.any(axis=1)
+            result[missing] = calculated[missing]
+        return self._normalize(result)
+
+    @staticmethod
+    def _normalize(vectors):
+        lengths = numpy.sqrt((vectors * vectors).sum(axis=1))
+        lengths[lengths == 0] = 1
+        return vectors / lengths[:, numpy.newaxis]
+
@@ -23,7 +23,7 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 
 __all__ = ["utils", "Line", "Model", "Path", "Plane", "Point", "Triangle",
            "PolygonExtractor", "TriangleKdtree", "intersection", "kdtree",
-           "Matrix", "Polygon", "Letters"]
+           "Matrix", "Polygon", "Letters", "TriangleMesh"]
 
 from pycam.Geometry.utils import epsilon, ceil
 import math
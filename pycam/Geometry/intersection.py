@@ -18,15 +18,28 @@ GNU General Public License for more details.
 
 You should have received a copy of the GNU General Public License
 along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+
+The private functions (e.g. "_intersect_circle_line") expect all points and
+vectors as tuples of three floats (x, y, z) - see L{pycam.Geometry.PointUtils}.
+An edge is a tuple of its two end points. A plane is a tuple of a point on the
+plane and its normal.
+The public functions are thin wrappers for L{Point}, L{Line} and L{Triangle}
+objects.
 """
 
 
 #import pycam.Geometry
-from pycam.Utils.polynomials import poly4_roots
+from pycam.Utils.polynomials import poly4_roots, poly4_roots_many
 from pycam.Geometry.utils import INFINITE, sqrt, epsilon
-from pycam.Geometry.Plane import Plane
-from pycam.Geometry.Line import Line
 from pycam.Geometry.Point import Point
+from pycam.Geometry.PointUtils import ptuple, padd, psub, pmul, pdiv, pdot, \
+        pcross, pnorm, pnormsq, pnormalized
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
 
 def isNear(a, b):
     return abs(a - b) < epsilon
@@ -58,176 +71,231 @@ def intersect_lines(xl, zl, nxl, nzl, xm, zm, nxm, nzm):
         pass
     return (None, None)
 
-def intersect_cylinder_point(center, axis, radius, radiussq, direction, point):
+def _intersect_plane_point(plane, direction, point):
+    """ intersect a line with a plane
+
+    This is the tuple based equivalent of
+    L{pycam.Geometry.Plane.Plane.intersect_point}.
+    @value plane: a point of the plane and its normal
+    @type plane: tuple(tuple(float), tuple(float))
+    @returns: the point of intersection (or None) and its distance from
+        "point" along the (normalized) direction
+    @rtype: tuple(tuple(float), float)
+    """
+    if (not direction is None) and (pnorm(direction) != 1):
+        # calculations will go wrong, if the direction is not a unit vector
+        direction = pnormalized(direction)
+    if direction is None:
+        return (None, INFINITE)
+    plane_point, normal = plane
+    denom = pdot(normal, direction)
+    if denom == 0:
+        return (None, INFINITE)
+    l = -(pdot(normal, point) - pdot(normal, plane_point)) / denom
+    cp = padd(point, pmul(direction, l))
+    return (cp, l)
+
+def _is_point_inside_triangle(p1, p2, p3, point):
+    """ tuple based equivalent of L{pycam.Geometry.Triangle.is_point_inside}
+    """
+    v0 = psub(p3, p1)
+    v1 = psub(p2, p1)
+    v2 = psub(point, p1)
+    dot00 = pdot(v0, v0)
+    dot01 = pdot(v0, v1)
+    dot02 = pdot(v0, v2)
+    dot11 = pdot(v1, v1)
+    dot12 = pdot(v1, v2)
+    denom = dot00 * dot11 - dot01 * dot01
+    if denom == 0:
+        return False
+    invDenom = 1.0 / denom
+    u = (dot11 * dot02 - dot01 * dot12) * invDenom
+    v = (dot00 * dot12 - dot01 * dot02) * invDenom
+    return (u > 0) and (v > 0) and (u + v < 1)
+
+def _closest_point_on_line(p1, p2, point):
+    """ tuple based equivalent of L{pycam.Geometry.Line.Line.closest_point}
+    """
+    v = pnormalized(psub(p2, p1))
+    if v is None:
+        # for zero-length lines
+        return p1
+    l = pdot(p1, v) - pdot(point, v)
+    return psub(p1, pmul(v, l))
+
+def _intersect_cylinder_point(center, axis, radius, radiussq, direction,
+        point):
     # take a plane along direction and axis
-    n = direction.cross(axis).normalized()
+    n = pnormalized(pcross(direction, axis))
+    if n is None:
+        return (None, None, INFINITE)
     # distance of the point to this plane
-    d = n.dot(point) - n.dot(center)
+    d = pdot(n, point) - pdot(n, center)
     if abs(d) > radius - epsilon:
         return (None, None, INFINITE)
     # ccl is on cylinder
     d2 = sqrt(radiussq-d*d)
-    ccl = center.add(n.mul(d)).add(direction.mul(d2))
+    ccl = padd(padd(center, pmul(n, d)), pmul(direction, d2))
     # take plane through ccl and axis
-    plane = Plane(ccl, direction)
     # intersect point with plane
-    (ccp, l) = plane.intersect_point(direction, point)
+    (ccp, l) = _intersect_plane_point((ccl, direction), direction, point)
     return (ccp, point, -l)
 
-def intersect_cylinder_line(center, axis, radius, radiussq, direction, edge):
-    d = edge.dir
+def _intersect_cylinder_line(center, axis, radius, radiussq, direction, edge):
+    d = pnormalized(psub(edge[1], edge[0]))
+    if d is None:
+        return (None, None, INFINITE)
     # take a plane throught the line and along the cylinder axis (1)
-    n = d.cross(axis)
-    if n.norm == 0:
+    n = pcross(d, axis)
+    if pnorm(n) == 0:
         # no contact point, but should check here if cylinder *always*
         # intersects line...
         return (None, None, INFINITE)
-    n = n.normalized()
+    n = pnormalized(n)
     # the contact line between the cylinder and this plane (1)
     # is where the surface normal is perpendicular to the plane
     # so line := ccl + \lambda * axis
-    if n.dot(direction) < 0:
-        ccl = center.sub(n.mul(radius))
+    if pdot(n, direction) < 0:
+        ccl = psub(center, pmul(n, radius))
     else:
-        ccl = center.add(n.mul(radius))
+        ccl = padd(center, pmul(n, radius))
     # now extrude the contact line along the direction, this is a plane (2)
-    n2 = direction.cross(axis)
-    if n2.norm == 0:
+    n2 = pcross(direction, axis)
+    if pnorm(n2) == 0:
         # no contact point, but should check here if cylinder *always*
         # intersects line...
         return (None, None, INFINITE)
-    n2 = n2.normalized()
-    plane1 = Plane(ccl, n2)
+    n2 = pnormalized(n2)
     # intersect this plane with the line, this gives us the contact point
-    (cp, l) = plane1.intersect_point(d, edge.p1)
+    (cp, l) = _intersect_plane_point((ccl, n2), d, edge[0])
     if not cp:
         return (None, None, INFINITE)
     # now take a plane through the contact line and perpendicular to the
     # direction (3)
-    plane2 = Plane(ccl, direction)
     # the intersection of this plane (3) with the line through the contact point
     # gives us the cutter contact point
-    (ccp, l) = plane2.intersect_point(direction, cp)
-    cp = ccp.add(direction.mul(-l))
+    (ccp, l) = _intersect_plane_point((ccl, direction), direction, cp)
+    cp = padd(ccp, pmul(direction, -l))
     return (ccp, cp, -l)
 
-def intersect_circle_plane(center, radius, direction, triangle):
+def _intersect_circle_plane(center, radius, direction, plane):
     # let n be the normal to the plane
-    n = triangle.normal
-    if n.dot(direction) == 0:
+    n = plane[1]
+    if pdot(n, direction) == 0:
         return (None, None, INFINITE)
     # project onto z=0
-    n2 = Point(n.x, n.y, 0)
-    if n2.norm == 0:
-        (cp, d) = triangle.plane.intersect_point(direction, center)
-        ccp = cp.sub(direction.mul(d))
+    n2 = (n[0], n[1], 0)
+    if pnorm(n2) == 0:
+        (cp, d) = _intersect_plane_point(plane, direction, center)
+        ccp = psub(cp, pmul(direction, d))
         return (ccp, cp, d)
-    n2 = n2.normalized()
+    n2 = pnormalized(n2)
     # the cutter contact point is on the circle, where the surface normal is n
-    ccp = center.add(n2.mul(-radius))
+    ccp = padd(center, pmul(n2, -radius))
     # intersect the plane with a line through the contact point
-    (cp, d) = triangle.plane.intersect_point(direction, ccp)
+    (cp, d) = _intersect_plane_point(plane, direction, ccp)
     return (ccp, cp, d)
 
-def intersect_circle_point(center, axis, radius, radiussq, direction, point):
+def _intersect_circle_point(center, axis, radius, radiussq, direction, point):
     # take a plane through the base
-    plane = Plane(center, axis)
     # intersect with line gives ccp
-    (ccp, l) = plane.intersect_point(direction, point)
+    (ccp, l) = _intersect_plane_point((center, axis), direction, point)
     # check if inside circle
-    if ccp and (center.sub(ccp).normsq < radiussq - epsilon):
+    if ccp and (pnormsq(psub(center, ccp)) < radiussq - epsilon):
         return (ccp, point, -l)
     return (None, None, INFINITE)
 
-def intersect_circle_line(center, axis, radius, radiussq, direction, edge):
+def _intersect_circle_line(center, axis, radius, radiussq, direction, edge):
     # make a plane by sliding the line along the direction (1)
-    d = edge.dir
-    if d.dot(axis) == 0:
-        if direction.dot(axis) == 0:
+    d = pnormalized(psub(edge[1], edge[0]))
+    if d is None:
+        return (None, None, INFINITE)
+    if pdot(d, axis) == 0:
+        if pdot(direction, axis) == 0:
             return (None, None, INFINITE)
-        plane = Plane(center, axis)
-        (p1, l) = plane.intersect_point(direction, edge.p1)
-        (p2, l) = plane.intersect_point(direction, edge.p2)
-        pc = Line(p1, p2).closest_point(center)
-        d_sq = pc.sub(center).normsq
+        plane = (center, axis)
+        (p1, l) = _intersect_plane_point(plane, direction, edge[0])
+        (p2, l) = _intersect_plane_point(plane, direction, edge[1])
+        pc = _closest_point_on_line(p1, p2, center)
+        d_sq = pnormsq(psub(pc, center))
         if d_sq >= radiussq:
             return (None, None, INFINITE)
         a = sqrt(radiussq - d_sq)
-        d1 = p1.sub(pc).dot(d)
-        d2 = p2.sub(pc).dot(d)
+        d1 = pdot(psub(p1, pc), d)
+        d2 = pdot(psub(p2, pc), d)
         ccp = None
         cp = None
         if abs(d1) < a - epsilon:
             ccp = p1
-            cp = p1.sub(direction.mul(l))
+            cp = psub(p1, pmul(direction, l))
         elif abs(d2) < a - epsilon:
             ccp = p2
-            cp = p2.sub(direction.mul(l))
+            cp = psub(p2, pmul(direction, l))
         elif ((d1 < -a + epsilon) and (d2 > a - epsilon)) \
                 or ((d2 < -a + epsilon) and (d1 > a - epsilon)):
             ccp = pc
-            cp = pc.sub(direction.mul(l))
+            cp = psub(pc, pmul(direction, l))
         return (ccp, cp, -l)
-    n = d.cross(direction)
-    if n.norm == 0:
+    n = pcross(d, direction)
+    if pnorm(n) == 0:
         # no contact point, but should check here if circle *always* intersects
         # line...
         return (None, None, INFINITE)
-    n = n.normalized()
+    n = pnormalized(n)
     # take a plane through the base
-    plane = Plane(center, axis)
     # intersect base with line
-    (lp, l) = plane.intersect_point(d, edge.p1)
+    (lp, l) = _intersect_plane_point((center, axis), d, edge[0])
     if not lp:
         return (None, None, INFINITE)
     # intersection of 2 planes: lp + \lambda v
-    v = axis.cross(n)
-    if v.norm == 0:
+    v = pcross(axis, n)
+    if pnorm(v) == 0:
         return (None, None, INFINITE)
-    v = v.normalized()
+    v = pnormalized(v)
     # take plane through intersection line and parallel to axis
-    n2 = v.cross(axis)
-    if n2.norm == 0:
+    n2 = pcross(v, axis)
+    if pnorm(n2) == 0:
         return (None, None, INFINITE)
-    n2 = n2.normalized()
+    n2 = pnormalized(n2)
     # distance from center to this plane
-    dist = n2.dot(center) - n2.dot(lp)
+    dist = pdot(n2, center) - pdot(n2, lp)
     distsq = dist * dist
     if distsq > radiussq - epsilon:
         return (None, None, INFINITE)
     # must be on circle
     dist2 = sqrt(radiussq - distsq)
-    if d.dot(axis) < 0:
+    if pdot(d, axis) < 0:
         dist2 = -dist2
-    ccp = center.sub(n2.mul(dist)).sub(v.mul(dist2))
-    plane = Plane(edge.p1, d.cross(direction).cross(d))
-    (cp, l) = plane.intersect_point(direction, ccp)
+    ccp = psub(psub(center, pmul(n2, dist)), pmul(v, dist2))
+    plane = (edge[0], pcross(pcross(d, direction), d))
+    (cp, l) = _intersect_plane_point(plane, direction, ccp)
     return (ccp, cp, l)
 
-def intersect_sphere_plane(center, radius, direction, triangle):
+def _intersect_sphere_plane(center, radius, direction, plane):
     # let n be the normal to the plane
-    n = triangle.normal
-    if n.dot(direction) == 0:
+    n = plane[1]
+    if pdot(n, direction) == 0:
         return (None, None, INFINITE)
     # the cutter contact point is on the sphere, where the surface normal is n
-    if n.dot(direction) < 0:
-        ccp = center.sub(n.mul(radius))
+    if pdot(n, direction) < 0:
+        ccp = psub(center, pmul(n, radius))
     else:
-        ccp = center.add(n.mul(radius))
+        ccp = padd(center, pmul(n, radius))
     # intersect the plane with a line through the contact point
-    (cp, d) = triangle.plane.intersect_point(direction, ccp)
+    (cp, d) = _intersect_plane_point(plane, direction, ccp)
     return (ccp, cp, d)
 
-def intersect_sphere_point(center, radius, radiussq, direction, point):
+def _intersect_sphere_point(center, radius, radiussq, direction, point):
     # line equation
     # (1) x = p_0 + \lambda * d
     # sphere equation
     # (2) (x-x_0)^2 = R^2
     # (1) in (2) gives a quadratic in \lambda
-    p0_x0 = center.sub(point)
-    a = direction.normsq
-    b = 2 * p0_x0.dot(direction)
-    c = p0_x0.normsq - radiussq
+    p0_x0 = psub(center, point)
+    a = pnormsq(direction)
+    b = 2 * pdot(p0_x0, direction)
+    c = pnormsq(p0_x0) - radiussq
     d = b * b - 4 * a * c
     if d < 0:
         return (None, None, INFINITE)
@@ -236,21 +304,23 @@ def intersect_sphere_point(center, radius, radiussq, direction, point):
     else:
         l = (-b - sqrt(d)) / (2 * a)
     # cutter contact point
-    ccp = point.add(direction.mul(-l))
+    ccp = padd(point, pmul(direction, -l))
     return (ccp, point, l)
 
-def intersect_sphere_line(center, radius, radiussq, direction, edge):
+def _intersect_sphere_line(center, radius, radiussq, direction, edge):
     # make a plane by sliding the line along the direction (1)
-    d = edge.dir
-    n = d.cross(direction)
-    if n.norm == 0:
+    d = pnormalized(psub(edge[1], edge[0]))
+    if d is None:
+        return (None, None, INFINITE)
+    n = pcross(d, direction)
+    if pnorm(n) == 0:
         # no contact point, but should check here if sphere *always* intersects
         # line...
         return (None, None, INFINITE)
-    n = n.normalized()
+    n = pnormalized(n)
 
     # calculate the distance from the sphere center to the plane
-    dist = - center.dot(n) + edge.p1.dot(n)
+    dist = - pdot(center, n) + pdot(edge[0], n)
     if abs(dist) > radius - epsilon:
         return (None, None, INFINITE)
     # this gives us the intersection circle on the sphere
@@ -259,48 +329,47 @@ def intersect_sphere_line(center, radius, radiussq, direction, edge):
     # find the center on the circle closest to this plane
 
     # which means the other component is perpendicular to this plane (2)
-    n2 = n.cross(d).normalized()
+    n2 = pnormalized(pcross(n, d))
 
     # the contact point is on a big circle through the sphere...
     dist2 = sqrt(radiussq - dist * dist)
 
     # ... and it's on the plane (1)
-    ccp = center.add(n.mul(dist)).add(n2.mul(dist2))
+    ccp = padd(padd(center, pmul(n, dist)), pmul(n2, dist2))
 
     # now intersect a line through this point with the plane (2)
-    plane = Plane(edge.p1, n2)
-    (cp, l) = plane.intersect_point(direction, ccp)
+    (cp, l) = _intersect_plane_point((edge[0], n2), direction, ccp)
     return (ccp, cp, l)
 
-def intersect_torus_plane(center, axis, majorradius, minorradius, direction,
-        triangle):
+def _intersect_torus_plane(center, axis, majorradius, minorradius, direction,
+        plane):
     # take normal to the plane
-    n = triangle.normal
-    if n.dot(direction) == 0:
+    n = plane[1]
+    if pdot(n, direction) == 0:
         return (None, None, INFINITE)
-    if n.dot(axis) == 1:
+    if pdot(n, axis) == 1:
         return (None, None, INFINITE)
     # find place on torus where surface normal is n
-    b = n.mul(-1)
+    b = pmul(n, -1)
     z = axis
-    a = b.sub(z.mul(z.dot(b)))
-    a_sq = a.normsq
+    a = psub(b, pmul(z, pdot(z, b)))
+    a_sq = pnormsq(a)
     if a_sq <= 0:
         return (None, None, INFINITE)
-    a = a.div(sqrt(a_sq))
-    ccp = center.add(a.mul(majorradius)).add(b.mul(minorradius))
+    a = pdiv(a, sqrt(a_sq))
+    ccp = padd(padd(center, pmul(a, majorradius)), pmul(b, minorradius))
     # find intersection with plane
-    (cp, l) = triangle.plane.intersect_point(direction, ccp)
+    (cp, l) = _intersect_plane_point(plane, direction, ccp)
     return (ccp, cp, l)
 
-def intersect_torus_point(center, axis, majorradius, minorradius, majorradiussq,
-        minorradiussq, direction, point):
+def _intersect_torus_point(center, axis, majorradius, minorradius,
+        majorradiussq, minorradiussq, direction, point):
     dist = 0
-    if (direction.x == 0) and (direction.y == 0):
+    if (direction[0] == 0) and (direction[1] == 0):
         # drop
         minlsq = (majorradius - minorradius) ** 2
         maxlsq = (majorradius + minorradius) ** 2
-        l_sq = (point.x-center.x) ** 2 + (point.y - center.y) ** 2
+        l_sq = (point[0] - center[0]) ** 2 + (point[1] - center[1]) ** 2
         if (l_sq < minlsq + epsilon) or (l_sq > maxlsq - epsilon):
             return (None, None, INFINITE)
         l = sqrt(l_sq)
@@ -308,33 +377,31 @@ def intersect_torus_point(center, axis, majorradius, minorradius, majorradiussq,
         if z_sq < 0:
             return (None, None, INFINITE)
         z = sqrt(z_sq)
-        ccp = Point(point.x, point.y, center.z - z)
-        dist = ccp.z - point.z
-    elif direction.z == 0:
+        ccp = (point[0], point[1], center[2] - z)
+        dist = ccp[2] - point[2]
+    elif direction[2] == 0:
         # push
-        z = point.z - center.z
+        z = point[2] - center[2]
         if abs(z) > minorradius - epsilon:
             return (None, None, INFINITE)
         l = majorradius + sqrt(minorradiussq - z * z)
-        n = axis.cross(direction)
-        d = n.dot(point) - n.dot(center)
+        n = pcross(axis, direction)
+        d = pdot(n, point) - pdot(n, center)
         if abs(d) > l - epsilon:
             return (None, None, INFINITE)
         a = sqrt(l * l - d * d)
-        ccp = center.add(n.mul(d).add(direction.mul(a)))
-        ccp.z = point.z
-        dist = point.sub(ccp).dot(direction)
+        ccp = padd(center, padd(pmul(n, d), pmul(direction, a)))
+        ccp = (ccp[0], ccp[1], point[2])
+        dist = pdot(psub(point, ccp), direction)
     else:
         # general case
-        x = point.sub(center)
-        v = direction.mul(-1)
-        x_x = x.dot(x)
-        x_v = x.dot(v)
-        x1 = Point(x.x, x.y, 0)
-        v1 = Point(v.x, v.y, 0)
-        x1_x1 = x1.dot(x1)
-        x1_v1 = x1.dot(v1)
-        v1_v1 = v1.dot(v1)
+        x = psub(point, center)
+        v = pmul(direction, -1)
+        x_x = pdot(x, x)
+        x_v = pdot(x, v)
+        x1_x1 = x[0] * x[0] + x[1] * x[1]
+        x1_v1 = x[0] * v[0] + x[1] * v[1]
+        v1_v1 = v[0] * v[0] + v[1] * v[1]
         R2 = majorradiussq
         r2 = minorradiussq
         a = 1.0
@@ -347,7 +414,134 @@ def intersect_torus_point(center, axis, majorradius, minorradius, majorradiussq,
             return (None, None, INFINITE)
         else:
             l = min(r)
-        ccp = point.add(direction.mul(-l))
+        ccp = padd(point, pmul(direction, -l))
         dist = l
     return (ccp, point, dist)
 
+def _intersect_torus_points(center, axis, majorradius, minorradius,
+        majorradiussq, minorradiussq, direction, points):
+    """ calculate the intersections of a torus with many points at once
+
+    This is the array based equivalent of "_intersect_torus_point" (it
+    requires numpy).
+    @value points: the points to be checked
+    @type points: array of shape (N, 3)
+    @returns: the cutter contact points and the distances along the
+        direction (INFINITE for points without contact)
+    @rtype: tuple(array of shape (N, 3), array of shape (N,))
+    """
+    points = numpy.asarray(points, dtype=numpy.float64)
+    center = numpy.array(center, dtype=numpy.float64)
+    direction_array = numpy.array(direction, dtype=numpy.float64)
+    dists = numpy.empty(len(points))
+    dists.fill(INFINITE)
+    errors = numpy.seterr(all="ignore")
+    try:
+        if (direction[0] == 0) and (direction[1] == 0):
+            # drop
+            minlsq = (majorradius - minorradius) ** 2
+            maxlsq = (majorradius + minorradius) ** 2
+            l_sq = (points[:, 0] - center[0]) ** 2 \
+                    + (points[:, 1] - center[1]) ** 2
+            z_sq = minorradiussq - (majorradius - numpy.sqrt(l_sq)) ** 2
+            valid = (l_sq >= minlsq + epsilon) & (l_sq <= maxlsq - epsilon) \
+                    & (z_sq >= 0)
+            ccps = points.copy()
+            ccps[:, 2] = center[2] - numpy.sqrt(z_sq)
+            dists[valid] = (ccps[:, 2] - points[:, 2])[valid]
+        elif direction[2] == 0:
+            # push
+            z = points[:, 2] - center[2]
+            l = majorradius + numpy.sqrt(minorradiussq - z * z)
+            n = numpy.array(pcross(axis, direction))
+            d = numpy.dot(points, n) - numpy.dot(center, n)
+            valid = (numpy.abs(z) <= minorradius - epsilon) \
+                    & (numpy.abs(d) <= l - epsilon)
+            a = numpy.sqrt(l * l - d * d)
+            ccps = center + (d[:, numpy.newaxis] * n
+                    + a[:, numpy.newaxis] * direction_array)
+            ccps[:, 2] = points[:, 2]
+            dists[valid] = numpy.dot(points - ccps, direction_array)[valid]
+        else:
+            # general case
+            x = points - center
+            v = -direction_array
+            x_x = (x * x).sum(axis=1)
+            x_v = numpy.dot(x, v)
+            x1_x1 = x[:, 0] * x[:, 0] + x[:, 1] * x[:, 1]
+            x1_v1 = x[:, 0] * v[0] + x[:, 1] * v[1]
+            v1_v1 = v[0] * v[0] + v[1] * v[1]
+            R2 = majorradiussq
+            r2 = minorradiussq
+            b = 4 * x_v
+            c = 2 * (x_x + 2 * x_v ** 2 + (R2 - r2) - 2 * R2 * v1_v1)
+            d = 4 * (x_x * x_v + x_v * (R2 - r2) - 2 * R2 * x1_v1)
+            e = (x_x) ** 2 + 2 * x_x * (R2 - r2) + (R2 - r2) ** 2 \
+                    - 4 * R2 * x1_x1
+            roots = poly4_roots_many(1.0, b, c, d, e)
+            roots[numpy.isnan(roots)] = INFINITE
+            dists = roots.min(axis=1)
+            ccps = points - dists[:, numpy.newaxis] * direction_array
+    finally:
+        numpy.seterr(**errors)
+    return (ccps, dists)
+
+
+def _get_plane_tuple(triangle):
+    """ return the plane of a triangle as a tuple (point, normal) """
+    return (ptuple(triangle.plane.p), ptuple(triangle.plane.n))
+
+def _get_line_tuple(edge):
+    """ return the end points of a line as a tuple of two tuples """
+    return (ptuple(edge.p1), ptuple(edge.p2))
+
+def _get_point_results(result):
+    """ convert all tuples (x, y, z) of a result into points """
+    return tuple([Point(*value) if isinstance(value, tuple) else value
+            for value in result])
+
+def intersect_cylinder_point(center, axis, radius, radiussq, direction, point):
+    return _get_point_results(_intersect_cylinder_point(ptuple(center),
+            ptuple(axis), radius, radiussq, ptuple(direction), ptuple(point)))
+
+def intersect_cylinder_line(center, axis, radius, radiussq, direction, edge):
+    return _get_point_results(_intersect_cylinder_line(ptuple(center),
+            ptuple(axis), radius, radiussq, ptuple(direction),
+            _get_line_tuple(edge)))
+
+def intersect_circle_plane(center, radius, direction, triangle):
+    return _get_point_results(_intersect_circle_plane(ptuple(center), radius,
+            ptuple(direction), _get_plane_tuple(triangle)))
+
+def intersect_circle_point(center, axis, radius, radiussq, direction, point):
+    return _get_point_results(_intersect_circle_point(ptuple(center),
+            ptuple(axis), radius, radiussq, ptuple(direction), ptuple(point)))
+
+def intersect_circle_line(center, axis, radius, radiussq, direction, edge):
+    return _get_point_results(_intersect_circle_line(ptuple(center),
+            ptuple(axis), radius, radiussq, ptuple(direction),
+            _get_line_tuple(edge)))
+
+def intersect_sphere_plane(center, radius, direction, triangle):
+    return _get_point_results(_intersect_sphere_plane(ptuple(center), radius,
+            ptuple(direction), _get_plane_tuple(triangle)))
+
+def intersect_sphere_point(center, radius, radiussq, direction, point):
+    return _get_point_results(_intersect_sphere_point(ptuple(center), radius,
+            radiussq, ptuple(direction), ptuple(point)))
+
+def intersect_sphere_line(center, radius, radiussq, direction, edge):
+    return _get_point_results(_intersect_sphere_line(ptuple(center), radius,
+            radiussq, ptuple(direction), _get_line_tuple(edge)))
+
+def intersect_torus_plane(center, axis, majorradius, minorradius, direction,
+        triangle):
+    return _get_point_results(_intersect_torus_plane(ptuple(center),
+            ptuple(axis), majorradius, minorradius, ptuple(direction),
+            _get_plane_tuple(triangle)))
+
+def intersect_torus_point(center, axis, majorradius, minorradius, majorradiussq,
+        minorradiussq, direction, point):
+    return _get_point_results(_intersect_torus_point(ptuple(center),
+            ptuple(axis), majorradius, minorradius, majorradiussq,
+            minorradiussq, ptuple(direction), ptuple(point)))
@@ -588,6 +588,7 @@ class ToolpathSettings(object):
             "engrave_offset": float,
             "milling_style": str,
             "pocketing_type": str,
+            "surface_tolerance": float,
         },
     }
 
@@ -662,7 +663,8 @@ class ToolpathSettings(object):
 
     def set_process_settings(self, generator, postprocessor, path_direction,
             material_allowance=0.0, overlap_percent=0, step_down=1.0,
-            engrave_offset=0.0, milling_style="ignore", pocketing_type="none"):
+            engrave_offset=0.0, milling_style="ignore", pocketing_type="none",
+            surface_tolerance=None):
         # TODO: this hack should be somewhere else, I guess
         if generator in ("ContourFollow", "EngraveCutter"):
             material_allowance = 0.0
@@ -676,6 +678,7 @@ class ToolpathSettings(object):
                 "engrave_offset": engrave_offset,
                 "milling_style": milling_style,
                 "pocketing_type": pocketing_type,
+                "surface_tolerance": surface_tolerance,
         }
 
     def get_process_settings(self):
@@ -689,10 +692,11 @@ class ToolpathSettings(object):
                 (self.tool_settings, "Tool"),
                 (self.process_settings, "Process")):
             for key, value_type in self.SECTIONS[section].items():
-                value_raw = config.get(section, key, None)
-                if value_raw is None:
+                # "get_string" skips empty sections and undefined values
+                if not config.has_option(section, key):
                     continue
-                elif value_type == bool:
+                value_raw = config.get(section, key)
+                if value_type == bool:
                     value = value_raw.lower() in ("1", "true", "yes", "on")
                 elif isinstance(value_type, basestring) \
                         and (value_type.startswith("list_of_")):
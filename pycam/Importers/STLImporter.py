@@ -29,12 +29,24 @@ from pycam.Geometry.Model import Model
 import pycam.Utils.log
 import pycam.Utils
 
-from struct import unpack 
+from struct import unpack, Struct
 import StringIO
 import re
 
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+
 log = pycam.Utils.log.get_logger()
 
+# one facet of a binary STL file: normal, three vertices, attribute count
+FACET_STRUCT = Struct("<12fH")
+# number of facets to be processed between two calls of the "callback"
+FACET_CHUNK_SIZE = 10000
+
 
 vertices = 0
 edges = 0
@@ -52,7 +64,241 @@ def UniqueVertex(x, y, z):
         vertices += 1
         return Point(x, y, z)
 
-def ImportModel(filename, use_kdtree=True, callback=None, **kwargs):
+def _read_binary_facets(f, numfacets):
+    """ read the normals and vertex coordinates of all facets at once
+
+    @returns: a tuple of normals (one 3-tuple per facet) and vertices (a flat
+        sequence of 3-tuples - three per facet); both are numpy arrays if numpy
+        is available
+    """
+    data = f.getvalue()
+    if numpy_enabled:
+        facet_dtype = numpy.dtype([("normal", "<f4", (3, )),
+                ("vertices", "<f4", (3, 3)), ("attributes", "<u2")])
+        facets = numpy.frombuffer(data, dtype=facet_dtype, count=numfacets,
+                offset=84)
+        normals = facets["normal"].astype(numpy.float64)
+        coords = numpy.ascontiguousarray(facets["vertices"]).reshape(-1, 3)
+        return normals, coords
+    else:
+        normals = []
+        coords = []
+        unpack_facet = FACET_STRUCT.unpack_from
+        for offset in xrange(84, 84 + FACET_STRUCT.size * numfacets,
+                FACET_STRUCT.size):
+            values = unpack_facet(data, offset)
+            normals.append(values[0:3])
+            coords.append(values[3:6])
+            coords.append(values[6:9])
+            coords.append(values[9:12])
+        return normals, coords
+
+def _get_unique_vertices(coords, tolerance):
+    """ merge all vertices, that are closer than the given tolerance
+
+    The merging strategy corresponds to L{UniqueVertex}: a vertex is replaced
+    by the first previously seen vertex with a squared distance below
+    'tolerance'.
+
+    @returns: the list of unique vertices (3-tuples in order of their first
+        appearance) and the index of the unique vertex for every input vertex
+    """
+    if numpy_enabled:
+        unique, indices = _get_unique_vertices_numpy(coords, tolerance)
+        return unique.tolist(), indices.tolist()
+    # pure python: hash grid with a cell size of the tolerance distance
+    cell_size = tolerance ** 0.5
+    grid = {}
+    unique = []
+    exact = {}
+    indices = []
+    neighbour_offsets = [(dx, dy, dz) for dx in (-1, 0, 1)
+            for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+    for coord in coords:
+        try:
+            indices.append(exact[coord])
+            continue
+        except KeyError:
+            pass
+        x, y, z = coord
+        cell = (int(x // cell_size), int(y // cell_size), int(z // cell_size))
+        found = None
+        for dx, dy, dz in neighbour_offsets:
+            for other in grid.get((cell[0] + dx, cell[1] + dy, cell[2] + dz),
+                    ()):
+                ox, oy, oz = unique[other]
+                if (x - ox) ** 2 + (y - oy) ** 2 + (z - oz) ** 2 < tolerance:
+                    if (found is None) or (other < found):
+                        found = other
+        if found is None:
+            found = len(unique)
+            unique.append((float(x), float(y), float(z)))
+            grid.setdefault(cell, []).append(found)
+        exact[coord] = found
+        indices.append(found)
+    return unique, indices
+
+def _get_unique_vertices_numpy(coords, tolerance):
+    # Merge bitwise identical vertices first. Shared vertices of adjacent
+    # facets are usually identical in STL files.
+    row_view = coords.view(numpy.dtype((numpy.void, coords.dtype.itemsize * 3)))
+    unused, first_index, inverse = numpy.unique(row_view.ravel(),
+            return_index=True, return_inverse=True)
+    # sort the unique vertices by their first appearance
+    order = numpy.argsort(first_index, kind="mergesort")
+    rank = numpy.empty(len(order), dtype=numpy.intp)
+    rank[order] = numpy.arange(len(order))
+    inverse = rank[inverse]
+    unique = coords[first_index[order]].astype(numpy.float64)
+    # Vertices closer than the tolerance distance share a cell (with twice
+    # the size of the tolerance distance) in at least one of eight grids
+    # shifted by half a cell along each axis.
+    distance = tolerance ** 0.5
+    cell_size = 2 * distance
+    parent = numpy.arange(len(unique))
+    def find_root(index):
+        while parent[index] != index:
+            index = parent[index]
+        return index
+    for shift_x in (0, distance):
+        for shift_y in (0, distance):
+            for shift_z in (0, distance):
+                shifted = unique + (shift_x, shift_y, shift_z)
+                cells = numpy.floor(shifted / cell_size).astype(numpy.int64)
+                cell_order = numpy.lexsort((cells[:, 2], cells[:, 1],
+                        cells[:, 0]))
+                sorted_cells = cells[cell_order]
+                same_cell = numpy.all(sorted_cells[1:] == sorted_cells[:-1],
+                        axis=1)
+                if not same_cell.any():
+                    continue
+                # collect the runs of vertices sharing a cell
+                runs = []
+                for position in numpy.nonzero(same_cell)[0]:
+                    if runs and (runs[-1][-1] == position):
+                        runs[-1].append(position + 1)
+                    else:
+                        runs.append([position, position + 1])
+                for run in runs:
+                    members = sorted(cell_order[run])
+                    for index, first in enumerate(members):
+                        for second in members[index + 1:]:
+                            diff = unique[first] - unique[second]
+                            if numpy.dot(diff, diff) < tolerance:
+                                root1 = find_root(first)
+                                root2 = find_root(second)
+                                # the older vertex wins
+                                parent[max(root1, root2)] = min(root1, root2)
+    merged = [index for index in xrange(len(parent))
+            if parent[index] != index]
+    if merged:
+        for index in merged:
+            parent[index] = find_root(index)
+        kept = parent == numpy.arange(len(parent))
+        new_index = numpy.cumsum(kept) - 1
+        inverse = new_index[parent[inverse]]
+        unique = unique[kept]
+    return unique, inverse
+
+def _import_binary_facets(model, f, numfacets, filename, callback=None):
+    """ add all facets of a binary STL file to the model
+
+    The facets are read in one go and the vertices are merged in bulk instead
+    of looking up every single vertex in a L{PointKdtree}.
+    @returns: False if the operation was cancelled, otherwise True
+    """
+    global vertices
+    normals, coords = _read_binary_facets(f, numfacets)
+    if callback and callback():
+        return False
+    if model.is_compact():
+        return _import_binary_facets_compact(model, normals, coords, filename)
+    if numpy_enabled:
+        normals = normals.tolist()
+    if model._use_kdtree:
+        unique, indices = _get_unique_vertices(coords, epsilon)
+    else:
+        if numpy_enabled:
+            coords = coords.astype(numpy.float64).tolist()
+        unique = coords
+        indices = xrange(len(unique))
+    if callback and callback():
+        return False
+    vertices = len(unique)
+    points = [Point(x, y, z) for x, y, z in unique]
+    normal_conflict_warning_seen = False
+    for facet_index in xrange(numfacets):
+        if callback and (facet_index % FACET_CHUNK_SIZE == 0) and callback():
+            return False
+        i1, i2, i3 = indices[3 * facet_index:3 * facet_index + 3]
+        p1, p2, p3 = points[i1], points[i2], points[i3]
+        a1, a2, a3 = normals[facet_index]
+        # the cross product of (p2 - p1) and (p3 - p1)
+        u1, u2, u3 = p2.x - p1.x, p2.y - p1.y, p2.z - p1.z
+        v1, v2, v3 = p3.x - p1.x, p3.y - p1.y, p3.z - p1.z
+        c1, c2, c3 = u2 * v3 - u3 * v2, u3 * v1 - u1 * v3, u1 * v2 - u2 * v1
+        if a1 == a2 == a3 == 0:
+            dotcross = c3
+            n = None
+        else:
+            dotcross = a1 * c1 + a2 * c2 + a3 * c3
+            n = Vector(float(a1), float(a2), float(a3))
+        if dotcross > 0:
+            # Triangle expects the vertices in clockwise order
+            t = Triangle(p1, p3, p2, n)
+        elif dotcross < 0:
+            if not normal_conflict_warning_seen:
+                log.warn(("Inconsistent normal/vertices found in facet " + \
+                        "definition %d of '%s'. Please validate the " + \
+                        "STL file!") % (facet_index + 1, filename))
+                normal_conflict_warning_seen = True
+            t = Triangle(p1, p2, p3, n)
+        else:
+            # the three points are in a line - or two points are identical
+            # usually this is caused by points, that are too close together
+            log.warn("Skipping invalid triangle: %s / %s / %s " \
+                    % (p1, p2, p3) + "(maybe the resolution of the model " \
+                    + "is too high?)")
+            continue
+        model.append(t)
+    return True
+
+def _import_binary_facets_compact(model, normals, coords, filename):
+    """ add the facets as arrays to a compact model (without creating any
+    Triangle objects)
+    """
+    global vertices
+    if model._use_kdtree:
+        unique, indices = _get_unique_vertices_numpy(coords, epsilon)
+    else:
+        unique = coords.astype(numpy.float64)
+        indices = numpy.arange(len(unique))
+    vertices = len(unique)
+    faces = indices.reshape(-1, 3)
+    corners = unique[faces]
+    cross = numpy.cross(corners[:, 1] - corners[:, 0],
+            corners[:, 2] - corners[:, 0])
+    without_normal = ~normals.any(axis=1)
+    dotcross = numpy.where(without_normal, cross[:, 2],
+            (normals * cross).sum(axis=1))
+    conflicts = numpy.nonzero(dotcross < 0)[0]
+    if len(conflicts) > 0:
+        log.warn(("Inconsistent normal/vertices found in facet " + \
+                "definition %d of '%s'. Please validate the " + \
+                "STL file!") % (conflicts[0] + 1, filename))
+    invalid_count = numpy.count_nonzero(dotcross == 0)
+    if invalid_count > 0:
+        log.warn("Skipping %d invalid triangles (maybe the resolution of " \
+                % invalid_count + "the model is too high?)")
+    # Triangle expects the vertices in clockwise order
+    clockwise = dotcross > 0
+    faces[clockwise] = faces[clockwise][:, (0, 2, 1)]
+    valid = dotcross != 0
+    model.extend_arrays(unique, faces[valid], normals[valid])
+    return True
+
+def ImportModel(filename, use_kdtree=True, callback=None, compact=False,
+        **kwargs):
     global vertices, edges, kdtree
     vertices = 0
     edges = 0
@@ -111,7 +357,7 @@ def ImportModel(filename, use_kdtree=True, callback=None, **kwargs):
 
     if use_kdtree:
         kdtree = PointKdtree([], 3, 1, epsilon)
-    model = Model(use_kdtree)
+    model = Model(use_kdtree, compact=compact)
 
     t = None
     p1 = None
@@ -119,64 +365,9 @@ def ImportModel(filename, use_kdtree=True, callback=None, **kwargs):
     p3 = None
 
     if binary:
-        for i in range(1, numfacets + 1): 
-            if callback and callback():
-                log.warn("STLImporter: load model operation cancelled")
-                return None
-            a1 = unpack("<f", f.read(4))[0] 
-            a2 = unpack("<f", f.read(4))[0] 
-            a3 = unpack("<f", f.read(4))[0] 
-
-            n = Vector(float(a1), float(a2), float(a3))
-            
-            v11 = unpack("<f", f.read(4))[0] 
-            v12 = unpack("<f", f.read(4))[0] 
-            v13 = unpack("<f", f.read(4))[0] 
-
-            p1 = UniqueVertex(float(v11), float(v12), float(v13))
-            
-            v21 = unpack("<f", f.read(4))[0] 
-            v22 = unpack("<f", f.read(4))[0] 
-            v23 = unpack("<f", f.read(4))[0] 
-
-            p2 = UniqueVertex(float(v21), float(v22), float(v23))
-            
-            v31 = unpack("<f", f.read(4))[0] 
-            v32 = unpack("<f", f.read(4))[0] 
-            v33 = unpack("<f", f.read(4))[0] 
-            
-            p3 = UniqueVertex(float(v31), float(v32), float(v33))
-
-            # not used
-            attribs = unpack("<H", f.read(2)) 
-            
-            dotcross = n.dot(p2.sub(p1).cross(p3.sub(p1)))
-            if a1 == a2 == a3 == 0:
-                dotcross = p2.sub(p1).cross(p3.sub(p1)).z
-                n = None
-
-            if dotcross > 0:
-                # Triangle expects the vertices in clockwise order
-                t = Triangle(p1, p3, p2)
-            elif dotcross < 0:
-                if not normal_conflict_warning_seen:
-                    log.warn(("Inconsistent normal/vertices found in facet " + \
-                            "definition %d of '%s'. Please validate the " + \
-                            "STL file!") % (i, filename))
-                    normal_conflict_warning_seen = True
-                t = Triangle(p1, p2, p3)
-            else:
-                # the three points are in a line - or two points are identical
-                # usually this is caused by points, that are too close together
-                # check the tolerance value in pycam/Geometry/PointKdtree.py
-                log.warn("Skipping invalid triangle: %s / %s / %s " \
-                        % (p1, p2, p3) + "(maybe the resolution of the model " \
-                        + "is too high?)")
-                continue
-            if n:
-                t.normal = n
-
-            model.append(t)
+        if not _import_binary_facets(model, f, numfacets, filename, callback):
+            log.warn("STLImporter: load model operation cancelled")
+            return None
     else:
         solid = re.compile(r"\s*solid\s+(\w+)\s+.*")
         endsolid = re.compile(r"\s*endsolid\s*")
@@ -37,6 +37,9 @@ _DEBUG_DISABLE_COLLISION_CHECK = False
 _DEBUG_DISABLE_EXTEND_LINES = False
 _DEBUG_DISBALE_WATERLINE_SHIFT = False
 
+# number of adjacent layers processed by a single task
+LAYERS_PER_TASK = 8
+
 
 log = pycam.Utils.log.get_logger()
 
@@ -71,6 +74,26 @@ def _process_one_triangle((model, cutter, up_vector, triangle, z)):
                     result.append((edge, shifted_edge))
         return result, None
 
+def _process_triangle_layers((triangle_index, model, cutter, up_vector,
+        triangle, z_levels)):
+    """ follow one triangle downwards through a sequence of layers
+
+    The triangle is skipped for all following layers as soon as it does not
+    contribute to a waterline anymore.
+    @returns: the index of the triangle, the results of "_process_one_triangle"
+        for the processed layers and the flag for ignoring the triangle from
+        now on
+    @rtype: tuple(int, list, bool)
+    """
+    layer_results = []
+    for z in z_levels:
+        result, ignore_triangle_id_list = _process_one_triangle((model,
+                cutter, up_vector, triangle, z))
+        layer_results.append(result)
+        if ignore_triangle_id_list:
+            return triangle_index, layer_results, True
+    return triangle_index, layer_results, False
+
 
 class CollisionPaths(object):
 
@@ -199,7 +222,6 @@ class ContourFollow(object):
         self.pa = path_processor
         self._up_vector = Vector(0, 0, 1)
         self.physics = physics
-        self._processed_triangles = []
         if self.physics:
             accuracy = 20
             max_depth = 16
@@ -222,8 +244,6 @@ class ContourFollow(object):
 
     def GenerateToolPath(self, cutter, models, minx, maxx, miny, maxy, minz,
             maxz, dz, draw_callback=None):
-        # reset the list of processed triangles
-        self._processed_triangles = []
         # calculate the number of steps
         # Sometimes there is a floating point accuracy issue: make sure
         # that only one layer is drawn, if maxz and minz are almost the same.
@@ -236,44 +256,90 @@ class ContourFollow(object):
 
         # only the first model is used for the contour-follow algorithm
         # TODO: should we combine all models?
-        num_of_triangles = len(models[0].triangles(minx=minx, miny=miny,
-                maxx=maxx, maxy=maxy))
+        model = models[0]
+        triangles = model.triangles(minx=minx, miny=miny, maxx=maxx,
+                maxy=maxy)
+        num_of_triangles = len(triangles)
         progress_counter = ProgressCounter(2 * num_of_layers * num_of_triangles,
                 draw_callback)
 
-        current_layer = 0
-
         z_steps = [(maxz - i * z_step) for i in range(num_of_layers)]
+        # triangles without a waterline are skipped in all following layers
+        ignored_triangles = set()
 
-        # collision handling function
-        for z in z_steps:
-            # update the progress bar and check, if we should cancel the process
-            if draw_callback:
-                if draw_callback(text="ContourFollow: processing layer %d/%d" \
-                        % (current_layer + 1, num_of_layers)):
-                    # cancel immediately
+        current_layer = 0
+        quit_requested = False
+        # The layers are processed in windows. Every task follows a triangle
+        # through all layers of a window. Thus the pool of workers drains
+        # only once per window instead of once per layer.
+        for window_start in range(0, num_of_layers, LAYERS_PER_TASK):
+            z_levels = z_steps[window_start:window_start + LAYERS_PER_TASK]
+            args = [(triangle_index, model, cutter, self._up_vector, triangle,
+                        z_levels)
+                    for triangle_index, triangle in enumerate(triangles)
+                    if not triangle_index in ignored_triangles]
+            # the waterline results of every layer: (triangle index, result)
+            window_results = [[] for z in z_levels]
+            for triangle_index, layer_results, ignore_triangle in \
+                    run_in_parallel(_process_triangle_layers, args,
+                        unordered=True, callback=progress_counter.update):
+                for layer_index, result in enumerate(layer_results):
+                    window_results[layer_index].append(
+                            (triangle_index, result))
+                if ignore_triangle:
+                    ignored_triangles.add(triangle_index)
+                if progress_counter.increment(len(z_levels)):
+                    # quit requested
+                    quit_requested = True
+                    break
+            if quit_requested:
+                break
+            for z, layer_results in zip(z_levels, window_results):
+                # update the progress bar and check, if we should cancel the
+                # process
+                if draw_callback:
+                    if draw_callback(text="ContourFollow: processing " \
+                            + "layer %d/%d" % (current_layer + 1,
+                                num_of_layers)):
+                        # cancel immediately
+                        quit_requested = True
+                        break
+                # use the order of the triangles (independent of the workers)
+                layer_results.sort()
+                shifted_lines = self.get_potential_contour_lines(
+                        [result for triangle_index, result in layer_results],
+                        minx, maxx, miny, maxy, z)
+                self.pa.new_direction(0)
+                quit_requested = self.GenerateToolPathSlice(cutter, model,
+                        shifted_lines, draw_callback, progress_counter,
+                        num_of_triangles)
+                self.pa.end_direction()
+                self.pa.finish()
+                if quit_requested:
                     break
-            self.pa.new_direction(0)
-            self.GenerateToolPathSlice(cutter, models[0], minx, maxx, miny, maxy, z,
-                    draw_callback, progress_counter, num_of_triangles)
-            self.pa.end_direction()
-            self.pa.finish()
-            current_layer += 1
+                current_layer += 1
+            if quit_requested:
+                break
         return self.pa.paths
 
-    def GenerateToolPathSlice(self, cutter, model, minx, maxx, miny, maxy, z,
+    def GenerateToolPathSlice(self, cutter, model, shifted_lines,
             draw_callback=None, progress_counter=None, num_of_triangles=None):
-        shifted_lines = self.get_potential_contour_lines(cutter, model, minx, maxx, miny, maxy,
-                z, progress_counter=progress_counter)
+        """ add the collision-free parts of the contour lines of a layer
+
+        @returns: True, if the user requested to quit
+        @rtype: bool
+        """
         if num_of_triangles is None:
             num_of_triangles = len(shifted_lines)
+        quit_requested = False
         last_position = None
         self.pa.new_scanline()
         for line in shifted_lines:
             if _DEBUG_DISABLE_COLLISION_CHECK:
                 points = (line.p1, line.p2)
             else:
-                points = self._get_free_paths(line.p1, line.p2)
+                points = self._get_free_paths(cutter, [model], line.p1,
+                        line.p2)
             if points:
                 if (not last_position is None) and (last_position != points[0]):
                     self.pa.end_scanline()
@@ -288,34 +354,29 @@ class ContourFollow(object):
             if not progress_counter is None:
                 if progress_counter.increment():
                     # quit requested
+                    quit_requested = True
                     break
         # The progress counter jumps up by the number of non directly processed
         # triangles.
-        if not progress_counter is None:
-            progress_counter.increment(num_of_triangles - len(shifted_lines))
+        if (not progress_counter is None) and not quit_requested:
+            quit_requested = progress_counter.increment(
+                    num_of_triangles - len(shifted_lines))
         self.pa.end_scanline()
-        return self.pa.paths
+        return quit_requested
+
+    def get_potential_contour_lines(self, layer_results, minx, maxx, miny,
+            maxy, z):
+        """ combine the waterlines of the triangles of a layer
 
-    def get_potential_contour_lines(self, cutter, model, minx, maxx, miny, maxy, z,
-            progress_counter=None):
-        # use only the first model for the contour
-        follow_model = model
+        @value layer_results: the results of "_process_one_triangle" for the
+            triangles of the layer
+        @returns: the shifted waterlines of the layer
+        @rtype: list(Line)
+        """
         waterline_triangles = CollisionPaths()
-        triangles = follow_model.triangles(minx=minx, miny=miny, maxx=maxx,
-                maxy=maxy)
-        args = [(follow_model, cutter, self._up_vector, t, z)
-                for t in triangles if not id(t) in self._processed_triangles]
-        results_iter = run_in_parallel(_process_one_triangle, args,
-                unordered=True, callback=progress_counter.update)
-        for result, ignore_triangle_id_list in results_iter:
-            if ignore_triangle_id_list:
-                self._processed_triangles.extend(ignore_triangle_id_list)
+        for result in layer_results:
             for edge, shifted_edge in result:
                 waterline_triangles.add(edge, shifted_edge)
-            if (not progress_counter is None) \
-                    and (progress_counter.increment()):
-                # quit requested
-                break
         if not _DEBUG_DISABLE_EXTEND_LINES:
             waterline_triangles.extend_shifted_lines()
         result = []
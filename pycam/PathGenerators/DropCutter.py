@@ -22,6 +22,7 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from pycam.PathGenerators import get_max_height_dynamic
+from pycam.PathGenerators.HeightMap import get_drop_heightmap
 from pycam.Utils import ProgressCounter
 from pycam.Utils.threading import run_in_parallel
 import pycam.Geometry.Model
@@ -32,12 +33,14 @@ log = pycam.Utils.log.get_logger()
 
 # We need to use a global function here - otherwise it does not work with
 # the multiprocessing Pool.
-def _process_one_grid_line((positions, minz, maxz, model, cutter, physics)):
+def _process_one_grid_line((positions, minz, maxz, model, cutter, physics,
+        heightmap, tolerance)):
     """ This function assumes, that the positions are next to each other.
     Otherwise the dynamic over-sampling (in get_max_height_dynamic) is
     pointless.
     """
-    return get_max_height_dynamic(model, cutter, positions, minz, maxz, physics)
+    return get_max_height_dynamic(model, cutter, positions, minz, maxz,
+            physics, heightmap=heightmap, tolerance=tolerance)
 
 
 class DropCutter(object):
@@ -46,7 +49,14 @@ class DropCutter(object):
         self.pa = path_processor
         self.physics = physics
 
-    def GenerateToolPath(self, cutter, models, motion_grid, minz=None, maxz=None, draw_callback=None):
+    def GenerateToolPath(self, cutter, models, motion_grid, minz=None,
+            maxz=None, draw_callback=None, tolerance=None):
+        """ calculate the toolpath for the lines of the motion grid
+
+        @value tolerance: the maximum distance between the toolpath and the
+            surface of the model (see L{get_max_height_dynamic})
+        @type tolerance: float
+        """
         quit_requested = False
         model = pycam.Geometry.Model.get_combined_model(models)
 
@@ -59,17 +69,31 @@ class DropCutter(object):
                 lines.append(line)
 
         num_of_lines = len(lines)
-        progress_counter = ProgressCounter(len(lines), draw_callback)
         current_line = 0
 
         self.pa.new_direction(0)
 
+        # simplify the data (useful for remote processing)
+        lines = [[(pos.x, pos.y) for pos in line] for line in lines]
+        coords = [xy for line in lines for xy in line]
+
+        if (self.physics is None) and coords:
+            # The drop heights of the model are cached for subsequent
+            # toolpaths (e.g. other directions) with the same tool. The height
+            # map is limited to the area of the motion grid.
+            xs = [x for x, y in coords]
+            ys = [y for x, y in coords]
+            heightmap = get_drop_heightmap(model, cutter,
+                    (min(xs), max(xs), min(ys), max(ys)), len(coords),
+                    tolerance=tolerance, draw_callback=draw_callback)
+        else:
+            heightmap = None
+
+        progress_counter = ProgressCounter(num_of_lines, draw_callback)
         args = []
-        for one_grid_line in lines:
-            # simplify the data (useful for remote processing)
-            xy_coords = [(pos.x, pos.y) for pos in one_grid_line]
+        for xy_coords in lines:
             args.append((xy_coords, minz, maxz, model, cutter,
-                    self.physics))
+                    self.physics, heightmap, tolerance))
         for points in run_in_parallel(_process_one_grid_line, args,
                 callback=progress_counter.update):
             self.pa.new_scanline()
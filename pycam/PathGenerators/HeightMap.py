@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+
+A cache of drop heights for a model and a tool.
+
+The heights of the tool (the "inverse tool offset" of the model) are
+calculated once for a fine grid covering the processed area of the model.
+Later drop requests for the same model and tool (e.g. finishing in another
+direction or with another overlap) are answered by interpolation. Only
+positions within unsafe cells of the grid (steep walls, edges, strongly curved
+surfaces) are calculated again.
+The grid is only worth its costs if more positions are requested than the grid
+contains nodes (e.g. for a second direction within the same area).
+"""
+
+from pycam.PathGenerators import get_max_height_triangles_batch, \
+        is_batch_drop_supported
+from pycam.Geometry.utils import INFINITE, epsilon
+from pycam.Utils.threading import run_in_parallel
+from pycam.Utils import ProgressCounter
+import pycam.Utils.log
+import uuid
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+
+log = pycam.Utils.log.get_logger()
+
+# the default distance of the grid nodes (relative to the tool radius)
+DEFAULT_RESOLUTION_FACTOR = 0.1
+# the grid is not used if the nodes are further apart (relative to the radius)
+MAX_RESOLUTION_FACTOR = 0.5
+# maximum deviation of an interpolated height (in model units)
+DEFAULT_TOLERANCE = 0.001
+# limit the memory consumption of a single height map (8 bytes per node)
+MAX_NODES = 4 * 1024 * 1024
+# number of nodes along each side of a tile (the unit of parallel processing)
+TILE_SIZE = 64
+# number of height maps kept in memory
+MAX_CACHED_HEIGHTMAPS = 4
+
+# heights below this limit mark nodes without any contact to the model
+NO_CONTACT = -INFINITE / 2
+
+
+# the most recently used height maps: list of (key, height map)
+_heightmaps = []
+# the number of requested positions for areas without a height map:
+# list of (key, area, number of positions)
+_demands = []
+
+
+def get_cutter_key(cutter):
+    """ return the attributes of a cutter influencing its drop heights """
+    return (cutter.__class__.__name__, float(cutter.radius),
+            float(getattr(cutter, "minorradius", 0)),
+            float(cutter.get_required_distance()))
+
+def get_drop_heightmap(model, cutter, area, positions, resolution=None,
+        tolerance=None, draw_callback=None):
+    """ return the cached height map of the model and the cutter
+
+    The height map is calculated if it is not available in the cache and if
+    more positions were requested for the area (in total) than the height map
+    would contain nodes. Otherwise the exact calculation of the positions is
+    cheaper.
+    @value area: the xy range of the requested positions
+    @type area: tuple(minx, maxx, miny, maxy)
+    @value positions: the number of requested positions
+    @type positions: int
+    @value resolution: the distance between two nodes of the grid - a tenth
+        of the tool radius is used by default
+    @type resolution: float
+    @value tolerance: the maximum deviation of interpolated heights
+    @type tolerance: float
+    @value draw_callback: the progress callback (e.g. of a path generator)
+    @returns: the height map or None (if the cutter or the model are not
+        suitable, if the height map is not worth its costs or if the
+        calculation was cancelled)
+    @rtype: DropHeightMap
+    """
+    if (model is None) or (len(model) == 0) \
+            or not is_batch_drop_supported(model, cutter):
+        return None
+    if tolerance is None:
+        tolerance = DEFAULT_TOLERANCE
+    # nodes outside of the model (including the radius) are not necessary
+    radius = cutter.distance_radius
+    area = (max(area[0], model.minx - radius),
+            min(area[1], model.maxx + radius),
+            max(area[2], model.miny - radius),
+            min(area[3], model.maxy + radius))
+    if (area[0] > area[1]) or (area[2] > area[3]):
+        return None
+    if resolution is None:
+        resolution = DEFAULT_RESOLUTION_FACTOR * radius
+        # coarsen the grid for huge areas
+        resolution = max(resolution, ((area[1] - area[0] + 2 * resolution) \
+                * (area[3] - area[2] + 2 * resolution) / MAX_NODES) ** 0.5)
+    if resolution > MAX_RESOLUTION_FACTOR * radius:
+        # narrow features of the model could hide between the nodes
+        log.debug("Skipping the height map: the area is too large")
+        return None
+    key = (model.uuid, get_cutter_key(cutter), float(tolerance))
+    for index, (item_key, heightmap) in enumerate(_heightmaps):
+        if (item_key == key) and (heightmap.resolution <= resolution) \
+                and heightmap.contains_area(area):
+            # mark this item as recently used
+            _heightmaps.append(_heightmaps.pop(index))
+            return heightmap
+    # sum up the positions requested for this area
+    for index, (item_key, item_area, item_positions) in enumerate(_demands):
+        if (item_key == key) and (item_area == area):
+            positions += item_positions
+            _demands.pop(index)
+            break
+    nodes = DropHeightMap.get_grid(area, resolution)[2:]
+    if positions <= nodes[0] * nodes[1]:
+        log.debug("Skipping the height map: %d positions are cheaper than " \
+                % positions + "%dx%d nodes" % nodes)
+        _demands.append((key, area, positions))
+        while len(_demands) > MAX_CACHED_HEIGHTMAPS:
+            _demands.pop(0)
+        return None
+    heightmap = DropHeightMap.create(model, cutter, area, resolution,
+            tolerance, draw_callback=draw_callback)
+    if heightmap is not None:
+        _heightmaps.append((key, heightmap))
+        while len(_heightmaps) > MAX_CACHED_HEIGHTMAPS:
+            _heightmaps.pop(0)
+    return heightmap
+
+def clear_heightmap_cache():
+    while _heightmaps:
+        _heightmaps.pop()
+    while _demands:
+        _demands.pop()
+
+# We need to use a global function here - otherwise it does not work with
+# the multiprocessing Pool.
+def _process_one_tile((xs, ys, model, cutter)):
+    grid_x, grid_y = numpy.meshgrid(xs, ys)
+    coords = numpy.column_stack((grid_x.ravel(), grid_y.ravel()))
+    heights = get_max_height_triangles_batch(model, cutter, coords,
+            -INFINITE, INFINITE)
+    return heights.reshape(len(ys), len(xs))
+
+
+class DropHeightMap(object):
+    """ the drop heights of a cutter for a regular grid covering a model
+
+    Every cell of the grid (between four nodes) is marked as unsafe if the
+    heights of its nodes do not allow an accurate interpolation. This is
+    checked via the second differences of the heights at the nodes: they
+    exceed the tolerance at steep walls, at edges and at surfaces with a
+    small radius of curvature (compared to the size of a cell).
+    """
+
+    def __init__(self, origin, resolution, heights, tolerance, map_uuid=None):
+        """ use the heights of the nodes (see "create")
+
+        @value origin: the xy coordinates of the first node
+        @type origin: tuple(float, float)
+        @value heights: the drop heights of the nodes (indexed by y and x) -
+            nodes without contact are below L{NO_CONTACT}
+        @type heights: array of shape (ny, nx)
+        """
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.resolution = float(resolution)
+        self.heights = heights
+        self.tolerance = float(tolerance)
+        self.unsafe = self._get_unsafe_cells(heights, self.tolerance)
+        self.uuid = map_uuid or str(uuid.uuid4())
+
+    @staticmethod
+    def get_grid(area, resolution):
+        """ return the first node and the number of nodes covering an area
+
+        The grid exceeds the area by one node in every direction.
+        @value area: see L{get_drop_heightmap}
+        @returns: the coordinates of the first node and the number of nodes
+        @rtype: tuple(low_x, low_y, count_x, count_y)
+        """
+        low_x = area[0] - resolution
+        low_y = area[2] - resolution
+        count_x = int((area[1] - low_x) / resolution) + 2
+        count_y = int((area[3] - low_y) / resolution) + 2
+        return (low_x, low_y, count_x, count_y)
+
+    @classmethod
+    def create(cls, model, cutter, area, resolution,
+            tolerance=DEFAULT_TOLERANCE, draw_callback=None):
+        """ calculate the heights for all nodes (in parallel)
+
+        The grid covers the given area. It is processed in square tiles.
+        @value area: see L{get_drop_heightmap}
+        @value draw_callback: receives the progress of the tiles
+        @returns: the new height map or None (if cancelled)
+        """
+        low_x, low_y, count_x, count_y = cls.get_grid(area, resolution)
+        heights = numpy.empty((count_y, count_x))
+        tiles = []
+        args = []
+        for start_y in range(0, count_y, TILE_SIZE):
+            for start_x in range(0, count_x, TILE_SIZE):
+                end_x = min(start_x + TILE_SIZE, count_x)
+                end_y = min(start_y + TILE_SIZE, count_y)
+                xs = low_x + resolution * numpy.arange(start_x, end_x)
+                ys = low_y + resolution * numpy.arange(start_y, end_y)
+                tiles.append((start_x, end_x, start_y, end_y))
+                args.append((xs, ys, model, cutter))
+        log.debug("Calculating a height map with %dx%d nodes (%d tiles)" \
+                % (count_x, count_y, len(tiles)))
+        if draw_callback:
+            draw_callback(text="Calculating the height map")
+        # a separate counter: the tiles are unrelated to the progress of the
+        # path generator
+        progress_counter = ProgressCounter(len(tiles), draw_callback)
+        finished = 0
+        for tile, tile_heights in zip(tiles, run_in_parallel(
+                _process_one_tile, args)):
+            start_x, end_x, start_y, end_y = tile
+            heights[start_y:end_y, start_x:end_x] = tile_heights
+            finished += 1
+            if progress_counter.increment():
+                # cancel requested
+                break
+        if finished < len(tiles):
+            return None
+        return cls((low_x, low_y), resolution, heights, tolerance)
+
+    def __len__(self):
+        return self.heights.size
+
+    def contains_area(self, area):
+        """ check if the grid covers the given area (see L{get_grid}) """
+        count_y, count_x = self.heights.shape
+        return (self.origin[0] <= area[0] - self.resolution + epsilon) \
+                and (self.origin[1] <= area[2] - self.resolution + epsilon) \
+                and (self.origin[0] + (count_x - 2) * self.resolution \
+                    >= area[1] - epsilon) \
+                and (self.origin[1] + (count_y - 2) * self.resolution \
+                    >= area[3] - epsilon)
+
+    @staticmethod
+    def _get_unsafe_cells(heights, tolerance):
+        contact = heights > NO_CONTACT
+        # the sum of the second differences (along x and y) at every node
+        curvature = numpy.zeros(heights.shape)
+        for axis in (0, 1):
+            if heights.shape[axis] < 3:
+                continue
+            diff = numpy.abs(numpy.diff(heights, n=2, axis=axis))
+            if axis == 0:
+                curvature[1:-1, :] += diff
+            else:
+                curvature[:, 1:-1] += diff
+        curvature[~contact] = 0
+        def get_corners(values):
+            return (values[:-1, :-1], values[:-1, 1:], values[1:, :-1],
+                    values[1:, 1:])
+        corner_contact = get_corners(contact)
+        all_contact = corner_contact[0] & corner_contact[1] \
+                & corner_contact[2] & corner_contact[3]
+        any_contact = corner_contact[0] | corner_contact[1] \
+                | corner_contact[2] | corner_contact[3]
+        corner_curvature = get_corners(curvature)
+        max_curvature = numpy.maximum(
+                numpy.maximum(corner_curvature[0], corner_curvature[1]),
+                numpy.maximum(corner_curvature[2], corner_curvature[3]))
+        # The error of a linear interpolation between two nodes is below a
+        # quarter of the second difference (even for a kink of the surface).
+        # The sum of both directions needs an additional margin.
+        # Cells without any contact are safe: every feature of the model is
+        # widened by the radius of the tool - thus it touches some nodes.
+        # Cells with partial contact contain a wall.
+        return (any_contact & ~all_contact) \
+                | (all_contact & (max_curvature > 2 * tolerance))
+
+    def get_shared_arrays(self):
+        """ see L{pycam.Geometry.Model.Model.get_shared_arrays} """
+        return {"heights": self.heights,
+                "grid": numpy.array((self.origin[0], self.origin[1],
+                    self.resolution, self.tolerance))}
+
+    @classmethod
+    def from_shared_arrays(cls, arrays, model_uuid=None):
+        """ see L{pycam.Geometry.Model.Model.from_shared_arrays} """
+        grid = arrays["grid"]
+        return cls((grid[0], grid[1]), grid[2], arrays["heights"], grid[3],
+                map_uuid=model_uuid)
+
+    def get_heights(self, model, cutter, positions, minz, maxz,
+            triangles=None):
+        """ calculate the drop heights for a line (or grid) of positions
+
+        Positions within safe cells are interpolated. All others are
+        calculated via L{get_max_height_triangles_batch}.
+        @value positions: xy coordinates
+        @type positions: list of tuples or array of shape (N, 2)
+        @value triangles: see L{get_max_height_triangles_batch}
+        @returns: the heights of the cutter for all positions - positions
+            exceeding maxz are marked as "nan"
+        @rtype: array of shape (N,)
+        """
+        coords = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 2)
+        count_y, count_x = self.heights.shape
+        grid_x = (coords[:, 0] - self.origin[0]) / self.resolution
+        grid_y = (coords[:, 1] - self.origin[1]) / self.resolution
+        cell_x = numpy.clip(numpy.floor(grid_x), 0, count_x - 2).astype(int)
+        cell_y = numpy.clip(numpy.floor(grid_y), 0, count_y - 2).astype(int)
+        inside = (grid_x >= 0) & (grid_x <= count_x - 1) \
+                & (grid_y >= 0) & (grid_y <= count_y - 1)
+        safe = inside & ~self.unsafe[cell_y, cell_x]
+        result = numpy.empty(len(coords))
+        # bilinear interpolation
+        cell_x, cell_y = cell_x[safe], cell_y[safe]
+        fraction_x = grid_x[safe] - cell_x
+        fraction_y = grid_y[safe] - cell_y
+        heights = self.heights
+        low = heights[cell_y, cell_x] * (1 - fraction_x) \
+                + heights[cell_y, cell_x + 1] * fraction_x
+        high = heights[cell_y + 1, cell_x] * (1 - fraction_x) \
+                + heights[cell_y + 1, cell_x + 1] * fraction_x
+        interpolated = low * (1 - fraction_y) + high * fraction_y
+        # use the same limits as "get_max_height_triangles_batch"
+        interpolated[interpolated < minz + epsilon] = minz
+        interpolated[interpolated > maxz + epsilon] = numpy.nan
+        result[safe] = interpolated
+        if not safe.all():
+            result[~safe] = get_max_height_triangles_batch(model, cutter,
+                    coords[~safe], minz, maxz, triangles=triangles)
+        return result
+
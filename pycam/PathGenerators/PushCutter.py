@@ -21,17 +21,22 @@ You should have received a copy of the GNU General Public License
 along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from pycam.PathGenerators import get_free_paths_ode, get_free_paths_triangles
+from pycam.PathGenerators import get_free_paths_ode, get_free_paths_triangles, \
+        get_free_paths_triangles_batch, is_layer_collision_supported
 import pycam.PathProcessors
 from pycam.Geometry.utils import ceil
 from pycam.Utils.threading import run_in_parallel
 from pycam.Utils import ProgressCounter
 import pycam.Utils.log
+import itertools
 import math
 
 
 log = pycam.Utils.log.get_logger()
 
+# number of adjacent lines sharing the collection of triangles
+LINES_PER_TASK = 8
+
 
 # We need to use a global function here - otherwise it does not work with
 # the multiprocessing Pool.
@@ -42,6 +47,32 @@ def _process_one_line((p1, p2, depth, models, cutter, physics)):
         points = get_free_paths_triangles(models, cutter, p1, p2)
     return points
 
+def _get_ode_depth(cutter, p1, p2):
+    """ calculate the required calculation depth (recursion) """
+    # settings for calculation of depth
+    accuracy = 20
+    max_depth = 20
+    min_depth = 4
+    distance = p2.sub(p1).norm
+    # TODO: accessing cutter.radius here is slightly ugly
+    depth = math.log(accuracy * distance / cutter.radius) / math.log(2)
+    return min(max(ceil(depth), min_depth), max_depth)
+
+def _process_line_group((lines, models, cutter, physics, tolerance)):
+    """ calculate the free paths of a group of adjacent lines
+
+    @value tolerance: see L{get_free_paths_triangles_batch}
+    @returns: the free paths for each line
+    @rtype: list(list(Point))
+    """
+    if (physics is None) \
+            and is_layer_collision_supported(models, cutter, lines):
+        return get_free_paths_triangles_batch(models, cutter, lines,
+                tolerance=tolerance)
+    else:
+        return [_process_one_line((p1, p2, _get_ode_depth(cutter, p1, p2),
+                models, cutter, physics)) for p1, p2 in lines]
+
 
 class PushCutter(object):
 
@@ -55,7 +86,14 @@ class PushCutter(object):
         # check if we use a PolygonExtractor
         self._use_polygon_extractor = hasattr(self.pa, "polygon_extractor")
 
-    def GenerateToolPath(self, cutter, models, motion_grid, minz=None, maxz=None, draw_callback=None):
+    def GenerateToolPath(self, cutter, models, motion_grid, minz=None,
+            maxz=None, draw_callback=None, tolerance=None):
+        """ calculate the free paths along the lines of the motion grid
+
+        @value tolerance: the maximum distance between the toolpath and the
+            surface of the model (see L{get_free_paths_triangles_batch})
+        @type tolerance: float
+        """
         # Transfer the grid (a generator) into a list of lists and count the
         # items.
         grid = []
@@ -64,7 +102,7 @@ class PushCutter(object):
             lines = []
             for line in layer:
                 # convert the generator to a list
-                lines.append(list(line))
+                lines.append(tuple(line))
             num_of_grid_positions += len(lines)
             grid.append(lines)
 
@@ -72,8 +110,34 @@ class PushCutter(object):
 
         progress_counter = ProgressCounter(num_of_grid_positions, draw_callback)
 
-        current_layer = 0
+        # the ContourCutter pathprocessor does not work with combined models
+        if self._use_polygon_extractor:
+            slice_models = models[:1]
+        else:
+            slice_models = models
+
+        # The tasks of all layers are submitted at once. Thus the workers
+        # continue with the following layers, while the results of a layer
+        # are processed.
+        args = []
+        layer_task_counts = []
         for layer_grid in grid:
+            if (self.physics is None) and is_layer_collision_supported(
+                    slice_models, cutter, layer_grid):
+                # Adjacent lines touch almost the same triangles. Thus they
+                # are processed in groups.
+                group_size = LINES_PER_TASK
+            else:
+                group_size = 1
+            layer_args = [(layer_grid[index:index + group_size], slice_models,
+                    cutter, self.physics, tolerance)
+                    for index in range(0, len(layer_grid), group_size)]
+            args.extend(layer_args)
+            layer_task_counts.append(len(layer_args))
+        results = run_in_parallel(_process_line_group, args,
+                callback=progress_counter.update)
+
+        for current_layer, task_count in enumerate(layer_task_counts):
             # update the progress bar and check, if we should cancel the process
             if draw_callback and draw_callback(text="PushCutter: processing" \
                         + " layer %d/%d" % (current_layer + 1, num_of_layers)):
@@ -81,12 +145,13 @@ class PushCutter(object):
                 break
 
             self.pa.new_direction(0)
-            self.GenerateToolPathSlice(cutter, models, layer_grid, draw_callback,
+            quit_requested = self._process_slice_results(
+                    itertools.islice(results, task_count), draw_callback,
                     progress_counter)
             self.pa.end_direction()
             self.pa.finish()
-
-            current_layer += 1
+            if quit_requested:
+                break
 
         if self._use_polygon_extractor and (len(models) > 1):
             other_models = models[1:]
@@ -99,9 +164,13 @@ class PushCutter(object):
                 pairs = []
                 for index in range(len(path.points) - 1):
                     pairs.append((path.points[index], path.points[index + 1]))
-                for p1, p2 in pairs:
-                    free_points = get_free_paths_triangles(other_models,
-                            cutter, p1, p2)
+                if is_layer_collision_supported(other_models, cutter, pairs):
+                    all_free_points = get_free_paths_triangles_batch(
+                            other_models, cutter, pairs, tolerance=tolerance)
+                else:
+                    all_free_points = [get_free_paths_triangles(other_models,
+                            cutter, p1, p2) for p1, p2 in pairs]
+                for free_points in all_free_points:
                     for point in free_points:
                         final_pa.append(point)
                 final_pa.end_scanline()
@@ -110,40 +179,28 @@ class PushCutter(object):
         else:
             return self.pa.paths
 
-    def GenerateToolPathSlice(self, cutter, models, layer_grid, draw_callback=None,
+    def _process_slice_results(self, results, draw_callback=None,
             progress_counter=None):
-        # settings for calculation of depth
-        accuracy = 20
-        max_depth = 20
-        min_depth = 4
-
-        # the ContourCutter pathprocessor does not work with combined models
-        if self._use_polygon_extractor:
-            models = models[:1]
-        else:
-            models = models
-
-        args = []
-        for line in layer_grid:
-            p1, p2 = line
-            # calculate the required calculation depth (recursion)
-            distance = p2.sub(p1).norm
-            # TODO: accessing cutter.radius here is slightly ugly
-            depth = math.log(accuracy * distance / cutter.radius) / math.log(2)
-            depth = min(max(ceil(depth), 4), max_depth)
-            args.append((p1, p2, depth, models, cutter, self.physics))
-
-        for points in run_in_parallel(_process_one_line, args,
-                callback=progress_counter.update):
-            if points:
-                self.pa.new_scanline()
-                for point in points:
-                    self.pa.append(point)
-                if draw_callback:
-                    draw_callback(tool_position=points[-1], toolpath=self.pa.paths)
-                self.pa.end_scanline()
-            # update the progress counter
-            if progress_counter and progress_counter.increment():
-                # quit requested
-                break
+        """ add the free paths of one layer to the path processor
+
+        @value results: the results of "_process_line_group" for all groups
+            of lines within the layer
+        @returns: True, if the user requested to quit
+        @rtype: bool
+        """
+        for group in results:
+            for points in group:
+                if points:
+                    self.pa.new_scanline()
+                    for point in points:
+                        self.pa.append(point)
+                    if draw_callback:
+                        draw_callback(tool_position=points[-1],
+                                toolpath=self.pa.paths)
+                    self.pa.end_scanline()
+                # update the progress counter
+                if progress_counter and progress_counter.increment():
+                    # quit requested
+                    return True
+        return False
 
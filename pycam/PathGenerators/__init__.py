@@ -25,7 +25,26 @@ __all__ = ["DropCutter", "PushCutter", "EngraveCutter", "ContourFollow"]
 
 from pycam.Geometry.utils import INFINITE, epsilon, sqrt
 from pycam.Geometry.Point import Point
+from pycam.Geometry.PointUtils import ptuple, psub, pcross, pnorm
 import pycam.Utils.threading
+import heapq
+import math
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+
+# maximum number of position/triangle pairs to be processed at once
+DROP_BATCH_SIZE = 100000
+# maximum distance between a toolpath and the surface (in model units)
+DEFAULT_SURFACE_TOLERANCE = 0.001
+# maximum number of additional points (relative to the regular positions)
+MAX_REFINEMENT_FACTOR = 8
+# maximum number of segments refined together (with the largest errors)
+REFINEMENT_BATCH_SIZE = 64
 
 
 class Hit(object):
@@ -42,6 +61,15 @@ class Hit(object):
 
 
 def get_free_paths_triangles(models, cutter, p1, p2, return_triangles=False):
+    if (not return_triangles) and (abs(p1.z - p2.z) <= epsilon):
+        # Horizontal lines are checked via the drop heights of the cutter.
+        # Thus all code paths share the same shape of the cutter (including
+        # the material allowance).
+        if is_layer_collision_supported(models, cutter, [(p1, p2)]):
+            return get_free_paths_triangles_batch(models, cutter,
+                    [(p1, p2)])[0]
+        else:
+            return get_free_paths_drop(models, cutter, p1, p2)
     if (len(models) == 0) or ((len(models) == 1) and (models[0] is None)):
         return (p1, p2)
     elif len(models) == 1:
@@ -250,56 +278,382 @@ def get_max_height_triangles(model, cutter, x, y, minz, maxz):
     else:
         return Point(x, y, height_max)
 
-def _check_deviance_of_adjacent_points(p1, p2, p3, min_distance):
-    straight = p3.sub(p1)
-    added = p2.sub(p1).norm + p3.sub(p2).norm
-    # compare only the x/y distance of p1 and p3 with min_distance
-    if straight.x ** 2 + straight.y ** 2 < min_distance ** 2:
-        # the points are too close together
-        return True
+def is_batch_drop_supported(model, cutter):
+    """ check if "get_max_height_triangles_batch" can handle the model """
+    return numpy_enabled and hasattr(model, "get_triangle_arrays") \
+            and hasattr(cutter, "drop_many")
+
+def get_line_triangles(model, cutter, positions):
+    """ collect the triangles that may be touched along a line of positions
+
+    The result can be passed to "get_max_height_triangles_batch" for all
+    positions within the corridor.
+    """
+    coords = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return numpy.zeros((0, 3, 3))
+    radius = cutter.distance_radius + epsilon
+    low = coords.min(axis=0) - radius
+    high = coords.max(axis=0) + radius
+    return model.get_triangle_arrays(low[0], low[1], high[0], high[1])
+
+def get_max_height_triangles_batch(model, cutter, positions, minz, maxz,
+        triangles=None):
+    """ calculate the drop heights for a whole line (or grid) of positions
+
+    The candidate triangles are collected only once for the corridor around
+    all positions. Afterwards the relevant pairs of positions and triangles
+    are evaluated as array operations (see "BaseCutter.drop_many").
+    @value positions: xy coordinates
+    @type positions: list of tuples or array of shape (N, 2)
+    @value triangles: the result of "get_line_triangles" (optional)
+    @returns: the heights of the cutter for all positions - positions
+        exceeding maxz are marked as "nan"
+    @rtype: array of shape (N,)
+    """
+    coords = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 2)
+    heights = numpy.empty(len(coords))
+    heights.fill(-INFINITE)
+    if model is None:
+        heights.fill(minz)
+        return heights
+    if triangles is None:
+        triangles = get_line_triangles(model, cutter, coords)
+    if len(coords) and len(triangles):
+        radius = cutter.distance_radius + epsilon
+        # Sort the positions along the axis with the larger extent. Each
+        # triangle covers a contiguous range of these positions.
+        axis = int(numpy.ptp(coords[:, 1]) > numpy.ptp(coords[:, 0]))
+        order = numpy.argsort(coords[:, axis], kind="mergesort")
+        sorted_values = coords[order, axis]
+        lows = triangles[:, :, axis].min(axis=1) - radius
+        highs = triangles[:, :, axis].max(axis=1) + radius
+        starts = numpy.searchsorted(sorted_values, lows, side="left")
+        counts = numpy.searchsorted(sorted_values, highs, side="right") \
+                - starts
+        other_lows = triangles[:, :, 1 - axis].min(axis=1) - radius
+        other_highs = triangles[:, :, 1 - axis].max(axis=1) + radius
+        totals = numpy.cumsum(counts)
+        first = 0
+        while first < len(triangles):
+            # limit the number of pairs evaluated at once
+            last = numpy.searchsorted(totals,
+                    totals[first] - counts[first] + DROP_BATCH_SIZE,
+                    side="right")
+            last = max(first + 1, last)
+            chunk_counts = counts[first:last]
+            tri_indices = numpy.repeat(numpy.arange(first, last),
+                    chunk_counts)
+            offsets = numpy.arange(len(tri_indices)) \
+                    - numpy.repeat(numpy.cumsum(chunk_counts) - chunk_counts,
+                        chunk_counts)
+            pos_indices = order[starts[tri_indices] + offsets]
+            other = coords[pos_indices, 1 - axis]
+            near = (other >= other_lows[tri_indices]) \
+                    & (other <= other_highs[tri_indices])
+            tri_indices = tri_indices[near]
+            pos_indices = pos_indices[near]
+            if len(pos_indices):
+                cut = cutter.drop_many(coords[pos_indices, 0],
+                        coords[pos_indices, 1], triangles[tri_indices])
+                numpy.maximum.at(heights, pos_indices, cut)
+            first = last
+    # don't do a complete boundary check for the height
+    # this avoids zero-cuts for models that exceed the bounding box height
+    heights[heights < minz + epsilon] = minz
+    heights[heights > maxz + epsilon] = numpy.nan
+    return heights
+
+def get_free_paths_triangles_batch(models, cutter, lines, tolerance=None):
+    """ calculate the collision free parts of multiple horizontal lines
+
+    This is the layer based equivalent of "get_free_paths_triangles". The
+    triangles of all models near the lines are collected only once. The
+    cutter collides with the models wherever their drop height exceeds the
+    height of the line. Thus the drop heights are calculated (as array
+    operations) for samples along all lines. The transitions between free
+    and blocked samples are located via bisection (for all lines at once).
+    The distance between two samples is chosen in a way that a collision
+    hidden between two samples can not remove more material than the given
+    tolerance (DEFAULT_SURFACE_TOLERANCE by default). Free gaps shorter
+    than this distance may be missed - the result stays collision free.
+    @value lines: pairs of start and end points - each line must be
+        horizontal (see "is_layer_collision_supported")
+    @type lines: list(tuple(Point, Point))
+    @returns: the collision free pairs of points for each line
+    @rtype: list(list(Point))
+    """
+    models = [model for model in models if not model is None]
+    if not models or not lines:
+        return [[p1, p2] for p1, p2 in lines]
+    step = _get_free_path_step(cutter, tolerance)
+    starts = numpy.array([(p1.x, p1.y) for p1, p2 in lines])
+    ends = numpy.array([(p2.x, p2.y) for p1, p2 in lines])
+    heights = numpy.array([p1.z for p1, p2 in lines])
+    # collect the triangles near all lines
+    margin = cutter.distance_radius + epsilon
+    low = numpy.minimum(starts, ends).min(axis=0) - margin
+    high = numpy.maximum(starts, ends).max(axis=0) + margin
+    triangles = numpy.concatenate([model.get_triangle_arrays(low[0], low[1],
+            high[0], high[1]) for model in models])
+    # triangles below all lines (and the material allowance) are irrelevant
+    triangles = triangles[triangles[:, :, 2].max(axis=1) \
+            >= heights.min() - cutter.get_required_distance() - epsilon]
+    def is_blocked(positions, line_indices):
+        drop_heights = get_max_height_triangles_batch(models[0], cutter,
+                positions, -INFINITE, INFINITE, triangles=triangles)
+        return drop_heights > heights[line_indices] + epsilon
+    # distribute the samples evenly along each line
+    lengths = numpy.sqrt(((ends - starts) ** 2).sum(axis=1))
+    # at least two samples per line (even for lines without a length)
+    counts = numpy.maximum(1, numpy.ceil(lengths / step).astype(int)) + 1
+    line_indices = numpy.repeat(numpy.arange(len(lines)), counts)
+    first_samples = numpy.cumsum(counts) - counts
+    fractions = (numpy.arange(len(line_indices)) \
+            - first_samples[line_indices]) \
+            / (counts[line_indices] - 1.0)
+    positions = starts[line_indices] + fractions[:, numpy.newaxis] \
+            * (ends - starts)[line_indices]
+    blocked = is_blocked(positions, line_indices)
+    # locate the transitions between free and blocked samples
+    transitions = numpy.nonzero((blocked[:-1] != blocked[1:]) \
+            & (line_indices[:-1] == line_indices[1:]))[0]
+    transition_lines = line_indices[transitions]
+    low_positions = positions[transitions]
+    high_positions = positions[transitions + 1]
+    low_blocked = blocked[transitions]
+    if len(transitions):
+        for index in range(_get_bisection_steps(step)):
+            middles = (low_positions + high_positions) / 2
+            same = is_blocked(middles, transition_lines) == low_blocked
+            low_positions[same] = middles[same]
+            high_positions[~same] = middles[~same]
+    # the free end of each transition
+    free_positions = numpy.where(low_blocked[:, numpy.newaxis],
+            high_positions, low_positions)
+    transition_counts = numpy.bincount(transition_lines,
+            minlength=len(lines))
+    last_samples = first_samples + counts - 1
+    result = []
+    current = 0
+    for index, (p1, p2) in enumerate(lines):
+        points = []
+        if not blocked[first_samples[index]]:
+            points.append(p1)
+        for x, y in free_positions[current:current \
+                + transition_counts[index]].tolist():
+            points.append(Point(x, y, p1.z))
+        current += transition_counts[index]
+        if not blocked[last_samples[index]]:
+            points.append(p2)
+        result.append(points)
+    return result
+
+def get_free_paths_drop(models, cutter, p1, p2, tolerance=None):
+    """ calculate the collision free parts of a single horizontal line
+
+    This is the equivalent of "get_free_paths_triangles_batch" for a single
+    line. It does not require numpy.
+    @returns: the collision free pairs of points
+    @rtype: list(Point)
+    """
+    models = [model for model in models if not model is None]
+    if not models:
+        return [p1, p2]
+    step = _get_free_path_step(cutter, tolerance)
+    limit = p1.z + epsilon
+    # the cutter can't be lifted more than "required_distance" above a triangle
+    minz = limit - cutter.get_required_distance()
+    def is_blocked((x, y)):
+        location = Point(x, y, INFINITE)
+        for model in models:
+            for triangle in model.triangles(cutter.get_minx(location),
+                    cutter.get_miny(location), minz, cutter.get_maxx(location),
+                    cutter.get_maxy(location), INFINITE):
+                if triangle.maxz <= minz:
+                    continue
+                cut = cutter.drop(triangle, start=location)
+                if cut and (cut.z > limit):
+                    return True
+        return False
+    length = sqrt((p2.x - p1.x) ** 2 + (p2.y - p1.y) ** 2)
+    # at least two samples (even for a line without a length)
+    count = max(1, int(math.ceil(length / step))) + 1
+    positions = [(p1.x + (p2.x - p1.x) * index / (count - 1.0),
+            p1.y + (p2.y - p1.y) * index / (count - 1.0))
+            for index in range(count)]
+    blocked = [is_blocked(position) for position in positions]
+    points = []
+    if not blocked[0]:
+        points.append(p1)
+    for index in range(count - 1):
+        if blocked[index] == blocked[index + 1]:
+            continue
+        # locate the transition between the free and the blocked sample
+        low, high = positions[index], positions[index + 1]
+        for iteration in range(_get_bisection_steps(step)):
+            middle = ((low[0] + high[0]) / 2, (low[1] + high[1]) / 2)
+            if is_blocked(middle) == blocked[index]:
+                low = middle
+            else:
+                high = middle
+        if blocked[index]:
+            x, y = high
+        else:
+            x, y = low
+        points.append(Point(x, y, p1.z))
+    if not blocked[-1]:
+        points.append(p2)
+    return points
+
+def _get_free_path_step(cutter, tolerance=None):
+    """ return the distance of the samples along a line
+
+    A collision hidden between two samples can not remove more material than
+    the tolerance (DEFAULT_SURFACE_TOLERANCE by default).
+    """
+    if tolerance is None:
+        tolerance = DEFAULT_SURFACE_TOLERANCE
+    # the smallest radius of curvature of the cutter limits the step width
+    radius = getattr(cutter, "distance_minorradius", cutter.distance_radius)
+    return min(sqrt(8 * radius * tolerance), cutter.distance_radius / 2)
+
+def _get_bisection_steps(step):
+    """ return the number of bisections narrowing down a step to epsilon """
+    return int(math.ceil(math.log(max(step, epsilon) / (0.1 * epsilon)) \
+            / math.log(2)))
+
+def is_layer_collision_supported(models, cutter, lines):
+    """ check if "get_free_paths_triangles_batch" can handle the lines """
+    for model in models:
+        if (not model is None) and not is_batch_drop_supported(model, cutter):
+            return False
+    for p1, p2 in lines:
+        if abs(p1.z - p2.z) > epsilon:
+            return False
+    return True
+
+def _get_chordal_error(p1, p2, middle):
+    """ return the distance between a point and the line through two points """
+    p1, p2, middle = ptuple(p1), ptuple(p2), ptuple(middle)
+    chord = psub(p2, p1)
+    length = pnorm(chord)
+    if length == 0:
+        return pnorm(psub(middle, p1))
     else:
-        # allow 0.1% deviance - this is an angle of around 2 degrees
-        return (added / straight.norm) < 1.001
+        return pnorm(pcross(psub(middle, p1), chord)) / length
+
+def _get_xy_distance(p1, p2):
+    return sqrt((p2.x - p1.x) ** 2 + (p2.y - p1.y) ** 2)
+
+def _estimate_segment_error(points, index):
+    """ guess the chordal error between two adjacent points
+
+    The deviation of both points from the chord of their neighbours is used
+    as an estimate.
+    """
+    error = 0
+    for middle in (index, index + 1):
+        if (middle > 0) and (middle < len(points) - 1):
+            p1, p2, p3 = points[middle - 1:middle + 2]
+            if (not p1 is None) and (not p3 is None):
+                error = max(error, _get_chordal_error(p1, p3, p2))
+    return error
+
+def get_max_height_dynamic(model, cutter, positions, minz, maxz, physics=None,
+        heightmap=None, tolerance=None):
+    """ calculate the drop heights along a line of positions
 
-def get_max_height_dynamic(model, cutter, positions, minz, maxz, physics=None):
-    max_depth = 8
+    Additional points are inserted where the toolpath would deviate from the
+    surface by more than the given tolerance. The segments between the
+    points are kept in a queue sorted by their chordal error. The middle
+    points of the segments with the largest errors are calculated together
+    in each step (see REFINEMENT_BATCH_SIZE). The number of additional
+    points is limited (see MAX_REFINEMENT_FACTOR) - the remaining segments
+    with smaller errors are not refined.
+    @value heightmap: the cached drop heights of the model and the cutter
+        (see L{pycam.PathGenerators.HeightMap.get_drop_heightmap})
+    @type heightmap: pycam.PathGenerators.HeightMap.DropHeightMap
+    @value tolerance: the maximum distance between the toolpath and the
+        surface (DEFAULT_SURFACE_TOLERANCE by default)
+    @type tolerance: float
+    @returns: the cutter locations (None for positions exceeding maxz)
+    @rtype: list(pycam.Geometry.Point.Point)
+    """
+    if tolerance is None:
+        tolerance = DEFAULT_SURFACE_TOLERANCE
     # the points don't need to get closer than 1/1000 of the cutter radius
     min_distance = cutter.distance_radius / 1000
-    result = []
     if physics:
-        get_max_height = lambda x, y: get_max_height_ode(physics, x, y, minz,
-                maxz)
-    else:
-        get_max_height = lambda x, y: get_max_height_triangles(model, cutter,
-                x, y, minz, maxz)
-    # add one point between all existing points
-    for index in range(len(positions)):
-        p = positions[index]
-        result.append(get_max_height(p[0], p[1]))
-    # Check if three consecutive points are "flat".
-    # Add additional points if necessary.
-    index = 0
-    depth_count = 0
-    while index < len(result) - 2:
-        p1 = result[index]
-        p2 = result[index + 1]
-        p3 = result[index + 2]
-        if (not p1 is None) and (not p2 is None) and (not p3 is None) and \
-                not _check_deviance_of_adjacent_points(p1, p2, p3,
-                    min_distance) and \
-                (depth_count < max_depth):
-            # distribute the new point two before the middle and one after
-            if depth_count % 3 != 2:
-                # insert between the 1st and 2nd point
-                middle = ((p1.x + p2.x) / 2, (p1.y + p2.y) / 2)
-                result.insert(index + 1, get_max_height(middle[0], middle[1]))
-            else:
-                # insert between the 2nd and 3rd point
-                middle = ((p2.x + p3.x) / 2, (p2.y + p3.y) / 2)
-                result.insert(index + 2, get_max_height(middle[0], middle[1]))
-            depth_count += 1
+        get_max_heights = lambda coords: [get_max_height_ode(physics, x, y,
+                minz, maxz) for x, y in coords]
+        result = get_max_heights(positions)
+    elif is_batch_drop_supported(model, cutter) and positions:
+        # the refinement below stays within the corridor of the line
+        triangles = get_line_triangles(model, cutter, positions)
+        def get_points(coords, heights):
+            return [None if numpy.isnan(height) else Point(x, y, height)
+                    for (x, y), height in zip(coords, heights.tolist())]
+        get_max_heights = lambda coords: get_points(coords,
+                get_max_height_triangles_batch(model, cutter, coords, minz,
+                    maxz, triangles=triangles))
+        if heightmap is None:
+            result = get_max_heights(positions)
         else:
-            index += 1
-            depth_count = 0
-    return result
-
+            # The additional points below are usually located at walls and
+            # edges. Thus only the regular positions are interpolated.
+            result = get_points(positions, heightmap.get_heights(model,
+                    cutter, positions, minz, maxz, triangles=triangles))
+    else:
+        get_max_heights = lambda coords: [get_max_height_triangles(model,
+                cutter, x, y, minz, maxz) for x, y in coords]
+        result = get_max_heights(positions)
+    # Every queued segment consists of the index of the regular position
+    # before it and the relative start and end (between 0 and 1) within
+    # the regular segment - along with the points at both ends.
+    queue = []
+    for index in range(len(result) - 1):
+        p1, p2 = result[index], result[index + 1]
+        if (p1 is None) or (p2 is None) \
+                or (_get_xy_distance(p1, p2) < 2 * min_distance):
+            continue
+        error = _estimate_segment_error(result, index)
+        if error > tolerance:
+            queue.append((-error, index, 0.0, 1.0, p1, p2))
+    heapq.heapify(queue)
+    remaining = MAX_REFINEMENT_FACTOR * len(result)
+    inserted = []
+    while queue and (remaining > 0):
+        # the segments with the largest error are refined first
+        segments = [heapq.heappop(queue) for count in range(
+                min(len(queue), remaining, REFINEMENT_BATCH_SIZE))]
+        remaining -= len(segments)
+        middles = get_max_heights([((p1.x + p2.x) / 2, (p1.y + p2.y) / 2)
+                for error, index, start, end, p1, p2 in segments])
+        for segment, middle in zip(segments, middles):
+            error, index, start, end, p1, p2 = segment
+            position = (start + end) / 2
+            if middle is None:
+                # exceeded maxz - the toolpath is split here
+                inserted.append((index, position, middle))
+                continue
+            error = _get_chordal_error(p1, p2, middle)
+            if error <= tolerance:
+                # the segment is straight enough
+                continue
+            inserted.append((index, position, middle))
+            if _get_xy_distance(p1, middle) >= 2 * min_distance:
+                heapq.heappush(queue, (-error, index, start, position, p1,
+                        middle))
+                heapq.heappush(queue, (-error, index, position, end, middle,
+                        p2))
+    # merge the regular positions and the additional points
+    inserted.sort()
+    points = []
+    current = 0
+    for index, point in enumerate(result):
+        points.append(point)
+        while (current < len(inserted)) and (inserted[current][0] == index):
+            points.append(inserted[current][2])
+            current += 1
+    return points
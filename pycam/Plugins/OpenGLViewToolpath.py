@@ -20,6 +20,8 @@ You should have received a copy of the GNU General Public License
 along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import itertools
+
 import pycam.Plugins
 import pycam.Gui.OpenGLTools
 
@@ -74,11 +76,19 @@ class OpenGLViewToolpath(pycam.Plugins.PluginBase):
 
     def draw_toolpaths(self):
         if self._is_visible():
+            safety_height = self.core.get("gcode_safety_height")
             for toolpath in self.core.get("toolpaths").get_visible():
-                moves = toolpath.get_moves(self.core.get("gcode_safety_height"))
-                self._draw_toolpath_moves(moves)
+                # the move table is cached by the toolpath
+                positions, rapids = toolpath.get_move_table(safety_height)
+                self._draw_toolpath_moves(itertools.izip(positions, rapids))
     
     def _draw_toolpath_moves(self, moves):
+        """ draw a sequence of moves
+
+        @value moves: the positions (x, y, z) of the tool and their "rapid"
+            flags (e.g. based on "Toolpath.get_move_table")
+        @type moves: iterable of tuple((float, float, float), bool)
+        """
         GL = self._GL
         GL.glDisable(GL.GL_LIGHTING)
         show_directions = self.core.get("show_directions")
@@ -88,8 +98,10 @@ class OpenGLViewToolpath(pycam.Plugins.PluginBase):
         GL.glLoadIdentity()
         last_position = None
         last_rapid = None
+        directions = []
         GL.glBegin(GL.GL_LINE_STRIP)
         for position, rapid in moves:
+            x, y, z = position
             if last_rapid != rapid:
                 GL.glEnd()
                 if rapid:
@@ -102,14 +114,13 @@ class OpenGLViewToolpath(pycam.Plugins.PluginBase):
                 GL.glFinish()
                 GL.glBegin(GL.GL_LINE_STRIP)
                 if not last_position is None:
-                    GL.glVertex3f(last_position.x, last_position.y, last_position.z)
+                    GL.glVertex3f(*last_position)
                 last_rapid = rapid
-            GL.glVertex3f(position.x, position.y, position.z)
-            last_position = position
+            GL.glVertex3f(x, y, z)
+            if show_directions and not last_position is None:
+                directions.append((last_position, (x, y, z)))
+            last_position = (x, y, z)
         GL.glEnd()
-        if show_directions:
-            for index in range(len(moves) - 1):
-                p1 = moves[index][0]
-                p2 = moves[index + 1][0]
-                pycam.Gui.OpenGLTools.draw_direction_cone(p1, p2)
+        for p1, p2 in directions:
+            pycam.Gui.OpenGLTools.draw_direction_cone(p1, p2)
 
@@ -219,7 +219,7 @@ class ToolpathExport(pycam.Plugins.PluginBase):
                 spindle_speed = params.get("spindle_speed", 1000)
                 generator.set_speed(feedrate, spindle_speed)
                 # TODO: implement toolpath.get_meta_data()
-                generator.add_moves(toolpath.get_moves(safety_height),
+                generator.add_moves(toolpath.iter_moves(safety_height),
                         tool_id=tool_id, comment="")
             generator.finish()
             destination.close()
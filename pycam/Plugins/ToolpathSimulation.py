@@ -21,15 +21,28 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import math
+import bisect
 import datetime
+import itertools
 import gobject
 
 import pycam.Plugins
 import pycam.Gui.common
+import pycam.Cutters
+import pycam.Simulation.HeightField
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
 # this requires ODE - we import it later, if necessary
 #import pycam.Simulation.ODEBlocks
 
 
+# number of cells of the simulated material along the longer side
+SIMULATION_GRID_SIZE = 400
+
+
 class ToolpathSimulation(pycam.Plugins.PluginBase):
 
     UI_FILE = "toolpath_simulation.ui"
@@ -39,6 +52,8 @@ class ToolpathSimulation(pycam.Plugins.PluginBase):
     def setup(self):
         self._running = None
         if self.gui:
+            import OpenGL.GL
+            self._GL = OpenGL.GL
             self._gtk_handlers = []
             self._frame = self.gui.get_object("SimulationBox")
             self.core.register_ui("toolpath_handling", "Simulation",
@@ -51,7 +66,9 @@ class ToolpathSimulation(pycam.Plugins.PluginBase):
             self._timer_widget = self.gui.get_object(
                     "SimulationProgressTimeDisplay")
             self.core.set("show_simulation", False)
+            self._positions, self._rapids, self._distances = None, None, None
             self._toolpath_moves = None
+            self._simulation = None
             self._start_button = self.gui.get_object("SimulationStartButton")
             self._pause_button = self.gui.get_object("SimulationPauseButton")
             self._stop_button = self.gui.get_object("SimulationStopButton")
@@ -102,7 +119,11 @@ class ToolpathSimulation(pycam.Plugins.PluginBase):
                         safety_height=self._safety_height)
             self._feedrate = self._toolpath.get_params().get("tool_feedrate",
                     300)
+            self._positions, self._rapids = self._toolpath.get_move_table(
+                    self._safety_height)
+            self._distances = self._get_move_distances(self._positions)
             self._toolpath_moves = None
+            self._simulation = None
             self.core.set("show_simulation", True)
             self._running = True
             interval_ms = int(1000 / self.core.get("drill_progress_max_fps"))
@@ -122,7 +143,9 @@ class ToolpathSimulation(pycam.Plugins.PluginBase):
     def _stop_simulation(self, widget=None):
         self._running = None
         self.core.set("show_simulation", False)
+        self._positions, self._rapids, self._distances = None, None, None
         self._toolpath_moves = None
+        self._simulation = None
         self._timer_widget.set_label("")
         self._progress.set_value(0)
         self._start_button.set_sensitive(True)
@@ -156,14 +179,118 @@ class ToolpathSimulation(pycam.Plugins.PluginBase):
             complete = datetime.timedelta(
                     seconds=int(self._progress.get_upper()))
             self._timer_widget.set_label("%s / %s" % (current, complete))
-            self._toolpath_moves = self._toolpath.get_moves(
-                    safety_height=self._safety_height,
-                    max_movement=self._distance * fraction)
+            max_movement = self._distance * fraction
+            previous_moves = self._toolpath_moves
+            if (previous_moves is None) or \
+                    (max_movement < self._max_movement):
+                # (re)start the simulation of the material
+                previous_moves = None
+                self._simulation = self._get_simulation_backend(
+                        self._toolpath)
+            self._max_movement = max_movement
+            self._toolpath_moves = self._get_moves_until(max_movement)
+            if self._simulation:
+                self._update_material(previous_moves)
             self.core.emit_event("visual-item-updated")
 
+    def _get_cutter(self, toolpath):
+        params = toolpath.get_params()
+        for tool in self.core.get("tools"):
+            if tool["id"] == params.get("tool_id"):
+                shapes = self.core.get("get_parameter_sets")("tool")
+                if tool["shape"] in shapes:
+                    return shapes[tool["shape"]]["func"](tool=tool)
+        if "tool_radius" in params:
+            # the tool was removed in the meantime
+            return pycam.Cutters.CylindricalCutter(params["tool_radius"])
+        return None
+
+    def _get_simulation_backend(self, toolpath):
+        if not pycam.Simulation.HeightField.numpy_enabled:
+            self.log.info("Material removal simulation is disabled: " \
+                    + "the python module 'numpy' is missing")
+            return None
+        cutter = self._get_cutter(toolpath)
+        if (cutter is None) or (toolpath.minx is None):
+            return None
+        margin = cutter.radius
+        minx, maxx = toolpath.minx - margin, toolpath.maxx + margin
+        miny, maxy = toolpath.miny - margin, toolpath.maxy + margin
+        minz, maxz = toolpath.minz, toolpath.maxz
+        if maxz - minz <= 0:
+            # flat toolpath: make the removed material visible
+            minz -= margin
+        cell_width = max(maxx - minx, maxy - miny) / SIMULATION_GRID_SIZE
+        return pycam.Simulation.HeightField.HeightFieldSimulation(cutter,
+                (minx, maxx, miny, maxy, minz, maxz),
+                x_steps=int(math.ceil((maxx - minx) / cell_width)),
+                y_steps=int(math.ceil((maxy - miny) / cell_width)))
+
+    def _get_move_distances(self, positions):
+        """ return the movement distance up to each position of the table """
+        if numpy_enabled and len(positions):
+            lengths = numpy.sqrt((numpy.diff(positions, axis=0) ** 2).sum(
+                    axis=1))
+            return numpy.concatenate(([0.0], numpy.cumsum(lengths)))
+        distances = [0.0]
+        for index in range(1, len(positions)):
+            (x1, y1, z1), (x2, y2, z2) = positions[index - 1], positions[index]
+            distances.append(distances[-1] + math.sqrt((x2 - x1) ** 2 \
+                    + (y2 - y1) ** 2 + (z2 - z1) ** 2))
+        return distances
+
+    def _get_moves_until(self, max_movement):
+        """ return the number of moves of the cached table that are completed
+        after moving the given distance and the position reached on the way
+        to the next move (or None)
+        """
+        count = bisect.bisect_right(self._distances, max_movement)
+        if count >= len(self._positions):
+            return (len(self._positions), None)
+        start = self._positions[count - 1]
+        end = self._positions[count]
+        partial = (max_movement - self._distances[count - 1]) \
+                / (self._distances[count] - self._distances[count - 1])
+        position = tuple([p1 + (p2 - p1) * partial
+                for p1, p2 in zip(start, end)])
+        return (count, (position, self._rapids[count]))
+
+    def _update_material(self, previous_moves):
+        """ remove the material along the moves added since the last update
+
+        The simulation continues from the position reached by the previous
+        update. Thus only the moves completed in the meantime and the new
+        partial move are processed.
+        """
+        if previous_moves:
+            first = previous_moves[0]
+        else:
+            first = 0
+        count, partial_move = self._toolpath_moves
+        positions = [tuple(position)
+                for position in self._positions[first:count]]
+        if partial_move:
+            positions.append(partial_move[0])
+        if positions:
+            self._simulation.process_positions(positions)
+
     def show_simulation(self):
         if self._toolpath_moves and self.core.get("show_simulation"):
-            self.core.get("draw_toolpath_moves_func")(self._toolpath_moves)
+            count, partial_move = self._toolpath_moves
+            moves = itertools.izip(self._positions[:count],
+                    self._rapids[:count])
+            if partial_move:
+                moves = itertools.chain(moves, [partial_move])
+            self.core.get("draw_toolpath_moves_func")(moves)
+            if self._simulation:
+                GL = self._GL
+                col = self.core.get("color_model")
+                color = (col["red"], col["green"], col["blue"], col["alpha"])
+                GL.glColor4f(*color)
+                GL.glMaterial(GL.GL_FRONT_AND_BACK,
+                        GL.GL_AMBIENT_AND_DIFFUSE, color)
+                GL.glEnable(GL.GL_LIGHTING)
+                self._simulation.to_OpenGL()
 
     def update_toolpath_simulation_ode(self, widget=None, toolpath=None):
         import pycam.Simulation.ODEBlocks as ODEBlocks
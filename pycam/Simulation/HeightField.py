@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pycam.Cutters
+import pycam.Geometry.Model
+from pycam.Geometry.utils import epsilon
+from pycam.Utils import ProgressCounter
+import math
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+try:
+    import OpenGL.GL as GL
+    GL_enabled = True
+except ImportError:
+    GL_enabled = False
+
+
+def _get_cutter_profile(cutter):
+    """ return the height of the cutter's surface above its tip
+
+    The result is a function calculating the height for an array of squared
+    horizontal distances from the axis of the tool (within its radius).
+    """
+    if isinstance(cutter, pycam.Cutters.ToroidalCutter):
+        major = cutter.majorradius
+        minor = cutter.minorradius
+        minor_sq = minor ** 2
+        def get_heights(distances_sq):
+            rest = numpy.sqrt(distances_sq) - major
+            rest = numpy.maximum(rest, 0)
+            return minor - numpy.sqrt(numpy.maximum(minor_sq - rest ** 2, 0))
+    elif isinstance(cutter, pycam.Cutters.SphericalCutter):
+        radius = cutter.radius
+        radius_sq = radius ** 2
+        def get_heights(distances_sq):
+            return radius - numpy.sqrt(numpy.maximum(radius_sq - distances_sq,
+                    0))
+    else:
+        # flat bottom
+        def get_heights(distances_sq):
+            return numpy.zeros(distances_sq.shape)
+    return get_heights
+
+
+def get_model_heights(model, x_values, y_values):
+    """ calculate the height of the top surface of a model for a grid
+
+    @value model: the model (its triangles are used)
+    @type model: pycam.Geometry.Model.Model
+    @value x_values: the x coordinates of the grid
+    @type x_values: array
+    @value y_values: the y coordinates of the grid
+    @type y_values: array
+    @returns: the heights indexed by [x_index, y_index] - positions outside
+        of the model are marked by -inf
+    @rtype: array
+    """
+    if hasattr(model, "is_compact") and model.is_compact():
+        vertices, faces = model.triangles().vertices, model.triangles().faces
+        corners = vertices[faces]
+    else:
+        corners = numpy.array([[(p.x, p.y, p.z)
+                for p in (triangle.p1, triangle.p2, triangle.p3)]
+                for triangle in model.triangles()], dtype=numpy.float64)
+    result = numpy.empty((len(x_values), len(y_values)), dtype=numpy.float64)
+    result.fill(-numpy.inf)
+    for (x1, y1, z1), (x2, y2, z2), (x3, y3, z3) in corners.tolist():
+        # barycentric coordinates of the grid points
+        determinant = (y2 - y3) * (x1 - x3) + (x3 - x2) * (y1 - y3)
+        if determinant == 0:
+            # vertical triangle
+            continue
+        x_start = numpy.searchsorted(x_values, min(x1, x2, x3) - epsilon)
+        x_end = numpy.searchsorted(x_values, max(x1, x2, x3) + epsilon,
+                side="right")
+        y_start = numpy.searchsorted(y_values, min(y1, y2, y3) - epsilon)
+        y_end = numpy.searchsorted(y_values, max(y1, y2, y3) + epsilon,
+                side="right")
+        if (x_start >= x_end) or (y_start >= y_end):
+            continue
+        diff_x = (x_values[x_start:x_end] - x3)[:, numpy.newaxis]
+        diff_y = (y_values[y_start:y_end] - y3)[numpy.newaxis, :]
+        weight1 = ((y2 - y3) * diff_x + (x3 - x2) * diff_y) / determinant
+        weight2 = ((y3 - y1) * diff_x + (x1 - x3) * diff_y) / determinant
+        weight3 = 1 - weight1 - weight2
+        inside = (weight1 >= -epsilon) & (weight2 >= -epsilon) \
+                & (weight3 >= -epsilon)
+        if not inside.any():
+            continue
+        heights = numpy.where(inside,
+                weight1 * z1 + weight2 * z2 + weight3 * z3, -numpy.inf)
+        current = result[x_start:x_end, y_start:y_end]
+        numpy.maximum(current, heights, current)
+    return result
+
+
+class HeightFieldSimulation(object):
+    """ simulate the material removal of a toolpath with a height field
+
+    The remaining stock is described by the height of its top surface at the
+    center of every cell of a regular grid. The swept volume of every move is
+    subtracted from the grid with a few array operations.
+    Changed parts of the grid are tracked as "dirty" tiles - thus only these
+    need to be redrawn.
+    """
+
+    # the number of cells along both sides of a tile
+    TILE_SIZE = 32
+
+    def __init__(self, cutter, (minx, maxx, miny, maxy, minz, maxz),
+            x_steps=None, y_steps=None):
+        """ create the initial (untouched) block of stock material
+
+        @value cutter: the tool or its settings (see
+            "pycam.Cutters.get_tool_from_settings")
+        @type cutter: pycam.Cutters.BaseCutter.BaseCutter | dict
+        @value x_steps: number of cells along the x axis
+        @type x_steps: int
+        @value y_steps: number of cells along the y axis
+        @type y_steps: int
+        """
+        if isinstance(cutter, dict):
+            cutter = pycam.Cutters.get_tool_from_settings(cutter)
+        self.cutter = cutter
+        if x_steps is None:
+            x_steps = 100
+        if y_steps is None:
+            y_steps = 100
+        self.x_steps = max(1, int(x_steps))
+        self.y_steps = max(1, int(y_steps))
+        self.minx, self.maxx = minx, maxx
+        self.miny, self.maxy = miny, maxy
+        self.minz, self.maxz = minz, maxz
+        self.x_step_width = (maxx - minx) / float(self.x_steps)
+        self.y_step_width = (maxy - miny) / float(self.y_steps)
+        # the positions of the centers of all cells
+        self.x_values = minx + (numpy.arange(self.x_steps) + 0.5) \
+                * self.x_step_width
+        self.y_values = miny + (numpy.arange(self.y_steps) + 0.5) \
+                * self.y_step_width
+        # the height field is indexed by [x_index, y_index]
+        self.heights = numpy.empty((self.x_steps, self.y_steps),
+                dtype=numpy.float64)
+        self.heights.fill(maxz)
+        self._get_profile_heights = _get_cutter_profile(cutter)
+        self._last_position = None
+        self._dirty_tiles = set()
+        self._display_lists = {}
+        self._mark_dirty(0, self.x_steps, 0, self.y_steps)
+
+    def get_height_field(self):
+        """ return the current surface of the material
+
+        @returns: the positions of the cell centers along the x and y axis and
+            the heights of all cells (indexed by [x_index, y_index])
+        @rtype: tuple(array, array, array)
+        """
+        return self.x_values, self.y_values, self.heights
+
+    def get_dirty_tiles(self):
+        """ return the tiles that changed since the last call of "to_OpenGL"
+
+        @returns: the indices of the tiles (x_index, y_index) - every tile
+            covers TILE_SIZE x TILE_SIZE cells
+        @rtype: list(tuple(int, int))
+        """
+        return sorted(self._dirty_tiles)
+
+    def _mark_dirty(self, x_start, x_end, y_start, y_end):
+        # The drawn surface of a tile connects its cells with the first row
+        # and column of its neighbours. Thus the previous tile is affected,
+        # too.
+        size = self.TILE_SIZE
+        for tile_x in range(max(0, x_start - 1) // size,
+                (x_end - 1) // size + 1):
+            for tile_y in range(max(0, y_start - 1) // size,
+                    (y_end - 1) // size + 1):
+                self._dirty_tiles.add((tile_x, tile_y))
+
+    def _get_index_range(self, low, high, start, step_width, count):
+        if step_width <= 0:
+            return 0, count
+        first = int(math.ceil((low - start) / step_width - 0.5))
+        last = int(math.floor((high - start) / step_width - 0.5)) + 1
+        return max(0, first), min(count, last)
+
+    def process_moves(self, moves):
+        """ remove the material along a sequence of moves
+
+        @value moves: the positions of the tool (e.g. the result of
+            "Toolpath.get_moves") - the first position is connected to the
+            last one of the previous call
+        @type moves: list(tuple(pycam.Geometry.Point.Point, bool))
+        """
+        for position, rapid in moves:
+            position = (position.x, position.y, position.z)
+            if self._last_position is not None:
+                self._process_move(self._last_position, position)
+            self._last_position = position
+
+    def process_cutter_movement(self, location_start, location_end):
+        """ remove the material swept by a single straight move of the tool
+
+        @value location_start: the start position of the tool's tip
+        @type location_start: pycam.Geometry.Point.Point
+        @value location_end: the end position of the tool's tip
+        @type location_end: pycam.Geometry.Point.Point
+        """
+        self._process_move(
+                (location_start.x, location_start.y, location_start.z),
+                (location_end.x, location_end.y, location_end.z))
+
+    def process_positions(self, positions, callback=None):
+        """ remove the material along a sequence of positions of the tool
+
+        This is the fastest way for simulating a complete toolpath (e.g. via
+        the positions of "Toolpath.get_move_table").
+        @value positions: the consecutive positions of the tool's tip
+        @type positions: array of shape (N, 3)
+        @value callback: function for progress updates - returning True
+            cancels the simulation
+        @returns: False if the simulation was cancelled, otherwise True
+        """
+        positions = numpy.asarray(positions, dtype=numpy.float64).tolist()
+        progress = ProgressCounter(len(positions), callback)
+        for index, position in enumerate(positions):
+            if self._last_position is not None:
+                self._process_move(self._last_position, position)
+            self._last_position = position
+            if callback and (index % 100 == 0) and progress.increment(100):
+                return False
+        return True
+
+    def _process_move(self, (x1, y1, z1), (x2, y2, z2)):
+        # The cut height of every cell is based on the position of the tool
+        # closest to this cell. This is exact for horizontal moves. Thus
+        # sloped moves are split into pieces with a small height difference.
+        step_width = max(min(self.x_step_width, self.y_step_width), 0)
+        if (z1 != z2) and ((x1 != x2) or (y1 != y2)) and (step_width > 0):
+            pieces = int(math.ceil(abs(z2 - z1) / step_width))
+        else:
+            pieces = 1
+        for index in range(pieces):
+            start = float(index) / pieces
+            end = float(index + 1) / pieces
+            self._process_straight_move(
+                    (x1 + start * (x2 - x1), y1 + start * (y2 - y1),
+                        z1 + start * (z2 - z1)),
+                    (x1 + end * (x2 - x1), y1 + end * (y2 - y1),
+                        z1 + end * (z2 - z1)))
+
+    def _process_straight_move(self, (x1, y1, z1), (x2, y2, z2)):
+        radius = self.cutter.radius
+        if min(z1, z2) >= self.maxz:
+            # the tool does not touch the material
+            return
+        x_start, x_end = self._get_index_range(min(x1, x2) - radius,
+                max(x1, x2) + radius, self.minx, self.x_step_width,
+                self.x_steps)
+        y_start, y_end = self._get_index_range(min(y1, y2) - radius,
+                max(y1, y2) + radius, self.miny, self.y_step_width,
+                self.y_steps)
+        if (x_start >= x_end) or (y_start >= y_end):
+            return
+        dir_x = x2 - x1
+        dir_y = y2 - y1
+        length_sq = dir_x ** 2 + dir_y ** 2
+        diff_x = (self.x_values[x_start:x_end] - x1)[:, numpy.newaxis]
+        diff_y = (self.y_values[y_start:y_end] - y1)[numpy.newaxis, :]
+        if length_sq > 0:
+            # the position of the closest point along the move (0..1)
+            factors = numpy.clip((diff_x * dir_x + diff_y * dir_y) / length_sq,
+                    0, 1)
+            dist_x = diff_x - factors * dir_x
+            dist_y = diff_y - factors * dir_y
+            cut = z1 + factors * (z2 - z1)
+        else:
+            # vertical move: only the lower end is relevant
+            dist_x = diff_x + numpy.zeros(diff_y.shape)
+            dist_y = diff_y + numpy.zeros(diff_x.shape)
+            cut = min(z1, z2)
+        distances_sq = dist_x ** 2 + dist_y ** 2
+        cut = cut + self._get_profile_heights(distances_sq)
+        # the tool does not remove material outside of its radius
+        cut[distances_sq > radius ** 2] = numpy.inf
+        # the material can't be removed below its bottom
+        cut = numpy.maximum(cut, self.minz)
+        current = self.heights[x_start:x_end, y_start:y_end]
+        changed = cut < current
+        if not changed.any():
+            return
+        numpy.minimum(current, cut, current)
+        x_changed = numpy.flatnonzero(changed.any(axis=1))
+        y_changed = numpy.flatnonzero(changed.any(axis=0))
+        self._mark_dirty(x_start + x_changed[0], x_start + x_changed[-1] + 1,
+                y_start + y_changed[0], y_start + y_changed[-1] + 1)
+
+    def _get_tile_arrays(self, tile_x, tile_y):
+        size = self.TILE_SIZE
+        x_slice = slice(tile_x * size, min((tile_x + 1) * size + 1,
+                self.x_steps))
+        y_slice = slice(tile_y * size, min((tile_y + 1) * size + 1,
+                self.y_steps))
+        heights = self.heights[x_slice, y_slice]
+        width, height = heights.shape
+        if (width < 2) or (height < 2):
+            return None
+        x_grid, y_grid = numpy.meshgrid(self.x_values[x_slice],
+                self.y_values[y_slice], indexing="ij")
+        vertices = numpy.column_stack((x_grid.ravel(), y_grid.ravel(),
+                heights.ravel())).astype(numpy.float32)
+        # the normals are based on the slope of the surface
+        slope_x = numpy.gradient(heights, axis=0) / self.x_step_width
+        slope_y = numpy.gradient(heights, axis=1) / self.y_step_width
+        normals = numpy.column_stack((-slope_x.ravel(), -slope_y.ravel(),
+                numpy.ones(heights.size)))
+        normals /= numpy.sqrt((normals ** 2).sum(axis=1))[:, numpy.newaxis]
+        normals = normals.astype(numpy.float32)
+        # four corners of every quad (counter-clockwise seen from above)
+        corners = numpy.arange(heights.size).reshape(width, height)[:-1, :-1]
+        corners = corners.ravel()
+        quads = numpy.column_stack((corners, corners + height,
+                corners + height + 1, corners + 1)).astype(numpy.uint32)
+        return vertices, normals, quads.ravel()
+
+    def to_OpenGL(self):
+        if not GL_enabled:
+            return
+        for tile in self._dirty_tiles:
+            if tile in self._display_lists:
+                GL.glDeleteLists(self._display_lists.pop(tile), 1)
+            arrays = self._get_tile_arrays(*tile)
+            if arrays is None:
+                continue
+            vertices, normals, quads = arrays
+            display_list = GL.glGenLists(1)
+            GL.glNewList(display_list, GL.GL_COMPILE)
+            GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+            GL.glEnableClientState(GL.GL_NORMAL_ARRAY)
+            GL.glVertexPointer(3, GL.GL_FLOAT, 0, vertices)
+            GL.glNormalPointer(GL.GL_FLOAT, 0, normals)
+            GL.glDrawElements(GL.GL_QUADS, len(quads), GL.GL_UNSIGNED_INT,
+                    quads)
+            GL.glDisableClientState(GL.GL_NORMAL_ARRAY)
+            GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+            GL.glEndList()
+            self._display_lists[tile] = display_list
+        self._dirty_tiles.clear()
+        for display_list in self._display_lists.values():
+            GL.glCallList(display_list)
+
+    def get_removed_volume(self):
+        """ return the volume of the material removed so far """
+        return float((self.maxz - self.heights).sum()) \
+                * self.x_step_width * self.y_step_width
+
+    def get_material_report(self, model, gouge_tolerance=0.0, max_gouges=10):
+        """ compare the remaining material with the surface of a model
+
+        Only the cells covered by the model are taken into account.
+        @value model: the target shape of the workpiece
+        @type model: pycam.Geometry.Model.Model
+        @value gouge_tolerance: cells cut deeper than this distance below the
+            model surface are reported as gouges
+        @type gouge_tolerance: float
+        @value max_gouges: the maximum number of reported gouge locations
+        @type max_gouges: int
+        @returns: a dictionary with the following items: "removed_volume",
+            "max_residual" and "min_residual" (remaining material above the
+            model surface - negative values are gouges), "gouge_count" (the
+            number of gouged cells) and "gouges" (a list of (x, y, z, depth)
+            tuples - starting with the deepest gouge)
+        @rtype: dict
+        """
+        model_heights = get_model_heights(model, self.x_values, self.y_values)
+        covered = model_heights > -numpy.inf
+        result = {"removed_volume": self.get_removed_volume(),
+                "max_residual": None, "min_residual": None,
+                "gouge_count": 0, "gouges": []}
+        if not covered.any():
+            return result
+        residual = numpy.where(covered, self.heights - model_heights, 0)
+        result["max_residual"] = float(residual[covered].max())
+        result["min_residual"] = float(residual[covered].min())
+        gouged = covered & (residual < -gouge_tolerance)
+        result["gouge_count"] = int(gouged.sum())
+        if result["gouge_count"] > 0:
+            x_indices, y_indices = numpy.nonzero(gouged)
+            order = numpy.argsort(residual[gouged])[:max_gouges]
+            for x_index, y_index in zip(x_indices[order], y_indices[order]):
+                result["gouges"].append((float(self.x_values[x_index]),
+                        float(self.y_values[y_index]),
+                        float(self.heights[x_index, y_index]),
+                        -float(residual[x_index, y_index])))
+        return result
+
+    def get_stock_model(self):
+        """ return the remaining material as a closed triangle mesh
+
+        The top surface connects the centers of all cells (the outer ones are
+        moved to the border of the stock). It is closed by four walls and a bottom face at the lower limit of the stock.
+        @rtype: pycam.Geometry.Model.Model
+        """
+        x_count, y_count = self.x_steps, self.y_steps
+        if (x_count < 2) or (y_count < 2):
+            return None
+        # the outer cells are stretched to the limits of the stock
+        x_values = self.x_values.copy()
+        x_values[[0, -1]] = self.minx, self.maxx
+        y_values = self.y_values.copy()
+        y_values[[0, -1]] = self.miny, self.maxy
+        x_grid, y_grid = numpy.meshgrid(x_values, y_values, indexing="ij")
+        top = numpy.column_stack((x_grid.ravel(), y_grid.ravel(),
+                self.heights.ravel()))
+        bottom = top.copy()
+        bottom[:, 2] = self.minz
+        vertices = numpy.concatenate((top, bottom))
+        bottom_offset = len(top)
+        # two clockwise triangles for every cell of the grid
+        corners = numpy.arange(len(top)).reshape(x_count, y_count)
+        p1 = corners[:-1, :-1].ravel()
+        p2 = corners[:-1, 1:].ravel()
+        p3 = corners[1:, 1:].ravel()
+        p4 = corners[1:, :-1].ravel()
+        top_faces = numpy.concatenate((numpy.column_stack((p1, p2, p4)),
+                numpy.column_stack((p2, p3, p4))))
+        # the bottom faces down
+        bottom_faces = top_faces[:, ::-1] + bottom_offset
+        # the border of the grid (counter-clockwise seen from above)
+        border = numpy.concatenate((corners[:, 0], corners[-1, 1:],
+                corners[-2::-1, -1], corners[0, -2:0:-1], corners[:1, 0]))
+        start, end = border[:-1], border[1:]
+        wall_faces = numpy.concatenate((
+                numpy.column_stack((start, end, start + bottom_offset)),
+                numpy.column_stack((end, end + bottom_offset,
+                    start + bottom_offset))))
+        model = pycam.Geometry.Model.Model(use_kdtree=False, compact=True)
+        model.extend_arrays(vertices, numpy.concatenate((top_faces,
+                bottom_faces, wall_faces)))
+        return model
+
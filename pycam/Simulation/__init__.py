@@ -21,5 +21,5 @@ You should have received a copy of the GNU General Public License
 along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-__all__ = ['ZBuffer', 'ODEBlocks']
+__all__ = ['ZBuffer', 'ODEBlocks', 'HeightField']
 
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pycam
+import pycam.Geometry.Model
+import pycam.Utils.log
+import cPickle
+import hashlib
+import struct
+import os
+
+
+CACHE_DIR = "toolpath_cache"
+CACHE_FILE_SUFFIX = ".toolpath"
+# increase this number whenever the format of the cached data changes
+CACHE_FORMAT_VERSION = 1
+# default size limit of the cache (in bytes)
+DEFAULT_MAX_SIZE = 200 * 1024 * 1024
+# only these tool settings influence the shape of a toolpath
+TOOL_SETTINGS_KEYS = ("shape", "tool_radius", "torus_radius")
+
+
+log = pycam.Utils.log.get_logger()
+
+
+# model checksums indexed by the uuid of a model (changes with its geometry)
+_model_checksums = {}
+
+
+def get_model_checksum(model):
+    """ calculate a stable checksum of the geometry of a model
+
+    The uuid of a model changes with every modification - but it is not
+    stable between two program runs. Thus the checksum is based on the
+    coordinates of the model. It is calculated only once for every state of
+    the model.
+    """
+    if model is None:
+        return None
+    try:
+        return _model_checksums[model.uuid]
+    except (KeyError, AttributeError):
+        pass
+    checksum = hashlib.sha1(model.__class__.__name__)
+    pack_point = struct.Struct("<3d").pack
+    if isinstance(model, pycam.Geometry.Model.ContourModel):
+        for polygon in model.get_polygons():
+            checksum.update("polygon%d" % int(polygon.is_closed))
+            for point in polygon.get_points():
+                checksum.update(pack_point(point.x, point.y, point.z))
+    elif hasattr(model, "is_compact") and model.is_compact():
+        vertices, faces, normals = model.triangles().get_arrays()
+        checksum.update(vertices[faces].astype("<f8").tostring())
+    else:
+        for triangle in model.triangles():
+            for point in (triangle.p1, triangle.p2, triangle.p3):
+                checksum.update(pack_point(point.x, point.y, point.z))
+    result = checksum.hexdigest()
+    try:
+        _model_checksums[model.uuid] = result
+    except AttributeError:
+        pass
+    return result
+
+def get_toolpath_key(model, tool_settings, bounds, parameters,
+        support_model=None):
+    """ calculate the cache key for the toolpath of the given settings
+
+    @value model: the model used for the toolpath generation
+    @type model: pycam.Geometry.Model.Model
+    @value tool_settings: the settings of the tool (see
+        "pycam.Cutters.get_tool_from_settings")
+    @type tool_settings: dict
+    @value bounds: the absolute limits of the processing area (low, high)
+    @type bounds: tuple of two triples
+    @value parameters: all other parameters of the toolpath generation
+        (strategy, post-processor, material allowance, ...)
+    @type parameters: dict
+    @value support_model: the optional support grid
+    @type support_model: pycam.Geometry.Model.Model
+    @rtype: str
+    """
+    tool = [(key, tool_settings.get(key)) for key in TOOL_SETTINGS_KEYS]
+    low, high = bounds
+    # the toolpath generation of other program versions may differ
+    key_items = (CACHE_FORMAT_VERSION, pycam.VERSION,
+            get_model_checksum(model), get_model_checksum(support_model), tool,
+            tuple([float(value) for value in low]),
+            tuple([float(value) for value in high]),
+            sorted(parameters.items()))
+    return hashlib.sha1(repr(key_items)).hexdigest()
+
+
+class ToolpathCache(object):
+    """ a size-limited cache for toolpaths stored as files in a directory
+
+    Every toolpath is stored in a separate file named by its key (see
+    "get_toolpath_key"). The modification time of each file is updated
+    whenever it is used. The least recently used files are removed as soon
+    as the total size of the cache exceeds its limit.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _get_filename(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_SUFFIX)
+
+    def get(self, key):
+        """ return the cached toolpath or None """
+        filename = self._get_filename(key)
+        try:
+            cache_file = open(filename, "rb")
+        except IOError:
+            return None
+        try:
+            try:
+                toolpath = cPickle.load(cache_file)
+            finally:
+                cache_file.close()
+        except Exception, err_msg:
+            log.info("Removing invalid toolpath cache file '%s': %s" \
+                    % (filename, err_msg))
+            self._remove(filename)
+            return None
+        try:
+            # mark this item as recently used
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return toolpath
+
+    def put(self, key, toolpath):
+        """ store a toolpath and remove the least recently used items """
+        if self.max_size <= 0:
+            return
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError, err_msg:
+                log.info("Failed to create the toolpath cache directory " \
+                        + "'%s': %s" % (self.cache_dir, err_msg))
+                return
+        filename = self._get_filename(key)
+        # write to a temporary file first - other processes may read the cache
+        temp_filename = "%s.%d.tmp" % (filename, os.getpid())
+        try:
+            cache_file = open(temp_filename, "wb")
+            try:
+                cPickle.dump(toolpath, cache_file, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                cache_file.close()
+            if os.path.exists(filename):
+                # "rename" does not replace files on Windows
+                os.remove(filename)
+            os.rename(temp_filename, filename)
+        except (IOError, OSError, cPickle.PicklingError), err_msg:
+            log.info("Failed to store the toolpath in the cache: %s" \
+                    % err_msg)
+            self._remove(temp_filename)
+            return
+        self.shrink(keep=filename)
+
+    def shrink(self, keep=None):
+        """ remove the least recently used items exceeding the size limit """
+        items = []
+        total_size = 0
+        try:
+            filenames = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for filename in filenames:
+            if not filename.endswith(CACHE_FILE_SUFFIX):
+                continue
+            filename = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            total_size += stat.st_size
+            items.append((stat.st_mtime, stat.st_size, filename))
+        items.sort()
+        for mtime, size, filename in items:
+            if total_size <= self.max_size:
+                break
+            if filename == keep:
+                continue
+            self._remove(filename)
+            total_size -= size
+
+    def clear(self):
+        max_size = self.max_size
+        self.max_size = 0
+        self.shrink()
+        self.max_size = max_size
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def get_default_cache(max_size=DEFAULT_MAX_SIZE):
+    """ return the toolpath cache located in the user's config directory
+
+    @returns: the cache or None (if the config directory is not available)
+    @rtype: ToolpathCache
+    """
+    # imported here - "pycam.Gui.Settings" depends on "pycam.Toolpath"
+    import pycam.Gui.Settings
+    config_dir = pycam.Gui.Settings.get_config_dirname()
+    if config_dir is None:
+        return None
+    return ToolpathCache(os.path.join(config_dir, CACHE_DIR),
+            max_size=max_size)
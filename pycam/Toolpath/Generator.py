@@ -29,8 +29,10 @@ from pycam.Cutters.CylindricalCutter import CylindricalCutter
 import pycam.Cutters
 import pycam.Toolpath.SupportGrid
 import pycam.Toolpath.MotionGrid
+import pycam.Toolpath.Cache
 import pycam.Toolpath
 import pycam.Geometry.Model
+import pycam.Geometry.Polygon
 from pycam.Utils import ProgressCounter
 import pycam.Utils.log
 
@@ -45,7 +47,8 @@ PATH_POSTPROCESSORS = frozenset(("ContourCutter", "PathAccumulator",
 CALCULATION_BACKENDS = frozenset((None, "ODE"))
 
 
-def generate_toolpath_from_settings(model, tp_settings, callback=None):
+def generate_toolpath_from_settings(model, tp_settings, callback=None,
+        cache=None):
     process = tp_settings.get_process_settings()
     support_model = tp_settings.get_support_model()
     backend = tp_settings.get_calculation_backend()
@@ -55,14 +58,16 @@ def generate_toolpath_from_settings(model, tp_settings, callback=None):
             process["material_allowance"], process["overlap_percent"],
             process["step_down"], process["engrave_offset"],
             process["milling_style"], process["pocketing_type"],
-            support_model, backend, callback)
+            support_model, backend, callback, cache=cache,
+            surface_tolerance=process.get("surface_tolerance"))
 
 def generate_toolpath(model, tool_settings=None,
         bounds=None, direction="x",
         path_generator="DropCutter", path_postprocessor="ZigZagCutter",
         material_allowance=0, overlap_percent=0, step_down=0, engrave_offset=0,
         milling_style="ignore", pocketing_type="none",
-        support_model=None, calculation_backend=None, callback=None):
+        support_model=None, calculation_backend=None, callback=None,
+        cache=None, surface_tolerance=None):
     """ abstract interface for generating a toolpath
 
     @type model: pycam.Geometry.Model.Model
@@ -96,6 +101,13 @@ def generate_toolpath(model, tool_settings=None,
     @type calculation_backend: str | None
     @value calculation_backend: any member of the CALCULATION_BACKENDS set
         The default is the triangular collision detection.
+    @type cache: pycam.Toolpath.Cache.ToolpathCache | None
+    @value cache: the toolpath is taken from this cache (if available) or it
+        is added to the cache after its generation
+    @type surface_tolerance: float | None
+    @value surface_tolerance: the maximum distance between the toolpath and
+        the surface of the model (for DropCutter and PushCutter) - a default
+        is used if it is not given
     @rtype: pycam.Toolpath.Toolpath | str
     @return: the resulting toolpath object or an error string in case of invalid
         arguments
@@ -111,6 +123,23 @@ def generate_toolpath(model, tool_settings=None,
     bounds_low, bounds_high = bounds.get_absolute_limits()
     minx, miny, minz = [number(value) for value in bounds_low]
     maxx, maxy, maxz = [number(value) for value in bounds_high]
+    if not cache is None:
+        cache_key = pycam.Toolpath.Cache.get_toolpath_key(model,
+                tool_settings, (bounds_low, bounds_high),
+                {"direction": direction, "path_generator": path_generator,
+                    "path_postprocessor": path_postprocessor,
+                    "material_allowance": material_allowance,
+                    "overlap_percent": overlap_percent,
+                    "step_down": step_down, "engrave_offset": engrave_offset,
+                    "milling_style": milling_style,
+                    "pocketing_type": pocketing_type,
+                    "calculation_backend": calculation_backend,
+                    "surface_tolerance": surface_tolerance},
+                support_model=support_model)
+        toolpath = cache.get(cache_key)
+        if not toolpath is None:
+            log.info("Using the cached toolpath")
+            return toolpath
     # trimesh model or contour model?
     if isinstance(model, pycam.Geometry.Model.ContourModel):
         # contour model
@@ -139,7 +168,7 @@ def generate_toolpath(model, tool_settings=None,
             callback(text="Preparing contour model with offset ...")
         contour_model = contour_model.get_offset_model(engrave_offset,
                 callback=callback)
-        if contour_model:
+        if not contour_model:
             return "Failed to calculate offset polygons"
         if not callback is None:
             # reset percentage counter after the contour model calculation
@@ -193,12 +222,15 @@ def generate_toolpath(model, tool_settings=None,
                     "'holes', 'enclosed'): %s" % str(pocketing_type)
         # For now we use only the polygons that do not surround eny other
         # polygons. Sorry - the pocketing is currently very simple ...
+        tree = pycam.Geometry.Polygon.PolygonContainmentTree(
+                contour_model.get_polygons())
+        other_polygons = set(other_polygons)
         base_filtered_polygons = []
         for candidate in base_polygons:
             if callback and callback():
                 return "Interrupted"
-            for other in other_polygons:
-                if candidate.is_polygon_inside(other):
+            for child in tree.get_children(candidate):
+                if child in other_polygons:
                     break
             else:
                 base_filtered_polygons.append(candidate)
@@ -227,7 +259,7 @@ def generate_toolpath(model, tool_settings=None,
         # use minz/maxz of the contour model (in other words: ignore z)
         contour_model = contour_model.get_cropped_model(minx, maxx, miny, maxy,
                 contour_model.minz, contour_model.maxz)
-        if contour_model:
+        if not contour_model:
             return "No part of the contour model is within the bounding box."
     physics = _get_physics(trimesh_models, cutter, calculation_backend)
     if isinstance(physics, basestring):
@@ -241,6 +273,9 @@ def generate_toolpath(model, tool_settings=None,
     if (overlap < 0) or (overlap >= 1):
         return "Invalid overlap value (%f): should be greater or equal 0 " \
                 + "and lower than 1"
+    if (not surface_tolerance is None) and (surface_tolerance <= 0):
+        return "Invalid surface tolerance (%f): should be greater than 0" \
+                % surface_tolerance
     # factor "2" since we are based on radius instead of diameter
     line_stepping = 2 * number(tool_settings["tool_radius"]) * (1 - overlap)
     if path_generator == "PushCutter":
@@ -264,18 +299,22 @@ def generate_toolpath(model, tool_settings=None,
                 (bounds_low, bounds_high), layer_distance, line_stepping,
                 step_width=step_width, grid_direction=direction_dict[direction],
                 milling_style=milling_style_grid[milling_style])
-        if path_generator == "DropCutter":
-            toolpath = generator.GenerateToolPath(motion_grid, minz, maxz,
-                    callback)
-        else:
-            toolpath = generator.GenerateToolPath(motion_grid, callback)
+        toolpath = generator.GenerateToolPath(cutter, trimesh_models,
+                motion_grid, minz=minz, maxz=maxz, draw_callback=callback,
+                tolerance=surface_tolerance)
     elif path_generator == "EngraveCutter":
         if step_down > 0:
             dz = step_down
         else:
             dz = maxz - minz
-        toolpath = generator.GenerateToolPath(minz, maxz, step_width, dz,
-                callback)
+        # the pockets were added to the contour model above
+        motion_grid = pycam.Toolpath.MotionGrid.get_lines_grid(
+                [contour_model], (list(bounds_low), list(bounds_high)), dz,
+                line_distance=line_stepping, step_width=step_width,
+                milling_style=milling_style_grid[milling_style],
+                callback=callback)
+        toolpath = generator.GenerateToolPath(cutter, trimesh_models,
+                motion_grid, minz=minz, maxz=maxz, draw_callback=callback)
     elif path_generator == "ContourFollow":
         if step_down > 0:
             dz = step_down
@@ -283,11 +322,14 @@ def generate_toolpath(model, tool_settings=None,
             dz = maxz - minz
             if dz <= 0:
                 dz = 1
-        toolpath = generator.GenerateToolPath(minx, maxx, miny, maxy, minz,
-                maxz, dz, callback)
+        toolpath = generator.GenerateToolPath(cutter, trimesh_models, minx,
+                maxx, miny, maxy, minz, maxz, dz, draw_callback=callback)
     else:
         return "Invalid path generator (%s): not one of %s" \
                 % (path_generator, PATH_GENERATORS)
+    if (not cache is None) and toolpath \
+            and not isinstance(toolpath, basestring):
+        cache.put(cache_key, toolpath)
     return toolpath
     
 def _get_pathgenerator_instance(trimesh_models, contour_model, cutter,
@@ -304,8 +346,7 @@ def _get_pathgenerator_instance(trimesh_models, contour_model, cutter,
             return ("Invalid postprocessor (%s) for 'DropCutter': only " \
                     + "'ZigZagCutter' or 'PathAccumulator' are allowed") \
                     % str(pathprocessor)
-        return DropCutter.DropCutter(cutter, trimesh_models, processor,
-                physics=physics)
+        return DropCutter.DropCutter(processor, physics=physics)
     elif pathgenerator == "PushCutter":
         if pathprocessor == "PathAccumulator":
             processor = PathAccumulator.PathAccumulator()
@@ -321,10 +362,8 @@ def _get_pathgenerator_instance(trimesh_models, contour_model, cutter,
             return ("Invalid postprocessor (%s) for 'PushCutter' - it " + \
                     "should be one of these: %s") % \
                     (pathprocessor, PATH_POSTPROCESSORS)
-        return PushCutter.PushCutter(cutter, trimesh_models, processor,
-                physics=physics)
+        return PushCutter.PushCutter(processor, physics=physics)
     elif pathgenerator == "EngraveCutter":
-        clockwise = (milling_style == "climb")
         if pathprocessor == "SimpleCutter":
             processor = SimpleCutter.SimpleCutter()
         else:
@@ -333,8 +372,7 @@ def _get_pathgenerator_instance(trimesh_models, contour_model, cutter,
         if not contour_model:
             return "The 'Engraving' toolpath strategy requires a 2D contour " \
                     + "model (e.g. from a DXF or SVG file)."
-        return EngraveCutter.EngraveCutter(cutter, trimesh_models,
-                contour_model, processor, clockwise=clockwise, physics=physics)
+        return EngraveCutter.EngraveCutter(processor, physics=physics)
     elif pathgenerator == "ContourFollow":
         reverse = (milling_style == "conventional")
         if pathprocessor == "SimpleCutter":
@@ -346,8 +384,7 @@ def _get_pathgenerator_instance(trimesh_models, contour_model, cutter,
             log.warn("The ContourFollow strategy only works reliably with " + \
                     "the cylindrical cutter shape. Maybe you should use " + \
                     "the alternative ContourPolygon strategy instead.")
-        return ContourFollow.ContourFollow(cutter, trimesh_models, processor,
-                physics=physics)
+        return ContourFollow.ContourFollow(processor, physics=physics)
     else:
         return "Invalid path generator (%s): not one of %s" \
                 % (pathgenerator, PATH_GENERATORS)
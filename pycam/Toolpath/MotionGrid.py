@@ -23,7 +23,7 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 from pycam.Geometry.Point import Point, Vector
 from pycam.Geometry.Line import Line
 from pycam.Geometry.utils import epsilon
-from pycam.Geometry.Polygon import PolygonSorter
+from pycam.Geometry.Polygon import PolygonSorter, PolygonContainmentTree
 import pycam.Utils.log
 import pycam.Geometry
 
@@ -382,7 +382,7 @@ def get_lines_layer(lines, z, last_z=None, step_width=None,
                 points.append(next_point)
         yield points
 
-def _get_sorted_polygons(models, callback=None):
+def _get_sorted_polygons(models, callback=None, tree=None):
     # Sort the polygons according to their directions (first inside, then
     # outside. This reduces the problem of break-away pieces.
     inner_polys = []
@@ -393,16 +393,23 @@ def _get_sorted_polygons(models, callback=None):
                 inner_polys.append(poly)
             else:
                 outer_polys.append(poly)
-    inner_sorter = PolygonSorter(inner_polys, callback=callback)
-    outer_sorter = PolygonSorter(outer_polys, callback=callback)
+    if tree is None:
+        tree = PolygonContainmentTree(inner_polys + outer_polys)
+    inner_sorter = PolygonSorter(inner_polys, callback=callback, tree=tree)
+    outer_sorter = PolygonSorter(outer_polys, callback=callback, tree=tree)
     return inner_sorter.get_polygons() + outer_sorter.get_polygons()
 
 def get_lines_grid(models, (low, high), layer_distance, line_distance=None,
         step_width=None, milling_style=MILLING_STYLE_CONVENTIONAL,
         start_position=START_Z, pocketing_type=POCKETING_TYPE_NONE,
         callback=None):
+    # the nesting of all polygons is used for sorting and pocketing
+    all_polygons = []
+    for model in models:
+        all_polygons.extend(model.get_polygons())
+    tree = PolygonContainmentTree(all_polygons)
     # the lower limit is never below the model
-    polygons = _get_sorted_polygons(models, callback=callback)
+    polygons = _get_sorted_polygons(models, callback=callback, tree=tree)
     if polygons:
         low_limit_lines = min([polygon.minz for polygon in polygons])
         low[2] = max(low[2], low_limit_lines)
@@ -411,7 +418,7 @@ def get_lines_grid(models, (low, high), layer_distance, line_distance=None,
         if not callback is None:
             callback(text="Generating pocketing polygons ...")
         polygons = get_pocketing_polygons(polygons, line_distance,
-                pocketing_type, callback=callback)
+                pocketing_type, callback=callback, tree=tree)
     # extract lines in correct order from all polygons
     lines = []
     for polygon in polygons:
@@ -448,7 +455,8 @@ def get_lines_grid(models, (low, high), layer_distance, line_distance=None,
         yield get_lines_layer(lines, layers[-1], last_z=last_z,
                 step_width=step_width, milling_style=milling_style)
 
-def get_pocketing_polygons(polygons, offset, pocketing_type, callback=None):
+def get_pocketing_polygons(polygons, offset, pocketing_type, callback=None,
+        tree=None):
     pocketing_limit = 1000
     base_polygons = []
     other_polygons = []
@@ -471,13 +479,16 @@ def get_pocketing_polygons(polygons, offset, pocketing_type, callback=None):
         return polygons
     # For now we use only the polygons that do not surround any other
     # polygons. Sorry - the pocketing is currently very simple ...
+    if tree is None:
+        tree = PolygonContainmentTree(base_polygons + other_polygons)
+    other_polygons = set(other_polygons)
     base_filtered_polygons = []
     for candidate in base_polygons:
         if callback and callback():
             # we were interrupted
             return polygons
-        for other in other_polygons:
-            if candidate.is_polygon_inside(other):
+        for child in tree.get_children(candidate):
+            if child in other_polygons:
                 break
         else:
             base_filtered_polygons.append(candidate)
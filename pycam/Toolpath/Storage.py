@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2011 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+
+A compact binary file format for toolpaths:
+  - magic string (8 bytes): "PYCAMTP" followed by a zero byte
+  - header size (unsigned 32 bit integer, little endian)
+  - header: JSON encoded dictionary with the parameters of the toolpath
+    ("parameters"), the optional task settings ("settings" - see
+    "ToolpathSettings.get_string"), arbitrary meta data ("meta") and the
+    layout of the following arrays
+  - padding (up to the next multiple of 8 bytes)
+  - path offsets: "path_count + 1" unsigned 64 bit integers (little endian)
+    - path number "i" consists of the points "offsets[i]" to
+    "offsets[i + 1] - 1"
+  - points: "point_count" triples of little endian floats (32 or 64 bit)
+"""
+
+from pycam.Toolpath import Toolpath
+from pycam.Geometry.Path import Path
+from pycam.Geometry.Point import Point
+from pycam import VERSION
+import ConfigParser
+import array
+import json
+import struct
+import sys
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+
+MAGIC = "PYCAMTP\0"
+FORMAT_VERSION = 1
+PRECISIONS = {"single": ("f", "<f4"), "double": ("d", "<f8")}
+
+
+class ToolpathFormatError(Exception):
+    pass
+
+
+class MappedPaths(object):
+    """ a read-only list of paths based on arrays of offsets and points
+
+    The paths (and their points) are created on demand. The arrays may be
+    mapped from a file - thus only the used parts are read.
+    """
+
+    def __init__(self, offsets, points):
+        self._offsets = offsets
+        self._points = points
+        self._paths = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        path = self._paths[index]
+        if path is None:
+            path = Path()
+            start, end = self._offsets[index], self._offsets[index + 1]
+            for x, y, z in _get_rows(self._points, start, end):
+                path.append(Point(x, y, z))
+            self._paths[index] = path
+        return path
+
+    def get_arrays(self):
+        """ return the path offsets and the points (shape (N, 3)) """
+        return self._offsets, self._points
+
+
+def _get_rows(points, start, end):
+    if numpy_enabled and isinstance(points, numpy.ndarray):
+        return points[start:end].tolist()
+    else:
+        return [points[3 * index:3 * index + 3]
+                for index in xrange(start, end)]
+
+def _get_header(toolpath, precision, meta):
+    path_count = len(toolpath.paths)
+    if isinstance(toolpath.paths, MappedPaths):
+        offsets = toolpath.paths.get_arrays()[0]
+        point_count = int(offsets[-1])
+    else:
+        point_count = sum([len(path.points) for path in toolpath.paths])
+    all_meta = {"created_by": "PyCAM %s" % VERSION}
+    if meta:
+        all_meta.update(meta)
+    header = {"version": FORMAT_VERSION, "parameters": toolpath.get_params(),
+            "meta": all_meta, "precision": precision,
+            "path_count": path_count, "point_count": point_count}
+    settings = toolpath.get_toolpath_settings()
+    if not settings is None:
+        header["settings"] = settings.get_string()
+    return header
+
+def _get_toolpath_settings(text):
+    # imported here - "pycam.Gui.Settings" depends on "pycam.Toolpath"
+    import pycam.Gui.Settings
+    settings = pycam.Gui.Settings.ToolpathSettings()
+    try:
+        settings.parse(text)
+    except ConfigParser.Error, err_msg:
+        raise ToolpathFormatError("Invalid toolpath settings: %s" % err_msg)
+    return settings
+
+def write_toolpath(toolpath, stream, precision="double", meta=None):
+    """ store a toolpath in the binary format
+
+    @value toolpath: the toolpath to be stored
+    @type toolpath: pycam.Toolpath.Toolpath
+    @value stream: a file opened for writing (binary mode)
+    @type stream: file
+    @value precision: "single" (32 bit) or "double" (64 bit) floats
+    @type precision: str
+    @value meta: additional meta data (values must be suitable for JSON)
+    @type meta: dict
+    """
+    if not precision in PRECISIONS:
+        raise ValueError("Invalid precision of toolpath coordinates: %s" \
+                % str(precision))
+    header = json.dumps(_get_header(toolpath, precision, meta),
+            sort_keys=True)
+    stream.write(MAGIC)
+    stream.write(struct.pack("<I", len(header)))
+    stream.write(header)
+    position = len(MAGIC) + 4 + len(header)
+    stream.write("\0" * (-position % 8))
+    if isinstance(toolpath.paths, MappedPaths) and numpy_enabled:
+        # copy the arrays without creating any paths
+        offsets, points = toolpath.paths.get_arrays()
+        stream.write(numpy.asarray(offsets, dtype="<u8").tostring())
+        stream.write(numpy.asarray(points,
+                dtype=PRECISIONS[precision][1]).tostring())
+        return
+    offsets = [0]
+    for path in toolpath.paths:
+        offsets.append(offsets[-1] + len(path.points))
+    stream.write(struct.pack("<%dQ" % len(offsets), *offsets))
+    coords = array.array(PRECISIONS[precision][0])
+    for path in toolpath.paths:
+        for point in path.points:
+            coords.extend((point.x, point.y, point.z))
+        if len(coords) > 3 * 65536:
+            _write_coords(stream, coords)
+            coords = array.array(PRECISIONS[precision][0])
+    _write_coords(stream, coords)
+
+def _write_coords(stream, coords):
+    if sys.byteorder != "little":
+        coords.byteswap()
+    stream.write(coords.tostring())
+
+def read_header(stream):
+    """ read the header of a toolpath file
+
+    @value stream: a file opened for reading (binary mode) - its position
+        is moved to the start of the path offsets
+    @type stream: file
+    @returns: the header and the position of the path offsets within the file
+    @rtype: tuple(dict, int)
+    """
+    magic = stream.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ToolpathFormatError("This is not a PyCAM toolpath file.")
+    try:
+        header_size = struct.unpack("<I", stream.read(4))[0]
+        header = json.loads(stream.read(header_size))
+    except (struct.error, ValueError), err_msg:
+        raise ToolpathFormatError("Invalid toolpath file header: %s" \
+                % err_msg)
+    if header.get("version") != FORMAT_VERSION:
+        raise ToolpathFormatError("Unsupported version of toolpath file " \
+                + "format: %s" % str(header.get("version")))
+    position = len(MAGIC) + 4 + header_size
+    position += -position % 8
+    stream.seek(position)
+    return header, position
+
+def read_toolpath(filename, use_mmap=True):
+    """ load a toolpath stored via "write_toolpath"
+
+    The coordinates are mapped into memory (if numpy is available). The paths
+    and points are created only when they are accessed.
+    @value filename: the name of the toolpath file
+    @type filename: str
+    @value use_mmap: map the file into memory instead of reading it
+    @type use_mmap: bool
+    @returns: the toolpath and the meta data stored in the file
+    @rtype: tuple(pycam.Toolpath.Toolpath, dict)
+    """
+    stream = open(filename, "rb")
+    try:
+        header, position = read_header(stream)
+        path_count = int(header["path_count"])
+        point_count = int(header["point_count"])
+        code, dtype = PRECISIONS[header["precision"]]
+        points_position = position + 8 * (path_count + 1)
+        if numpy_enabled:
+            if use_mmap and (point_count > 0):
+                offsets = numpy.memmap(filename, dtype="<u8", mode="r",
+                        offset=position, shape=(path_count + 1,))
+                points = numpy.memmap(filename, dtype=dtype, mode="r",
+                        offset=points_position, shape=(point_count, 3))
+            else:
+                offsets = numpy.fromfile(stream, dtype="<u8",
+                        count=path_count + 1)
+                points = numpy.fromfile(stream, dtype=dtype,
+                        count=3 * point_count).reshape(-1, 3)
+            if (len(offsets) != path_count + 1) \
+                    or (len(points) != point_count):
+                raise ToolpathFormatError("The toolpath file is truncated.")
+            offsets = offsets.astype(numpy.int64)
+        else:
+            offsets = struct.unpack("<%dQ" % (path_count + 1),
+                    stream.read(8 * (path_count + 1)))
+            points = array.array(code)
+            points.fromfile(stream, 3 * point_count)
+            if sys.byteorder != "little":
+                points.byteswap()
+    except (KeyError, ValueError, EOFError, struct.error), err_msg:
+        raise ToolpathFormatError("Invalid toolpath file: %s" % err_msg)
+    finally:
+        stream.close()
+    # JSON delivers unicode keys
+    parameters = dict([(str(key), value)
+            for key, value in header["parameters"].iteritems()])
+    if "settings" in header:
+        settings = _get_toolpath_settings(str(header["settings"]))
+    else:
+        settings = None
+    toolpath = Toolpath(MappedPaths(offsets, points), parameters=parameters,
+            toolpath_settings=settings)
+    return toolpath, header["meta"]
+
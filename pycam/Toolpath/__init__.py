@@ -27,12 +27,23 @@ from pycam.Geometry.Path import Path
 from pycam.Geometry.Line import Line
 from pycam.Geometry.utils import number, epsilon
 import pycam.Utils.log
+import array
 import random
 import os
 
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
 log = pycam.Utils.log.get_logger()
 
 
+# number of z levels in the histogram of the toolpath statistics
+Z_HISTOGRAM_BINS = 20
+
+
 def _check_colinearity(p1, p2, p3):
     v1 = p2.sub(p1).normalized()
     v2 = p3.sub(p2).normalized()
@@ -62,14 +73,36 @@ def simplify_toolpath(path):
 
 class Toolpath(object):
 
-    def __init__(self, paths, parameters=None):
+    def __init__(self, paths, parameters=None, toolpath_settings=None):
+        self._move_table = None
+        self._statistics = None
         self.paths = paths
         if not parameters:
             parameters = {}
         self.parameters = parameters
+        # the settings used for generating this toolpath (if known)
+        self.toolpath_settings = toolpath_settings
         self._max_safe_distance = 2 * parameters.get("tool_radius", 0)
         self._feedrate = parameters.get("tool_feedrate", 300)
 
+    def _get_paths(self):
+        return self._paths
+
+    def _set_paths(self, paths):
+        self._paths = paths
+        self.reset_cache()
+
+    paths = property(_get_paths, _set_paths)
+
+    def reset_cache(self):
+        """ discard all data calculated from the paths
+
+        This happens automatically when "paths" is replaced. Call this function
+        after changing the paths in place.
+        """
+        self._move_table = None
+        self._statistics = None
+
     def get_params(self):
         return dict(self.parameters)
 
@@ -80,7 +113,8 @@ class Toolpath(object):
             for point in path.points:
                 new_path.append(point)
             new_paths.append(new_path)
-        return Toolpath(new_paths, parameters=self.get_params())
+        return Toolpath(new_paths, parameters=self.get_params(),
+                toolpath_settings=self.toolpath_settings)
 
     def _get_limit_generic(self, attr, func):
         path_min = []
@@ -113,50 +147,24 @@ class Toolpath(object):
     def maxz(self):
         return self._get_limit_generic("z", max)
 
+    def get_toolpath_settings(self):
+        return self.toolpath_settings
+
     def get_meta_data(self):
+        """ return the settings of the toolpath as a block of text
+
+        @returns: the text or None (if the settings are unknown)
+        @rtype: str
+        """
+        if self.toolpath_settings is None:
+            return None
         meta = self.toolpath_settings.get_string()
         start_marker = self.toolpath_settings.META_MARKER_START
         end_marker = self.toolpath_settings.META_MARKER_END
         return os.linesep.join((start_marker, meta, end_marker))
 
-    def get_moves(self, safety_height, max_movement=None):
-        class MoveContainer(object):
-            def __init__(self, max_movement):
-                self.max_movement = max_movement
-                self.moved_distance = 0
-                self.moves = []
-                self.last_pos = None
-                if max_movement is None:
-                    self.append = self.append_without_movement_limit
-                else:
-                    self.append = self.append_with_movement_limit
-            def append_with_movement_limit(self, new_position, rapid):
-                if self.last_pos is None:
-                    # first move with unknown start position - ignore it
-                    self.moves.append((new_position, rapid))
-                    self.last_pos = new_position
-                    return True
-                else:
-                    distance = new_position.sub(self.last_pos).norm
-                    if self.moved_distance + distance > self.max_movement:
-                        partial = (self.max_movement - self.moved_distance) / \
-                                distance
-                        partial_dest = self.last_pos.add(new_position.sub(
-                                self.last_pos).mul(partial))
-                        self.moves.append((partial_dest, rapid))
-                        self.last_pos = partial_dest
-                        # we are finished
-                        return False
-                    else:
-                        self.moves.append((new_position, rapid))
-                        self.moved_distance += distance
-                        self.last_pos = new_position
-                        return True
-            def append_without_movement_limit(self, new_position, rapid):
-                self.moves.append((new_position, rapid))
-                return True
+    def _iter_path_moves(self, safety_height):
         p_last = None
-        result = MoveContainer(max_movement)
         for path in self.paths:
             if not path:
                 # ignore empty paths
@@ -164,8 +172,7 @@ class Toolpath(object):
             p_next = path.points[0]
             if p_last is None:
                 p_last = Point(p_next.x, p_next.y, safety_height)
-                if not result.append(p_last, True):
-                    return result.moves
+                yield (p_last, True)
             if ((abs(p_last.x - p_next.x) > epsilon) \
                     or (abs(p_last.y - p_next.y) > epsilon)):
                 # Draw the connection between the last and the next path.
@@ -176,20 +183,181 @@ class Toolpath(object):
                     # The distance between these two points is too far.
                     # This condition helps to prevent moves up/down for
                     # adjacent lines.
-                    safety_last = Point(p_last.x, p_last.y, safety_height)
-                    safety_next = Point(p_next.x, p_next.y, safety_height)
-                    if not result.append(safety_last, True):
-                        return result.moves
-                    if not result.append(safety_next, True):
-                        return result.moves
+                    yield (Point(p_last.x, p_last.y, safety_height), True)
+                    yield (Point(p_next.x, p_next.y, safety_height), True)
             for p in path.points:
-                if not result.append(p, False):
-                    return result.moves
+                yield (p, False)
             p_last = path.points[-1]
         if not p_last is None:
-            p_last_safety = Point(p_last.x, p_last.y, safety_height)
-            result.append(p_last_safety, True)
-        return result.moves
+            yield (Point(p_last.x, p_last.y, safety_height), True)
+
+    def iter_moves(self, safety_height, max_movement=None):
+        """ generate the moves (position, rapid) of the toolpath one by one
+
+        @value safety_height: the height of rapid moves between paths
+        @type safety_height: float
+        @value max_movement: stop after moving the given distance - the last
+            move is shortened accordingly
+        @type max_movement: float
+        """
+        moved_distance = 0
+        last_pos = None
+        for new_position, rapid in self._iter_path_moves(safety_height):
+            if not (max_movement is None or last_pos is None):
+                # the first move has an unknown start position - ignore it
+                distance = new_position.sub(last_pos).norm
+                if moved_distance + distance > max_movement:
+                    partial = (max_movement - moved_distance) / distance
+                    yield (last_pos.add(new_position.sub(last_pos).mul(
+                            partial)), rapid)
+                    # we are finished
+                    return
+                moved_distance += distance
+            last_pos = new_position
+            yield (new_position, rapid)
+
+    def get_moves(self, safety_height, max_movement=None):
+        return list(self.iter_moves(safety_height, max_movement=max_movement))
+
+    def get_move_table(self, safety_height):
+        """ return all moves of the toolpath as arrays
+
+        The table is calculated only once and shared by all consumers - until
+        the paths or the safety height are changed.
+        @returns: the positions (array of shape (N, 3)) and the "rapid" flags
+            (boolean array of shape (N,)) - tuples of (x, y, z) tuples and
+            of flags without numpy
+        """
+        if (self._move_table is None) \
+                or (self._move_table[0] != safety_height):
+            if numpy_enabled:
+                coords = array.array("d")
+                rapids = array.array("b")
+                for position, rapid in self._iter_path_moves(safety_height):
+                    coords.extend((position.x, position.y, position.z))
+                    rapids.append(bool(rapid))
+                positions = numpy.frombuffer(coords,
+                        dtype=numpy.float64).reshape(-1, 3)
+                rapids = numpy.frombuffer(rapids,
+                        dtype=numpy.int8).astype(bool)
+                # avoid accidental changes of the shared table
+                positions.flags.writeable = False
+                rapids.flags.writeable = False
+            else:
+                positions = []
+                rapids = []
+                for position, rapid in self._iter_path_moves(safety_height):
+                    positions.append((position.x, position.y, position.z))
+                    rapids.append(bool(rapid))
+                positions, rapids = tuple(positions), tuple(rapids)
+            self._move_table = (safety_height, positions, rapids)
+        return self._move_table[1:]
+
+    def get_statistics(self, safety_height=0.0):
+        """ calculate various statistics of the machine moves
+
+        The result is calculated in a single pass and it is kept until the
+        paths or the safety height are changed.
+        @value safety_height: the safety height configured for this toolpath
+        @type safety_height: float
+        @returns: a dictionary with the following items:
+            "machine_time": the estimated processing time in minutes
+            "distance": the total movement distance
+            "cut_distance" / "rapid_distance": the distance of normal and
+                rapid moves
+            "axis_travel": the movement along the x, y and z axes
+            "min_feed_segment" / "max_feed_segment": the length of the
+                shortest and longest non-rapid move (None without such moves)
+            "z_histogram": a tuple of the z level boundaries (bins + 1 items)
+                and the distance of non-rapid moves within each z level
+                (based on the middle of each move)
+        @rtype: dict
+        """
+        safety_height = number(safety_height)
+        if (self._statistics is None) \
+                or (self._statistics[0] != safety_height):
+            if numpy_enabled:
+                statistics = self._get_statistics_numpy(safety_height)
+            else:
+                statistics = self._get_statistics_python(safety_height)
+            statistics["machine_time"] = statistics["distance"] \
+                    / self._feedrate
+            self._statistics = (safety_height, statistics)
+        return dict(self._statistics[1])
+
+    def _get_statistics_numpy(self, safety_height):
+        positions, rapids = self.get_move_table(safety_height)
+        deltas = numpy.diff(positions, axis=0)
+        lengths = numpy.sqrt((deltas ** 2).sum(axis=1))
+        # the "rapid" flag of a move belongs to its destination
+        segment_rapids = rapids[1:]
+        cut_lengths = lengths[~segment_rapids]
+        cut_z = (positions[:-1, 2] + positions[1:, 2])[~segment_rapids] / 2
+        if len(cut_lengths):
+            histogram = numpy.histogram(cut_z, bins=Z_HISTOGRAM_BINS,
+                    weights=cut_lengths)
+            z_histogram = (histogram[1].tolist(), histogram[0].tolist())
+            min_feed = float(cut_lengths.min())
+            max_feed = float(cut_lengths.max())
+        else:
+            z_histogram = ([], [])
+            min_feed, max_feed = None, None
+        cut_distance = float(cut_lengths.sum())
+        distance = float(lengths.sum())
+        return {"distance": distance,
+                "cut_distance": cut_distance,
+                "rapid_distance": float(lengths[segment_rapids].sum()),
+                "axis_travel": tuple(numpy.abs(deltas).sum(axis=0).tolist()) \
+                        if len(deltas) else (0.0, 0.0, 0.0),
+                "min_feed_segment": min_feed,
+                "max_feed_segment": max_feed,
+                "z_histogram": z_histogram}
+
+    def _get_statistics_python(self, safety_height):
+        distance = 0
+        rapid_distance = 0
+        axis_travel = [0, 0, 0]
+        cut_segments = []
+        current_position = None
+        for new_pos, rapid in self.iter_moves(safety_height):
+            if not current_position is None:
+                length = new_pos.sub(current_position).norm
+                distance += length
+                for index, attr in enumerate("xyz"):
+                    axis_travel[index] += abs(getattr(new_pos, attr) \
+                            - getattr(current_position, attr))
+                if rapid:
+                    rapid_distance += length
+                else:
+                    cut_segments.append(
+                            ((new_pos.z + current_position.z) / 2, length))
+            current_position = new_pos
+        if cut_segments:
+            lengths = [length for z, length in cut_segments]
+            low = min([z for z, length in cut_segments])
+            high = max([z for z, length in cut_segments])
+            if high == low:
+                # see numpy.histogram
+                low, high = low - 0.5, high + 0.5
+            width = float(high - low) / Z_HISTOGRAM_BINS
+            bins = [low + index * width
+                    for index in range(Z_HISTOGRAM_BINS)] + [high]
+            weights = [0] * Z_HISTOGRAM_BINS
+            for z, length in cut_segments:
+                index = min(int((z - low) / width), Z_HISTOGRAM_BINS - 1)
+                weights[index] += length
+            z_histogram = (bins, weights)
+            min_feed, max_feed = min(lengths), max(lengths)
+        else:
+            z_histogram = ([], [])
+            min_feed, max_feed = None, None
+        return {"distance": distance,
+                "cut_distance": distance - rapid_distance,
+                "rapid_distance": rapid_distance,
+                "axis_travel": tuple(axis_travel),
+                "min_feed_segment": min_feed,
+                "max_feed_segment": max_feed,
+                "z_histogram": z_histogram}
 
     def get_machine_time(self, safety_height=0.0):
         """ calculate an estimation of the time required for processing the
@@ -200,26 +368,10 @@ class Toolpath(object):
         @rtype: float
         @returns: the machine time used for processing the toolpath in minutes
         """
-        result = 0
-        safety_height = number(safety_height)
-        current_position = None
-        # go through all points of the path
-        for new_pos, rapid in self.get_moves(safety_height):
-            if not current_position is None:
-                result += new_pos.sub(current_position).norm / self._feedrate
-            current_position = new_pos
-        return result
+        return self.get_statistics(safety_height)["machine_time"]
 
     def get_machine_movement_distance(self, safety_height=0.0):
-        result = 0
-        safety_height = number(safety_height)
-        current_position = None
-        # go through all points of the path
-        for new_pos, rapid in self.get_moves(safety_height):
-            if not current_position is None:
-                result += new_pos.sub(current_position).norm
-            current_position = new_pos
-        return result
+        return self.get_statistics(safety_height)["distance"]
 
     def get_cropped_copy(self, polygons, callback=None):
         # create a deep copy of the current toolpath
@@ -23,6 +23,12 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 import math
 from math import sqrt
 
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
 # see BRL-CAD/src/libbn/poly.c
 
 EPSILON = 1e-4
@@ -175,6 +181,104 @@ def poly4_roots(a, b, c, d, e):
     else:
         return None
 
+def _max_root3_many(c1, c2, c3):
+    """ return the largest real root of "x^3 + c1*x^2 + c2*x + c3" for arrays
+    of coefficients (see "poly3_roots")
+    """
+    c1_3 = c1 * INV_3
+    a = c2 - c1 * c1_3
+    b = (2 * c1 * c1 * c1 - 9 * c1 * c2 + 27 * c3) * INV_27
+    delta = b * b * INV_4 + a * a * a * INV_27
+    # one real root
+    r_delta = numpy.sqrt(numpy.maximum(delta, 0))
+    single = numpy.cbrt(-INV_2 * b + r_delta) + numpy.cbrt(-INV_2 * b - r_delta)
+    # three real roots (two of them are identical for "delta == 0")
+    s = numpy.cbrt(-b * INV_2)
+    double = numpy.maximum(2 * s, -s)
+    fact = numpy.sqrt(numpy.maximum(-a * INV_3, 0))
+    f = -b * INV_2 / (-a * INV_3 * fact)
+    phi = numpy.arccos(numpy.clip(f, -1.0, 1.0)) * INV_3
+    cs_phi = numpy.cos(phi)
+    sn_phi_s3 = numpy.sin(phi) * SQRT3
+    triple = numpy.maximum(2 * fact * cs_phi,
+            numpy.maximum(fact * (sn_phi_s3 - cs_phi),
+                fact * (-sn_phi_s3 - cs_phi)))
+    return numpy.where(delta > 0, single,
+            numpy.where(delta == 0, double, triple)) - c1_3
+
+def _roots2_many(b, c, roots, valid):
+    """ store the real roots of "x^2 + b*x + c" in the two columns of "roots"
+
+    A slightly negative discriminant is caused by rounding errors of a double
+    root (e.g. of "(x+1)^2*(x-1)^2") - it is treated like zero.
+    """
+    d = b * b - 4 * c
+    q = numpy.sqrt(numpy.maximum(d, 0))
+    roots[:, 0] = numpy.where(valid & (d >= -SMALL), (-b - q) * INV_2,
+            numpy.nan)
+    roots[:, 1] = numpy.where(valid & (d > 0), (-b + q) * INV_2, numpy.nan)
+
+def poly4_roots_many(a, b, c, d, e, refine_steps=2):
+    """ calculate the real roots of many quartic equations at once
+
+    This is the array based equivalent of "poly4_roots" (it requires numpy).
+    Every root is refined by a few steps of the Newton-Raphson method
+    afterwards - this reduces the numerical errors of the closed-form solution.
+
+    @value a, b, c, d, e: the coefficients of "a*x^4 + b*x^3 + c*x^2 + d*x + e"
+        (the leading coefficients "a" must not be zero)
+    @type a, b, c, d, e: float or array of shape (N,)
+    @value refine_steps: the number of Newton-Raphson steps
+    @type refine_steps: int
+    @returns: the real roots - missing roots are NaN
+    @rtype: array of shape (N, 4)
+    """
+    a, b, c, d, e = numpy.broadcast_arrays(*[numpy.atleast_1d(value).astype(
+            numpy.float64) for value in (a, b, c, d, e)])
+    roots = numpy.empty((len(a), 4))
+    roots.fill(numpy.nan)
+    errors = numpy.seterr(all="ignore")
+    try:
+        c1 = b / a
+        c2 = c / a
+        c3 = d / a
+        c4 = e / a
+        U = _max_root3_many(-c2, c3 * c1 - 4 * c4,
+                -c3 * c3 - c4 * c1 * c1 + 4 * c4 * c2)
+        p = c1 * c1 * INV_4 + U - c2
+        U *= INV_2
+        q = U * U - c4
+        valid = (a != 0) & (p >= -SMALL) & (q >= -SMALL)
+        p = numpy.sqrt(numpy.maximum(p, 0))
+        q = numpy.sqrt(numpy.maximum(q, 0))
+        b1 = c1 * INV_2 - p
+        b2 = c1 * INV_2 + p
+        q1 = U - q
+        q2 = U + q
+        # find the matching combination of the two quadratic factors
+        first = numpy.abs(b1 * q2 + b2 * q1 - c3) < EPSILON
+        second = numpy.abs(b1 * q1 + b2 * q2 - c3) < EPSILON
+        valid &= first | second
+        _roots2_many(b1, numpy.where(first, q1, q2), roots[:, :2], valid)
+        _roots2_many(b2, numpy.where(first, q2, q1), roots[:, 2:], valid)
+        # polish the roots of the original polynomial
+        for step in range(refine_steps):
+            value = (((roots + c1[:, numpy.newaxis]) * roots
+                    + c2[:, numpy.newaxis]) * roots
+                    + c3[:, numpy.newaxis]) * roots + c4[:, numpy.newaxis]
+            slope = ((4 * roots + 3 * c1[:, numpy.newaxis]) * roots
+                    + 2 * c2[:, numpy.newaxis]) * roots + c3[:, numpy.newaxis]
+            improved = roots - value / slope
+            new_value = (((improved + c1[:, numpy.newaxis]) * improved
+                    + c2[:, numpy.newaxis]) * improved
+                    + c3[:, numpy.newaxis]) * improved + c4[:, numpy.newaxis]
+            # keep the previous value, if the step does not improve it
+            better = numpy.abs(new_value) < numpy.abs(value)
+            roots = numpy.where(better, improved, roots)
+    finally:
+        numpy.seterr(**errors)
+    return roots
+
 def test_poly1(a, b):
     roots = poly1_roots(a, b)
     print a, "*x+", b, "=0 ", roots
@@ -33,29 +33,52 @@ import uuid
 import time
 import os
 import sys
+import tempfile
+import atexit
+import collections
+import mmap
+import shutil
+import errno
+
+try:
+    import numpy
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
 
 
 log = pycam.Utils.log.get_logger()
 
 
 try:
-    from multiprocessing.managers import SyncManager as __SyncManager
+    from multiprocessing.managers import SyncManager as _SyncManager
 except ImportError:
     pass
 else:
     # this class definition needs to be at the top level - for pyinstaller
-    class TaskManager(__SyncManager):
+    class TaskManager(_SyncManager):
         @classmethod
         def _run_server(cls, *args):
             # make sure that the server ignores SIGINT (KeyboardInterrupt)
             signal.signal(signal.SIGINT, signal.SIG_IGN)
             # prevent connection errors to trigger exceptions
             try:
-                __SyncManager._run_server(*args)
+                _SyncManager._run_server(*args)
             except socket.error:
                 pass
 
 DEFAULT_PORT = 1250
+# the number of models kept in memory mapped files for local workers
+MAX_SHARED_MODELS = 4
+# The files of the shared models are stored in a temporary directory of each
+# process (followed by the process ID). Directories of processes that were
+# killed are removed by the next process.
+SHARED_MODELS_DIR_PREFIX = "pycam-models-"
+# Many items are processed within one task (a chunk) to reduce the
+# communication overhead. The size of the chunks is based on the measured
+# processing time of the items.
+TARGET_TASK_TIME = 0.3
+MAX_CHUNK_SIZE = 1000
 
 
 #TODO: create one or two classes for these functions (to get rid of the globals)
@@ -74,6 +97,12 @@ __closing = None
 __task_source_uuid = None
 __finished_jobs = []
 __issued_warnings = []
+# models stored in memory mapped files (SharedModelItemID) - newest last
+__shared_models = []
+# the process ID and the directory of the shared models of this process
+__shared_models_dir = None
+# the processing times of the local pool (see "ProcessStatistics")
+__local_statistics = None
 
 
 def run_in_parallel(*args, **kwargs):
@@ -420,50 +449,30 @@ def _handle_tasks(tasks, results, stats, cache, pending_tasks, closing):
                 last_worker_notification = time.time()
             start_time = time.time()
             try:
-                job_id, task_id, func, args = tasks.get(timeout=0.2)
+                # wait for new tasks - they are added while a job is running
+                job_id, task_id, func, args_chunk = tasks.get(timeout=2.0)
             except Queue.Empty:
-                time.sleep(1.8)
                 timeout_counter += 1
                 continue
             # TODO: if the client aborts/disconnects between "tasks.get" and
             # "pending_tasks.add", the task is lost. We should better use some
             # backup.
-            pending_tasks.add(job_id, task_id, (func, args))
-            log.debug("Worker %s processes %s / %s" % (name, job_id, task_id))
+            pending_tasks.add(job_id, task_id, (func, args_chunk))
+            log.debug("Worker %s processes %s / %s (%d items)" \
+                    % (name, job_id, task_id, len(args_chunk)))
             # reset the timeout counter, if we found another item in the queue
             timeout_counter = 0
-            real_args = []
-            for arg in args:
-                if isinstance(arg, ProcessDataCacheItemID):
-                    try:
-                        value = local_cache.get(arg)
-                    except KeyError:
-                        # TODO: we will break hard, if the item is expired
-                        value = cache.get(arg)
-                        local_cache.add(arg, value)
-                    real_args.append(value)
-                elif isinstance(arg, list) and [True for item in arg \
-                        if isinstance(item, ProcessDataCacheItemID)]:
-                    # check if any item in the list is cacheable
-                    args_list = []
-                    for item in arg:
-                        if isinstance(item, ProcessDataCacheItemID):
-                            try:
-                                value = local_cache.get(item)
-                            except KeyError:
-                                value = cache.get(item)
-                                local_cache.add(item, value)
-                            args_list.append(value)
-                        else:
-                            args_list.append(item)
-                    real_args.append(args_list)
-                else:
-                    real_args.append(arg)
+            args_chunk = [_resolve_task_args(args, local_cache, cache)
+                    for args in args_chunk]
             stats.add_transfer_time(name, time.time() - start_time)
             start_time = time.time()
-            results.put((job_id, task_id, func(real_args)))
+            chunk_results = [func(args) for args in args_chunk]
+            process_time = time.time() - start_time
+            results.put((job_id, task_id, chunk_results))
             pending_tasks.remove(job_id, task_id)
-            stats.add_process_time(name, time.time() - start_time)
+            stats.add_process_time(name, process_time)
+            stats.add_item_time(_get_function_key(func), process_time,
+                    len(args_chunk))
     except KeyboardInterrupt:
         pass
     log.debug("Worker thread finished after %d seconds of inactivity: %s" \
@@ -479,50 +488,27 @@ def run_in_parallel_remote(func, args_list, unordered=False,
     if __multiprocessing and not disable_multiprocessing:
         job_id = str(uuid.uuid1())
         log.debug("Starting parallel tasks: %s" % job_id)
+        _limit_shared_models()
         tasks_queue = __manager.tasks()
         results_queue = __manager.results()
         remote_cache = __manager.cache()
         stats = __manager.statistics()
         pending_tasks = __manager.pending_tasks()
-        # add all tasks of this job to the queue
-        for index, args in enumerate(args_list):
-            if callback:
-                callback()
-            start_time = time.time()
-            result_args = []
-            for arg in args:
-                # add the argument to the cache if possible
-                if hasattr(arg, "uuid"):
-                    data_uuid = ProcessDataCacheItemID(arg.uuid)
-                    if not remote_cache.contains(data_uuid):
-                        log.debug("Adding cache item for job %s: %s - %s" % \
-                                (job_id, arg.uuid, arg.__class__))
-                        remote_cache.add(data_uuid, arg)
-                    result_args.append(data_uuid)
-                elif isinstance(arg, (list, set, tuple)):
-                    # a list with - maybe containing cacheable items
-                    new_arg_list = []
-                    for item in arg:
-                        try:
-                            data_uuid = ProcessDataCacheItemID(item.uuid)
-                        except AttributeError:
-                            # non-cacheable item
-                            new_arg_list.append(item)
-                            continue
-                        if not remote_cache.contains(data_uuid):
-                            log.debug("Adding cache item from list for " \
-                                    + "job %s: %s - %s" \
-                                    % (job_id, item.uuid, item.__class__))
-                            remote_cache.add(data_uuid, item)
-                        new_arg_list.append(data_uuid)
-                    result_args.append(new_arg_list)
-                else:
-                    result_args.append(arg)
-            tasks_queue.put((job_id, index, func, result_args))
-            stats.add_queueing_time(__task_source_uuid,
-                    time.time() - start_time)
-        log.debug("Added %d tasks for job %s" % (len(args_list), job_id))
+        args_list = list(args_list)
+        func_key = _get_function_key(func)
+        # the number of (local and remote) workers
+        num_of_workers = max(1, __num_of_processes,
+                len(stats.get_worker_statistics()))
+        # Chunks are added while the results arrive. Thus the size of the
+        # chunks adapts to the processing time measured by the workers.
+        max_pending_chunks = 2 * num_of_workers
+        # the number of items and chunks submitted to the queue
+        queued_items = 0
+        queued_chunks = 0
+        received_chunks = set()
         result_buffer = {}
+        # the next chunk to be returned (ordered mode)
+        next_chunk = 0
         index = 0
         cancelled = False
         # wait for all results of this job
@@ -531,6 +517,24 @@ def run_in_parallel_remote(func, args_list, unordered=False,
                 # cancel requested
                 cancelled = True
                 break
+            # add more tasks to the queue
+            while (queued_items < len(args_list)) and \
+                    (queued_chunks - len(received_chunks) \
+                        < max_pending_chunks):
+                start_time = time.time()
+                chunk_size = _get_chunk_size(stats.get_item_time(func_key),
+                        len(args_list) - queued_items, num_of_workers)
+                args_chunk = [_cache_task_args(args, remote_cache, job_id)
+                        for args in args_list[queued_items:
+                            queued_items + chunk_size]]
+                tasks_queue.put((job_id, queued_chunks, func, args_chunk))
+                stats.add_queueing_time(__task_source_uuid,
+                        time.time() - start_time)
+                queued_items += len(args_chunk)
+                queued_chunks += 1
+                if queued_items == len(args_list):
+                    log.debug("Added %d tasks (%d chunks) for job %s" \
+                            % (len(args_list), queued_chunks, job_id))
             # re-inject stale tasks if necessary
             stale_task = pending_tasks.get_stale_task()
             if stale_task:
@@ -554,27 +558,28 @@ def run_in_parallel_remote(func, args_list, unordered=False,
                 result_job_id, task_id, result = results_queue.get(
                         timeout=1.0)
             except Queue.Empty:
-                time.sleep(1.0)
                 continue
             if result_job_id == job_id:
                 log.debug("Received the result of a task: %s / %s" % \
                         (job_id, task_id))
+                if task_id in received_chunks:
+                    # a re-injected stale task was processed twice
+                    continue
+                received_chunks.add(task_id)
                 try:
                     if unordered:
                         # just return the values in any order
-                        yield result
-                        index += 1
+                        for item in result:
+                            yield item
+                            index += 1
                     else:
+                        result_buffer[task_id] = result
                         # return the results in order (based on task_id)
-                        if task_id == index:
-                            yield result
-                            index += 1
-                            while index in result_buffer.keys():
-                                yield result_buffer[index]
-                                del result_buffer[index]
+                        while next_chunk in result_buffer:
+                            next_chunk += 1
+                            for item in result_buffer.pop(next_chunk - 1):
+                                yield item
                                 index += 1
-                        else:
-                            result_buffer[task_id] = result
                 except GeneratorExit:
                     # This exception is triggered when the caller stops
                     # requesting more items from the generator.
@@ -603,6 +608,69 @@ def run_in_parallel_remote(func, args_list, unordered=False,
         for args in args_list:
             yield func(args)
 
+def _cache_task_args(args, remote_cache, job_id):
+    """ replace all cacheable arguments of a task by their cache references
+    """
+    result_args = []
+    for arg in args:
+        # add the argument to the cache if possible
+        if hasattr(arg, "uuid"):
+            data_uuid = _get_shared_model_id(arg) \
+                    or ProcessDataCacheItemID(arg.uuid)
+            if not remote_cache.contains(data_uuid):
+                log.debug("Adding cache item for job %s: %s - %s" % \
+                        (job_id, arg.uuid, arg.__class__))
+                remote_cache.add(data_uuid, arg)
+            result_args.append(data_uuid)
+        elif isinstance(arg, (list, set, tuple)):
+            # a list with - maybe containing cacheable items
+            new_arg_list = []
+            for item in arg:
+                try:
+                    data_uuid = _get_shared_model_id(item) \
+                            or ProcessDataCacheItemID(item.uuid)
+                except AttributeError:
+                    # non-cacheable item
+                    new_arg_list.append(item)
+                    continue
+                if not remote_cache.contains(data_uuid):
+                    log.debug("Adding cache item from list for " \
+                            + "job %s: %s - %s" \
+                            % (job_id, item.uuid, item.__class__))
+                    remote_cache.add(data_uuid, item)
+                new_arg_list.append(data_uuid)
+            result_args.append(new_arg_list)
+        else:
+            result_args.append(arg)
+    return result_args
+
+def _get_function_key(func):
+    """ the name of a task function used for its processing statistics """
+    return "%s.%s" % (func.__module__, func.__name__)
+
+def _get_chunk_size(item_time, remaining, num_of_workers):
+    """ calculate the number of items to be processed within one task
+
+    @value item_time: the average processing time of one item (or None, if
+        it is unknown)
+    @type item_time: float
+    @value remaining: the number of items not submitted yet
+    @type remaining: int
+    @value num_of_workers: the number of processes working on the items
+    @type num_of_workers: int
+    @rtype: int
+    """
+    if item_time is None:
+        # measure the processing time of single items first
+        return 1
+    elif item_time > 0:
+        chunk_size = int(TARGET_TASK_TIME / item_time)
+    else:
+        chunk_size = MAX_CHUNK_SIZE
+    # keep enough chunks for all workers at the end of a job
+    balanced_size = remaining // (2 * num_of_workers)
+    return max(1, min(chunk_size, balanced_size, MAX_CHUNK_SIZE))
+
 def _cleanup_job(job_id, tasks_queue, pending_tasks, finished_jobs):
     # flush the task queue
     try:
@@ -633,30 +701,233 @@ def _cleanup_job(job_id, tasks_queue, pending_tasks, finished_jobs):
         finished_jobs.pop(0)
 
 
+
+def _get_shared_model_id(model):
+    """ store the arrays of a model in a memory mapped file
+
+    Local workers map this file instead of unpickling the model. The file is
+    written only once for every state (uuid) of the model. Other items
+    providing "get_shared_arrays" and "from_shared_arrays" (e.g. height maps)
+    are shared in the same way.
+    @returns: the reference to the shared model or None (if the item is not
+        a model or numpy is missing)
+    @rtype: SharedModelItemID
+    """
+    global __shared_models
+    # imported here to avoid circular imports
+    import pycam.Geometry.Model
+    if numpy_enabled \
+            and isinstance(model, pycam.Geometry.Model.CompositeModel):
+        members = [_get_shared_model_id(member) for member in model.models]
+        if None in members:
+            return None
+        return SharedCompositeItemID(model.uuid, members)
+    if (not numpy_enabled) or (not hasattr(model, "get_shared_arrays")) \
+            or (len(model) == 0):
+        return None
+    model_uuid = model.uuid
+    for item in __shared_models:
+        if item.value == model_uuid:
+            return item
+    try:
+        item = SharedModelItemID.create(model_uuid, model.get_shared_arrays(),
+                item_class=model.__class__)
+    except (IOError, OSError), err_msg:
+        log.info("Failed to store a model in a temporary file: %s" % err_msg)
+        return None
+    log.debug("Shared model %s via %s" % (model_uuid, item.filename))
+    __shared_models.append(item)
+    return item
+
+def _get_shared_models_dir():
+    """ return the temporary directory for the shared models of this process
+
+    The directory is created with the first shared model. Leftovers of
+    processes that were killed (thus they could not clean up) are removed
+    at the same time.
+    """
+    global __shared_models_dir
+    pid = os.getpid()
+    if (__shared_models_dir is None) or (__shared_models_dir[0] != pid):
+        _remove_stale_shared_models_dirs()
+        __shared_models_dir = (pid, tempfile.mkdtemp(
+                prefix="%s%d-" % (SHARED_MODELS_DIR_PREFIX, pid)))
+    return __shared_models_dir[1]
+
+def _remove_stale_shared_models_dirs():
+    """ remove the shared models directories of processes that are gone """
+    # "os.kill" would terminate the process on Windows
+    if os.name != "posix":
+        return
+    temp_dir = tempfile.gettempdir()
+    try:
+        names = os.listdir(temp_dir)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(SHARED_MODELS_DIR_PREFIX):
+            continue
+        try:
+            pid = int(name[len(SHARED_MODELS_DIR_PREFIX):].split("-")[0])
+        except ValueError:
+            continue
+        try:
+            # check if the process is still running
+            os.kill(pid, 0)
+        except OSError, err_msg:
+            if err_msg.errno == errno.ESRCH:
+                log.debug("Removing shared models of a stale process: %s" \
+                        % name)
+                shutil.rmtree(os.path.join(temp_dir, name), ignore_errors=True)
+
+def _limit_shared_models():
+    """ remove the oldest shared models exceeding MAX_SHARED_MODELS
+
+    This is called only before a job starts - thus the models of a running
+    job are never removed.
+    """
+    global __shared_models
+    while len(__shared_models) > MAX_SHARED_MODELS:
+        __shared_models.pop(0).remove()
+
+def _remove_shared_models():
+    global __shared_models, __shared_models_dir
+    while __shared_models:
+        __shared_models.pop().remove()
+    if (not __shared_models_dir is None) \
+            and (__shared_models_dir[0] == os.getpid()):
+        shutil.rmtree(__shared_models_dir[1], ignore_errors=True)
+        __shared_models_dir = None
+
+atexit.register(_remove_shared_models)
+
+def _share_task_args(args):
+    """ replace all models (even within lists) by references to their shared
+    copies (see L{_get_shared_model_id})
+    """
+    result = []
+    changed = False
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            shared_items = [_get_shared_model_id(item) for item in arg]
+            if [True for item in shared_items if item]:
+                arg = type(arg)([shared or item
+                        for shared, item in zip(shared_items, arg)])
+                changed = True
+        else:
+            shared = _get_shared_model_id(arg)
+            if shared:
+                arg = shared
+                changed = True
+        result.append(arg)
+    if changed:
+        return type(args)(result)
+    else:
+        return args
+
+def _get_cached_item(item, local_cache, remote_cache=None):
+    try:
+        return local_cache.get(item)
+    except KeyError:
+        pass
+    value = None
+    if isinstance(item, (SharedModelItemID, SharedCompositeItemID)):
+        value = item.load()
+    if value is None:
+        # TODO: we will break hard, if the item is expired
+        value = remote_cache.get(item)
+    local_cache.add(item, value)
+    return value
+
+def _resolve_task_args(args, local_cache, remote_cache=None):
+    """ replace the references to cached items by their values """
+    result = []
+    for arg in args:
+        if isinstance(arg, ProcessDataCacheItemID):
+            arg = _get_cached_item(arg, local_cache, remote_cache)
+        elif isinstance(arg, (list, tuple)) and [True for item in arg \
+                if isinstance(item, ProcessDataCacheItemID)]:
+            # check if any item in the list is cacheable
+            arg = type(arg)([_get_cached_item(item, local_cache, remote_cache)
+                    if isinstance(item, ProcessDataCacheItemID) else item
+                    for item in arg])
+        result.append(arg)
+    return type(args)(result)
+
+# the cache of a worker process of the local pool
+__pool_worker_cache = None
+
+# We need to use a global function here - otherwise it does not work with
+# the multiprocessing Pool.
+def _process_chunk((func, args_chunk)):
+    """ process multiple items within a worker of the local pool
+
+    @returns: the processing time and the list of results
+    """
+    global __pool_worker_cache
+    if __pool_worker_cache is None:
+        __pool_worker_cache = ProcessDataCache()
+    args_chunk = [_resolve_task_args(args, __pool_worker_cache)
+            for args in args_chunk]
+    start_time = time.time()
+    results = [func(args) for args in args_chunk]
+    return time.time() - start_time, results
+
 def run_in_parallel_local(func, args, unordered=False,
         disable_multiprocessing=False, callback=None):
-    global __multiprocessing, __num_of_processes
+    global __multiprocessing, __num_of_processes, __local_statistics
     if __multiprocessing is None:
         # threading was not configured before
         init_threading()
     if __multiprocessing and not disable_multiprocessing:
+        if __local_statistics is None:
+            __local_statistics = ProcessStatistics()
+        stats = __local_statistics
+        func_key = _get_function_key(func)
+        # Models are transferred via memory mapped files instead of pickling
+        # them for every task.
+        _limit_shared_models()
+        args = [_share_task_args(arg) for arg in args]
+        # Chunks are submitted while the results arrive. Thus the size of
+        # the chunks adapts to the measured processing time.
+        max_pending_chunks = 2 * __num_of_processes
+        pending = collections.deque()
+        queued_items = [0]
+        def add_chunks():
+            while (queued_items[0] < len(args)) \
+                    and (len(pending) < max_pending_chunks):
+                chunk_size = _get_chunk_size(stats.get_item_time(func_key),
+                        len(args) - queued_items[0], __num_of_processes)
+                args_chunk = args[queued_items[0]:queued_items[0] + chunk_size]
+                pending.append(pool.apply_async(_process_chunk,
+                        ((func, args_chunk), )))
+                queued_items[0] += len(args_chunk)
         # use the number of CPUs as the default number of worker threads
         pool = __multiprocessing.Pool(__num_of_processes)
-        if unordered:
-            imap_func = pool.imap_unordered
-        else:
-            imap_func = pool.imap
         # We need to use try/finally here to ensure the garbage collection
         # of "pool". Otherwise a memory overflow is caused for Python 2.7.
         try:
-            # Beware: we may not return "pool.imap" or "pool.imap_unordered"
-            # directly. It would somehow loose the focus and just hang infinitely.
-            # Thus we wrap our own generator around it.
-            for result in imap_func(func, args):
-                if callback and callback():
-                    # cancel requested
-                    break
-                yield result
+            add_chunks()
+            while pending:
+                if unordered:
+                    # pick any finished chunk
+                    finished = [chunk for chunk in pending if chunk.ready()]
+                    if not finished:
+                        pending[0].wait(0.01)
+                        continue
+                    chunk = finished[0]
+                    pending.remove(chunk)
+                else:
+                    chunk = pending.popleft()
+                process_time, results = chunk.get()
+                stats.add_item_time(func_key, process_time, len(results))
+                # keep the workers busy while the results are processed
+                add_chunks()
+                for result in results:
+                    if callback and callback():
+                        # cancel requested
+                        return
+                    yield result
         finally:
             pool.terminate()
     else:
@@ -698,10 +969,15 @@ class OneProcess(object):
 
 class ProcessStatistics(object):
 
+    # the weight of previous measurements for "get_item_time"
+    ITEM_TIME_DECAY = 0.8
+
     def __init__(self, timeout=120):
         self.processes = {}
         self.queues = {}
         self.workers = {}
+        # total processing time and number of items for each task function
+        self.item_times = {}
         self.timeout = timeout
 
     def __str__(self):
@@ -740,6 +1016,24 @@ class ProcessStatistics(object):
         self.queues[name].transfer_count += 1
         self.queues[name].transfer_time += amount
 
+    def add_item_time(self, key, amount, count):
+        """ store the processing time of a number of items processed by
+        the same function (see "get_item_time")
+        """
+        total_time, total_count = self.item_times.get(key, (0, 0))
+        # older measurements lose their weight
+        self.item_times[key] = (total_time * self.ITEM_TIME_DECAY + amount,
+                total_count * self.ITEM_TIME_DECAY + count)
+
+    def get_item_time(self, key):
+        """ return the (recent) average processing time of an item or None
+        """
+        try:
+            total_time, total_count = self.item_times[key]
+        except KeyError:
+            return None
+        return total_time / max(1, total_count)
+
     def worker_notification(self, name):
         timestamp = time.time()
         self.workers[name] = timestamp
@@ -878,3 +1172,116 @@ class ProcessDataCacheItemID(object):
     def __init__(self, value):
         self.value = value
 
+
+class SharedModelItemID(ProcessDataCacheItemID):
+    """ reference to a model stored in a memory mapped file
+
+    Workers on the same host map the arrays of the model (see
+    L{pycam.Geometry.Model.Model.get_shared_arrays}) without copying or
+    unpickling them. Other workers receive the model via the data cache of
+    the manager (just like for any other L{ProcessDataCacheItemID}).
+    """
+
+    # all arrays within the file start at a multiple of this value
+    ALIGNMENT = 16
+
+    def __init__(self, value, filename, layout, item_class=None):
+        super(SharedModelItemID, self).__init__(value)
+        self.filename = filename
+        self.layout = layout
+        # the class providing "from_shared_arrays" (default: Model)
+        self.item_class = item_class
+        self.hostname = platform.node()
+        # only the creator of the file may remove it
+        self.owner = os.getpid()
+
+    @classmethod
+    def create(cls, value, arrays, item_class=None):
+        """ write the arrays of a model to a new temporary file """
+        handle, filename = tempfile.mkstemp(prefix="pycam-", suffix=".model",
+                dir=_get_shared_models_dir())
+        layout = []
+        offset = 0
+        try:
+            shared_file = os.fdopen(handle, "wb")
+            try:
+                for name, values in sorted(arrays.items()):
+                    values = numpy.ascontiguousarray(values)
+                    layout.append((name, values.dtype.str, values.shape,
+                            offset))
+                    values.tofile(shared_file)
+                    offset += values.nbytes
+                    padding = -offset % cls.ALIGNMENT
+                    shared_file.write("\0" * padding)
+                    offset += padding
+            finally:
+                shared_file.close()
+        except (IOError, OSError):
+            os.remove(filename)
+            raise
+        return cls(value, filename, layout, item_class=item_class)
+
+    def load(self):
+        """ map the model into memory
+
+        @returns: the model or None (if the file is not accessible)
+        @rtype: pycam.Geometry.Model.Model
+        """
+        if (not numpy_enabled) or (self.hostname != platform.node()):
+            return None
+        try:
+            shared_file = open(self.filename, "rb")
+            try:
+                data = mmap.mmap(shared_file.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+            finally:
+                shared_file.close()
+        except (IOError, OSError, mmap.error):
+            return None
+        arrays = {}
+        for name, dtype, shape, offset in self.layout:
+            count = 1
+            for size in shape:
+                count *= size
+            arrays[name] = numpy.frombuffer(data, dtype=dtype, count=count,
+                    offset=offset).reshape(shape)
+        item_class = self.item_class
+        if item_class is None:
+            # imported here to avoid circular imports
+            import pycam.Geometry.Model
+            item_class = pycam.Geometry.Model.Model
+        return item_class.from_shared_arrays(arrays, model_uuid=self.value)
+
+    def remove(self):
+        if self.owner != os.getpid():
+            return
+        try:
+            os.remove(self.filename)
+        except OSError:
+            # e.g. Windows refuses to remove files that are still mapped
+            pass
+
+
+class SharedCompositeItemID(ProcessDataCacheItemID):
+    """ reference to a composite model consisting of shared models
+
+    The models are mapped separately (see L{SharedModelItemID}). Thus a
+    model combined with different other models is stored only once.
+    """
+
+    def __init__(self, value, members):
+        super(SharedCompositeItemID, self).__init__(value)
+        self.members = members
+
+    def load(self):
+        """ map the models into memory and combine them
+
+        @returns: the composite model or None (if a model is not accessible)
+        @rtype: pycam.Geometry.Model.CompositeModel
+        """
+        models = [member.load() for member in self.members]
+        if None in models:
+            return None
+        # imported here to avoid circular imports
+        import pycam.Geometry.Model
+        return pycam.Geometry.Model.CompositeModel(models)